@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+from symphonia.text import normalize_text
+
+
+def fill_username_normalized(apps, schema_editor):
+    UserProfile = apps.get_model('authentication', 'UserProfile')
+    profiles = list(UserProfile.objects.select_related('user'))
+    for profile in profiles:
+        profile.username_normalized = normalize_text(profile.user.username)
+    UserProfile.objects.bulk_update(profiles, ['username_normalized'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0011_normalize_email_field'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='username_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=150),
+        ),
+        migrations.RunPython(fill_username_normalized, migrations.RunPython.noop),
+    ]
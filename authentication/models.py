@@ -6,6 +6,10 @@ from django.dispatch import receiver
 import os
 from uuid import uuid4
 
+from library import thumbnails
+from library.signed_media import signed_url
+from symphonia.text import normalize_text
+
 def user_profile_picture_path(instance, filename):
     """
     Generate file path for user profile picture.
@@ -26,6 +30,8 @@ class UserProfile(models.Model):
     ]
     
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
+    # Accent-stripped, case-folded copy of user.username for search
+    username_normalized = models.CharField(max_length=150, blank=True, editable=False, db_index=True)
     profile_picture = models.ImageField(upload_to=user_profile_picture_path, blank=True, null=True)
     first_name = models.CharField(max_length=150, blank=True)
     last_name = models.CharField(max_length=150, blank=True)
@@ -39,6 +45,10 @@ class UserProfile(models.Model):
         # Convert empty email string to None to ensure unique constraint works properly
         if self.email == '':
             self.email = None
+        self.username_normalized = normalize_text(self.user.username)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'username_normalized'}
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -48,10 +58,14 @@ class UserProfile(models.Model):
     @property
     def profile_picture_url(self):
         if self.profile_picture:
-            return self.profile_picture.url
+            return signed_url(self.profile_picture)
         # Return None if no profile picture is set - let frontend handle default
         return None
 
+    @property
+    def profile_picture_thumbnails(self):
+        return thumbnails.urls(self.profile_picture)
+
 # Add method to User model to get profile picture
 def get_profile_picture_url(self):
     try:
@@ -108,6 +122,29 @@ User.add_to_class(
         else "none"
     )
 )
+
+def get_friend_statuses(self, users):
+    """
+    Batched get_friend_status: map each user's id to its relationship status
+    with self, using one query per relationship kind however many users there are.
+    """
+    ids = [user.id for user in users]
+    statuses = dict.fromkeys(ids, "none")
+    if not ids:
+        return statuses
+
+    for sender_id in FriendRequest.objects.filter(sender_id__in=ids, receiver=self).values_list('sender_id', flat=True):
+        statuses[sender_id] = "pending_received"
+    for receiver_id in FriendRequest.objects.filter(sender=self, receiver_id__in=ids).values_list('receiver_id', flat=True):
+        statuses[receiver_id] = "pending_sent"
+    friendships = Friendship.objects.filter(
+        Q(user1=self, user2_id__in=ids) | Q(user1_id__in=ids, user2=self)
+    ).values_list('user1_id', 'user2_id')
+    for user1_id, user2_id in friendships:
+        statuses[user2_id if user1_id == self.id else user1_id] = "friend"
+    return statuses
+
+User.add_to_class('get_friend_statuses', get_friend_statuses)
 User.add_to_class(
     'is_friend_with',
     lambda self, user: (
@@ -239,4 +276,10 @@ def save_user_profile(sender, instance, **kwargs):
             birth_date='2000-01-01',
             email=None,  # để trống
             profile_picture=None  # để trống (avatar)
-        )
\ No newline at end of file
+        )
+
+# Make the fixed-size thumbnails of new profile pictures
+@receiver(post_save, sender=UserProfile)
+def make_profile_picture_thumbnails(sender, instance, raw=False, **kwargs):
+    if not raw:
+        thumbnails.generate_for(instance)
@@ -1,3 +1,43 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
 
-# Create your tests here.
+from .models import Friendship, FriendRequest
+
+
+class FriendStatusTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.me = User.objects.create_user('me')
+        cls.friend, cls.sent, cls.received, cls.stranger = [
+            User.objects.create_user(username) for username in ('friend', 'sent', 'received', 'stranger')
+        ]
+        Friendship.objects.create(user1=cls.me, user2=cls.friend)
+        # bulk_create skips FriendRequest.save(), which would turn a request
+        # in both directions into a friendship, to overlap every kind
+        FriendRequest.objects.bulk_create([
+            FriendRequest(sender=cls.me, receiver=cls.friend),
+            FriendRequest(sender=cls.friend, receiver=cls.me),
+            FriendRequest(sender=cls.me, receiver=cls.sent),
+            FriendRequest(sender=cls.sent, receiver=cls.me),
+            FriendRequest(sender=cls.received, receiver=cls.me),
+        ])
+
+    def test_batched_statuses_match_the_single_lookup(self):
+        users = [self.friend, self.sent, self.received, self.stranger]
+        statuses = self.me.get_friend_statuses(users)
+        self.assertEqual(statuses, {
+            self.friend.id: 'friend',
+            self.sent.id: 'pending_sent',
+            self.received.id: 'pending_received',
+            self.stranger.id: 'none',
+        })
+        self.assertEqual(statuses, {user.id: self.me.get_friend_status(user) for user in users})
+
+    def test_query_count_does_not_grow_with_the_users(self):
+        with self.assertNumQueries(3):
+            self.me.get_friend_statuses([self.friend])
+        more = [User.objects.create_user(f'user{i}') for i in range(10)]
+        with self.assertNumQueries(3):
+            self.me.get_friend_statuses([self.friend, self.sent, *more])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.me.get_friend_statuses([]), {})
@@ -2,7 +2,7 @@ from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView, TokenVerifyView
 
 from authentication.views import RegisterUserAPIView, SearchUserAPIView, GetUserInfoAPIView, GetUserIDFromUsernameAPIView
-from authentication.views import FriendRequestAPIView, ResponseFriendRequestAPIView, UnfriendAPIView, UpdateProfilePictureAPIView, UpdateUserProfileAPIView, ChangePasswordAPIView
+from authentication.views import FriendRequestAPIView, ResponseFriendRequestAPIView, UnfriendAPIView, UpdateProfilePictureAPIView, UpdateUserProfileAPIView, ChangePasswordAPIView, ProfilePictureAPIView
 
 
 urlpatterns = [
@@ -20,6 +20,7 @@ urlpatterns = [
     path('response_friend_request/', ResponseFriendRequestAPIView.as_view(), name='response_friend_request'),
     path('unfriend/', UnfriendAPIView.as_view(), name='unfriend'),
     path('update_profile_picture/', UpdateProfilePictureAPIView.as_view(), name='update_profile_picture'),
+    path('profile_picture/<int:user_id>/', ProfilePictureAPIView.as_view(), name='profile_picture'),
     path('update_profile/', UpdateUserProfileAPIView.as_view(), name='update_user_profile'),
     path('change-password/', ChangePasswordAPIView.as_view(), name='change_password'),
 ]
@@ -1,10 +1,18 @@
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+from django.db.models import Q
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.parsers import MultiPartParser, FormParser
 
+from library import search
+from library.media_delivery import media_response
+from library.streaming import StreamContentNegotiation
+from library.utils import in_rank_order
+from symphonia.text import normalize_text
+
 from .models import Friendship, FriendRequest, UserProfile
 from .serializers import RegisterUserSerializer, UserProfilePictureSerializer, UserProfileSerializer
 
@@ -57,7 +65,8 @@ class UpdateProfilePictureAPIView(APIView):
             serializer.save()
             return Response({
                 "message": "Profile picture updated successfully",
-                "profile_picture_url": profile.profile_picture_url
+                "profile_picture_url": profile.profile_picture_url,
+                "profile_picture_thumbnails": profile.profile_picture_thumbnails,
             }, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -81,6 +90,37 @@ class UpdateProfilePictureAPIView(APIView):
         except UserProfile.DoesNotExist:
             return Response({"error": "User profile not found"}, status=status.HTTP_404_NOT_FOUND)
 
+class ProfilePictureAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+    content_negotiation_class = StreamContentNegotiation
+
+    def get(self, request, user_id):
+        """
+        Profile picture image of a user, for signed-in users
+        Usage: GET /api/auth/profile_picture/{user_id}/
+        """
+        profile = UserProfile.objects.filter(user_id=user_id).first()
+        return media_response(request, profile.profile_picture if profile else None, 'User has no profile picture')
+
+def profile_picture_url(user):
+    """
+    Profile picture URL from an already loaded profile (see select_related),
+    without the lazy profile creation done by get_profile_picture_url
+    """
+    try:
+        return user.profile.profile_picture_url
+    except UserProfile.DoesNotExist:
+        return None
+
+def profile_picture_thumbnails(user):
+    """
+    Profile picture thumbnail URLs by size, like profile_picture_url
+    """
+    try:
+        return user.profile.profile_picture_thumbnails
+    except UserProfile.DoesNotExist:
+        return None
+
 class SearchUserAPIView(APIView):
     def get(self, request):
         user = request.user
@@ -89,25 +129,30 @@ class SearchUserAPIView(APIView):
         if not query:
             return Response({"error": "query parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
         
-        results = User.objects.filter(username__icontains=query)
-        
-        if user.is_authenticated:
-            results = results.exclude(id=user.id)
-            results = results[:max_results]  # Limit to max_results
-            user_data = [{
-                "id": result.id, 
-                "username": result.username, 
-                "relationships_status": user.get_friend_status(result),
-                "profile_picture_url": result.get_profile_picture_url()
-            } for result in results]
+        if search.is_available() and len(normalize_text(query)) >= 3:
+            # Accentless and typo-tolerant matches through the trigram index.
+            # Fetch one extra id in case the requesting user is among them.
+            ids = search.find_ids(search.KIND_USER, query, max_results + 1)
+            if user.is_authenticated:
+                ids = [user_id for user_id in ids if user_id != user.id]
+            results = in_rank_order(User.objects.select_related('profile'), ids[:max_results])
         else:
-            results = results[:max_results]  # Also limit results for unauthenticated users
-            user_data = [{
-                "id": result.id, 
-                "username": result.username,
-                "relationships_status": "none",
-                "profile_picture_url": result.get_profile_picture_url()
-            } for result in results]
+            results = User.objects.select_related('profile').filter(
+                Q(username__icontains=query) | Q(profile__username_normalized__contains=normalize_text(query))
+            )
+            if user.is_authenticated:
+                results = results.exclude(id=user.id)
+            results = list(results[:max_results])  # Limit to max_results
+        
+        # Resolve every relationship status of the page at once
+        statuses = user.get_friend_statuses(results) if user.is_authenticated else {}
+        user_data = [{
+            "id": result.id, 
+            "username": result.username, 
+            "relationships_status": statuses.get(result.id, "none"),
+            "profile_picture_url": profile_picture_url(result),
+            "profile_picture_thumbnails": profile_picture_thumbnails(result),
+        } for result in results]
         
         return Response(user_data, status=status.HTTP_200_OK)
 
@@ -133,6 +178,7 @@ class GetUserInfoAPIView(APIView):
                     "gender": profile.gender,
                     "birth_date": profile.birth_date,
                     "profile_picture_url": profile_picture_url,
+                    "profile_picture_thumbnails": profile.profile_picture_thumbnails,
                     "relationships_status": "none"
                 }
             except UserProfile.DoesNotExist:
@@ -155,6 +201,7 @@ class GetUserInfoAPIView(APIView):
                     "gender": profile.gender,
                     "birth_date": profile.birth_date,
                     "profile_picture_url": profile_picture_url,
+                    "profile_picture_thumbnails": profile.profile_picture_thumbnails,
                     "relationships_status": "none"
                 }
         else:
@@ -177,6 +224,7 @@ class GetUserInfoAPIView(APIView):
                     "gender": profile.gender,
                     "birth_date": profile.birth_date,
                     "profile_picture_url": profile_picture_url,
+                    "profile_picture_thumbnails": profile.profile_picture_thumbnails,
                     "relationships_status": user.get_friend_status(requested_user)
                 }
             except UserProfile.DoesNotExist:
@@ -199,6 +247,7 @@ class GetUserInfoAPIView(APIView):
                     "gender": profile.gender,
                     "birth_date": profile.birth_date,
                     "profile_picture_url": profile_picture_url,
+                    "profile_picture_thumbnails": profile.profile_picture_thumbnails,
                     "relationships_status": user.get_friend_status(requested_user)
                 }
         
@@ -1,6 +1,15 @@
 from django.contrib import admin
 
-from .models import Song, Artist, Album, Playlist, ListeningHistory
+from .models import Song, Artist, Album, Playlist, ListeningHistory, AudioFileMetadata, AudioJob
+
+class AudioFileMetadataInline(admin.TabularInline):
+    model = AudioFileMetadata
+    extra = 0
+    can_delete = False
+    readonly_fields = ['quality', 'file_name', 'size', 'duration', 'bitrate', 'codec', 'checksum', 'updated_at']
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 @admin.register(Song)
 class SongAdmin(admin.ModelAdmin):
@@ -8,6 +17,7 @@ class SongAdmin(admin.ModelAdmin):
     list_filter = ['release_date']
     search_fields = ['title', 'artist__name']
     filter_horizontal = ['artist', 'album', 'liked_by']
+    inlines = [AudioFileMetadataInline]
     
     fieldsets = (
         ('Basic Information', {
@@ -66,3 +76,10 @@ class ListeningHistoryAdmin(admin.ModelAdmin):
     list_display = ['user', 'song', 'position', 'updated_at']
     list_filter = ['updated_at']
     search_fields = ['user__username', 'song__title']
+
+@admin.register(AudioJob)
+class AudioJobAdmin(admin.ModelAdmin):
+    list_display = ['song', 'target_quality', 'source_quality', 'status', 'attempts', 'elapsed', 'created_at', 'finished_at']
+    list_filter = ['status', 'target_quality']
+    search_fields = ['song__title']
+    readonly_fields = ['song', 'target_quality', 'source_quality', 'attempts', 'worker', 'error', 'output_size', 'elapsed', 'created_at', 'started_at', 'finished_at']
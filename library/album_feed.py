@@ -0,0 +1,109 @@
+"""
+Seeded random album feed for AlbumViewSet.list.
+
+Shuffling the whole catalog per request costs memory and time linear in
+its size. Instead every album holds an independent random key in each of
+FEED_SLOTS precomputed shuffles (AlbumFeedPosition). A session seed is
+hashed to pick one slot and a starting key; the feed walks that slot's keys
+from the start to the end, then wraps around to the keys before it. Each
+page is one range read on the (slot, key, album) index, and since every
+album has exactly one key per slot, scrolling never repeats or skips one.
+
+New albums get their keys from a post_save handler (signals.py); albums
+created without it (bulk_create, loaddata) are added by the
+backfill_album_feed command.
+"""
+import hashlib
+import secrets
+
+from django.core import signing
+from django.db.models import Q
+
+from .models import Album, AlbumFeedPosition
+
+FEED_SLOTS = 16
+KEY_BITS = 62
+CURSOR_SALT = 'library.album_feed.cursor'
+
+
+def random_key():
+    return secrets.randbits(KEY_BITS)
+
+
+def new_seed():
+    return secrets.token_hex(8)
+
+
+def positions_for(album_ids):
+    return [
+        AlbumFeedPosition(slot=slot, key=random_key(), album_id=album_id)
+        for album_id in album_ids
+        for slot in range(FEED_SLOTS)
+    ]
+
+
+def add_albums(album_ids):
+    """
+    Give albums their keys in every slot; albums that already have them
+    keep their place
+    """
+    AlbumFeedPosition.objects.bulk_create(positions_for(album_ids), ignore_conflicts=True, batch_size=1000)
+
+
+def backfill():
+    """
+    Add every album that has no feed positions yet. Returns how many were added.
+    """
+    missing = list(Album.objects.filter(feed_positions__isnull=True).values_list('pk', flat=True))
+    add_albums(missing)
+    return len(missing)
+
+
+def _slot_and_start(seed):
+    digest = int.from_bytes(hashlib.blake2b(str(seed).encode('utf-8'), digest_size=8).digest(), 'big')
+    return digest % FEED_SLOTS, (digest >> 4) % (1 << KEY_BITS)
+
+
+def page(seed, limit, after=None):
+    """
+    One page of album ids in the feed order for seed, after the position
+    returned for the previous page. Returns (album ids, position) where
+    position is None at the end of the feed.
+    """
+    slot, start = _slot_and_start(seed)
+    # The first pass covers keys from start onwards, the second wraps around
+    # to the keys before it
+    wrapped, last = after if after is not None else (False, None)
+    ids = []
+    while len(ids) < limit:
+        positions = AlbumFeedPosition.objects.filter(slot=slot)
+        positions = positions.filter(key__lt=start) if wrapped else positions.filter(key__gte=start)
+        if last is not None:
+            last_key, last_album = last
+            positions = positions.filter(Q(key__gt=last_key) | Q(key=last_key, album_id__gt=last_album))
+        rows = list(positions.order_by('key', 'album_id').values_list('key', 'album_id')[:limit - len(ids)])
+        ids += [album_id for _, album_id in rows]
+        if rows:
+            last = rows[-1]
+        if len(ids) == limit:
+            return ids, (wrapped, last)
+        if wrapped:
+            return ids, None
+        wrapped, last = True, None
+    return ids, (wrapped, last)
+
+
+def encode_cursor(seed, position):
+    return signing.Signer(salt=CURSOR_SALT).sign_object({'s': seed, 'p': position}, compress=True)
+
+
+def decode_cursor(cursor):
+    """
+    Return (seed, position) from a cursor made by encode_cursor, or None if it is invalid
+    """
+    try:
+        payload = signing.Signer(salt=CURSOR_SALT).unsign_object(cursor)
+    except signing.BadSignature:
+        return None
+    wrapped, last = payload['p']
+    return payload['s'], (wrapped, tuple(last) if last is not None else None)
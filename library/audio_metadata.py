@@ -0,0 +1,325 @@
+"""
+Stored metadata for song audio files.
+
+describe() reads a file once to take its size, SHA-256 checksum, codec,
+duration and average bitrate; sync() records that for every quality of a
+song whose file changed since it was last described, and fills an empty
+Song.duration from the best quality. Serializers then read
+AudioFileMetadata rows instead of stat-ing files on every response.
+
+The probes only read container headers (RIFF, FLAC STREAMINFO, the MP4
+mvhd box, and for MP3 the Xing/Info or VBRI header of the first frame).
+MP3 files without one are taken as constant bitrate unless their first
+frames disagree, in which case every frame header is walked.
+"""
+import hashlib
+import os
+import struct
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import Song, AudioFileMetadata, AUDIO_QUALITY_FIELDS
+
+CHUNK_SIZE = 1024 * 1024
+HEADER_SIZE = 64 * 1024
+
+CODECS = {
+    '.mp3': 'mp3',
+    '.flac': 'flac',
+    '.wav': 'pcm',
+    '.m4a': 'aac',
+}
+
+# MPEG-1 layer III bitrates (kbps) by header index; MPEG-2/2.5 use the second row
+MP3_BITRATES = (
+    (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+)
+
+# Sample rates by MPEG version bits (3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5) and header index
+MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+
+# Frames read before deciding a file without a Xing/VBRI header is constant bitrate
+MP3_CBR_CHECK_FRAMES = 8
+
+
+def _probe_wav(fileobj, size):
+    header = fileobj.read(12)
+    if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return None
+    byte_rate = None
+    while True:
+        chunk = fileobj.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+        if chunk_id == b'fmt ':
+            fmt = fileobj.read(chunk_size + chunk_size % 2)
+            byte_rate = struct.unpack('<I', fmt[8:12])[0]
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            if chunk_size in (0, 0xffffffff):
+                # Written while streaming: the data runs to the end of the file
+                chunk_size = size - fileobj.tell()
+            return min(chunk_size, size - fileobj.tell()) / byte_rate, byte_rate * 8 / 1000
+        else:
+            fileobj.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def _probe_flac(fileobj, size):
+    header = fileobj.read(42)
+    # "fLaC", then the STREAMINFO block header and body
+    if header[:4] != b'fLaC' or header[4] & 0x7f != 0:
+        return None
+    packed = int.from_bytes(header[18:26], 'big')
+    sample_rate = packed >> 44
+    total_samples = packed & 0xfffffffff
+    if not sample_rate or not total_samples:
+        return None
+    duration = total_samples / sample_rate
+    return duration, size * 8 / duration / 1000
+
+
+def _mp3_frame(header):
+    """
+    (frame length, samples per frame, sample rate, bitrate, Xing header
+    offset) of a layer III frame header, or None if header isn't one
+    """
+    if len(header) < 4 or header[0] != 0xff or header[1] & 0xe0 != 0xe0:
+        return None
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x03
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = MP3_BITRATES[0 if mpeg1 else 1][bitrate_index]
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    samples = 1152 if mpeg1 else 576
+    padding = (header[2] >> 1) & 0x01
+    mono = header[3] >> 6 == 3
+    # The Xing/Info header follows the side information
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    return samples // 8 * bitrate * 1000 // sample_rate + padding, samples, sample_rate, bitrate, 4 + side_info
+
+
+def _mp3_vbr_header(frame, xing_offset):
+    """
+    (frame count, audio bytes or None) from a Xing/Info or VBRI header in
+    the first frame, or None
+    """
+    tag = frame[xing_offset:xing_offset + 4]
+    if tag in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', frame[xing_offset + 4:xing_offset + 8])[0]
+        position = xing_offset + 8
+        frames = audio_bytes = None
+        if flags & 0x01:
+            frames = struct.unpack('>I', frame[position:position + 4])[0]
+            position += 4
+        if flags & 0x02:
+            audio_bytes = struct.unpack('>I', frame[position:position + 4])[0]
+        return (frames, audio_bytes) if frames else None
+    if frame[36:40] == b'VBRI':
+        audio_bytes, frames = struct.unpack('>II', frame[46:54])
+        return (frames, audio_bytes) if frames else None
+    return None
+
+
+def _scan_mp3_frames(fileobj, offset, size):
+    """
+    Walk the frame headers from offset: (duration in seconds, audio bytes)
+    """
+    seconds = 0.0
+    start = offset
+    while offset + 4 <= size:
+        fileobj.seek(offset)
+        frame = _mp3_frame(fileobj.read(4))
+        if frame is None:
+            # A trailing ID3v1/APE tag or garbage ends the stream
+            break
+        length, samples, sample_rate = frame[:3]
+        seconds += samples / sample_rate
+        offset += length
+    return seconds, min(offset, size) - start
+
+
+def _probe_mp3(fileobj, size):
+    data = fileobj.read(HEADER_SIZE)
+    start = 0
+    if data[:3] == b'ID3':
+        tag_size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        start = 10 + tag_size
+        fileobj.seek(start)
+        data = fileobj.read(HEADER_SIZE)
+
+    for offset in range(len(data) - 3):
+        frame = _mp3_frame(data[offset:offset + 4])
+        if frame is None:
+            continue
+        length, samples, sample_rate, bitrate, xing_offset = frame
+        # A real frame is followed by another one (or the end of the file)
+        following = data[offset + length:offset + length + 4]
+        if len(following) == 4 and _mp3_frame(following) is None:
+            continue
+        audio_start = start + offset
+
+        vbr = _mp3_vbr_header(data[offset:offset + length], xing_offset)
+        if vbr:
+            frames, audio_bytes = vbr
+            duration = frames * samples / sample_rate
+            audio_bytes = audio_bytes or size - audio_start
+            return duration, audio_bytes * 8 / duration / 1000
+
+        # No VBR header: constant bitrate unless the first frames disagree
+        bitrates, position = set(), offset
+        for _ in range(MP3_CBR_CHECK_FRAMES):
+            next_frame = _mp3_frame(data[position:position + 4])
+            if next_frame is None:
+                break
+            bitrates.add(next_frame[3])
+            position += next_frame[0]
+        if len(bitrates) <= 1:
+            return (size - audio_start) * 8 / (bitrate * 1000), bitrate
+        duration, audio_bytes = _scan_mp3_frames(fileobj, audio_start, size)
+        return (duration, audio_bytes * 8 / duration / 1000) if duration else None
+    return None
+
+
+def _probe_m4a(fileobj, size):
+    # Walk the top-level boxes to moov, then to its mvhd
+    end = size
+    while fileobj.tell() < end:
+        header = fileobj.read(8)
+        if len(header) < 8:
+            return None
+        box_size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if box_size == 1:
+            box_size = struct.unpack('>Q', fileobj.read(8))[0]
+            header_size = 16
+        elif box_size == 0:
+            box_size = end - fileobj.tell() + 8
+        if box_type == b'moov':
+            end = fileobj.tell() - header_size + box_size
+            continue
+        if box_type == b'mvhd':
+            body = fileobj.read(box_size - header_size)
+            if body[0] == 1:
+                timescale, duration = struct.unpack('>IQ', body[20:32])
+            else:
+                timescale, duration = struct.unpack('>II', body[12:20])
+            if not timescale or not duration:
+                return None
+            seconds = duration / timescale
+            return seconds, size * 8 / seconds / 1000
+        fileobj.seek(box_size - header_size, os.SEEK_CUR)
+    return None
+
+
+PROBES = {
+    'pcm': _probe_wav,
+    'flac': _probe_flac,
+    'mp3': _probe_mp3,
+    'aac': _probe_m4a,
+}
+
+
+def probe(fileobj, size, codec):
+    """
+    Return (duration in seconds, bitrate in kbps) read from the headers of
+    an open file, or None if they can't be read
+    """
+    try:
+        fileobj.seek(0)
+        return PROBES[codec](fileobj, size)
+    except (KeyError, IndexError, ValueError, struct.error):
+        return None
+
+
+def probe_path(task):
+    """
+    Probe a local file by path; run in the probe_audio command's process
+    pool. task is (key, path); returns (key, (duration, bitrate) or None,
+    error message or None).
+    """
+    key, path = task
+    codec = CODECS.get(os.path.splitext(path)[1].lower(), '')
+    try:
+        with open(path, 'rb') as fileobj:
+            return key, probe(fileobj, os.fstat(fileobj.fileno()).st_size, codec), None
+    except OSError as e:
+        return key, None, str(e)
+
+
+def describe(audio_file):
+    """
+    Metadata fields for a stored FieldFile: one sequential read for the
+    checksum plus a few header reads
+    """
+    codec = CODECS.get(os.path.splitext(audio_file.name)[1].lower(), '')
+    checksum = hashlib.sha256()
+    size = 0
+    with audio_file.storage.open(audio_file.name, 'rb') as fileobj:
+        for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+            checksum.update(chunk)
+            size += len(chunk)
+        probed = probe(fileobj, size, codec)
+
+    duration, bitrate = probed if probed else (None, None)
+    return {
+        'file_name': audio_file.name,
+        'size': size,
+        'duration': timedelta(seconds=round(duration, 3)) if duration is not None else None,
+        'bitrate': round(bitrate) if bitrate is not None else None,
+        'codec': codec,
+        'checksum': checksum.hexdigest(),
+    }
+
+
+def sync(song, force=False):
+    """
+    Describe every quality of song whose file is new or changed since it
+    was last described (all of them with force) and drop metadata of
+    qualities that no longer have a file. Files missing from storage are
+    skipped. Returns (qualities described, qualities missing from storage).
+    """
+    existing = {metadata.quality: metadata for metadata in AudioFileMetadata.objects.filter(song=song)}
+    described, missing = [], []
+    for quality, field_name in AUDIO_QUALITY_FIELDS.items():
+        audio_file = getattr(song, field_name)
+        metadata = existing.get(quality)
+        if not audio_file or not audio_file.name:
+            if metadata:
+                metadata.delete()
+            continue
+        if metadata and metadata.file_name == audio_file.name and not force:
+            continue
+        try:
+            fields = describe(audio_file)
+        except OSError:
+            missing.append(quality)
+            continue
+        existing[quality], _ = AudioFileMetadata.objects.update_or_create(song=song, quality=quality, defaults=fields)
+        described.append(quality)
+
+    # A song fetched with audio_metadata prefetched (e.g. by SongViewSet)
+    # would otherwise keep rendering the metadata from before the save
+    getattr(song, '_prefetched_objects_cache', {}).pop('audio_metadata', None)
+
+    if song.duration is None:
+        # Playlist totals add up Song.duration; take it from the best file
+        for quality in AUDIO_QUALITY_FIELDS:
+            metadata = existing.get(quality)
+            if metadata and metadata.duration and getattr(song, AUDIO_QUALITY_FIELDS[quality]).name == metadata.file_name:
+                song.duration = metadata.duration
+                # No save(): this runs from the post_save signal
+                Song.objects.filter(pk=song.pk).update(duration=song.duration, updated_at=timezone.now())
+                break
+    return described, missing
@@ -0,0 +1,143 @@
+"""
+In-process prefix index backing the search box autocomplete endpoint.
+
+Every song, artist and album title is normalized (see
+symphonia.text.normalize_text) and stored under each of its word starts in
+a sorted list per kind, so a lookup is a bisect followed by a short
+forward scan of each requested kind. The index is built once per process
+from the database and then updated incrementally by the signal handlers in
+library/signals.py; writes made by other processes reach this one when it
+restarts or calls reload().
+"""
+import bisect
+import threading
+
+from django.db import DatabaseError
+
+from symphonia.text import normalize_text
+
+from .models import Song, Artist, Album
+from .search import KIND_SONG, KIND_ARTIST, KIND_ALBUM
+
+SOURCES = {
+    KIND_SONG: (Song, 'title'),
+    KIND_ARTIST: (Artist, 'name'),
+    KIND_ALBUM: (Album, 'title'),
+}
+
+# Titles are indexed under at most this many word starts
+MAX_WORDS_PER_TITLE = 8
+
+# Entries examined per kind and lookup before ranking; bounds the work of
+# very short prefixes
+MAX_SCAN = 200
+
+
+def _word_starts(normalized):
+    words = normalized.split(' ')[:MAX_WORDS_PER_TITLE]
+    starts, offset = [], 0
+    for word in words:
+        starts.append(normalized[offset:])
+        offset += len(word) + 1
+    return starts
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {kind: [] for kind in SOURCES}   # kind -> sorted (key, object_id)
+        self._titles = {}    # (kind, object_id) -> (title, normalized title)
+        self.loaded = False
+
+    def build(self):
+        """
+        Load every title from the database, replacing the current contents
+        """
+        entries, titles = {}, {}
+        for kind, (model, field) in SOURCES.items():
+            entries[kind] = []
+            for object_id, title in model.objects.values_list('pk', field).iterator():
+                normalized = normalize_text(title)
+                titles[(kind, object_id)] = (title, normalized)
+                entries[kind].extend((key, object_id) for key in _word_starts(normalized))
+            entries[kind].sort()
+        with self._lock:
+            self._entries, self._titles = entries, titles
+            self.loaded = True
+
+    reload = build
+
+    def warm_up(self):
+        """
+        Build the index at process startup; a database that is not migrated
+        yet leaves it to be built on first use instead
+        """
+        try:
+            self.ensure_loaded()
+        except DatabaseError:
+            pass
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.build()
+
+    def update(self, kind, object_id, title):
+        if not self.loaded:
+            return
+        with self._lock:
+            self._discard(kind, object_id)
+            normalized = normalize_text(title)
+            self._titles[(kind, object_id)] = (title, normalized)
+            for key in _word_starts(normalized):
+                bisect.insort(self._entries[kind], (key, object_id))
+
+    def remove(self, kind, object_id):
+        if not self.loaded:
+            return
+        with self._lock:
+            self._discard(kind, object_id)
+
+    def _discard(self, kind, object_id):
+        previous = self._titles.pop((kind, object_id), None)
+        if previous is None:
+            return
+        entries = self._entries[kind]
+        for key in _word_starts(previous[1]):
+            entry = (key, object_id)
+            index = bisect.bisect_left(entries, entry)
+            if index < len(entries) and entries[index] == entry:
+                del entries[index]
+
+    def lookup(self, query, limit=10, kinds=None):
+        """
+        Return up to limit {id, type, title} hits whose title has a word
+        starting with query. Titles that start with the query come first,
+        then shorter titles.
+        """
+        prefix = normalize_text(query)
+        if not prefix or limit <= 0:
+            return []
+        self.ensure_loaded()
+
+        matches = {}
+        with self._lock:
+            for kind, entries in self._entries.items():
+                if kinds and kind not in kinds:
+                    continue
+                index = bisect.bisect_left(entries, (prefix,))
+                for key, object_id in entries[index:index + MAX_SCAN]:
+                    if not key.startswith(prefix):
+                        break
+                    title, normalized = self._titles[(kind, object_id)]
+                    rank = (key != normalized, len(normalized), normalized)
+                    if (kind, object_id) not in matches or rank < matches[(kind, object_id)][0]:
+                        matches[(kind, object_id)] = (rank, title)
+
+        ranked = sorted(matches.items(), key=lambda item: item[1][0])[:limit]
+        return [
+            {'id': object_id, 'type': kind, 'title': title}
+            for (kind, object_id), (_, title) in ranked
+        ]
+
+
+prefix_index = PrefixIndex()
@@ -0,0 +1,215 @@
+"""
+Resumable, chunked audio uploads.
+
+A client starts an upload with the file's name, size and SHA-256, then PUTs
+numbered chunks in any order (and again after a dropped connection), each
+with its own SHA-256, and finally asks for the upload to be finalized:
+
+    POST   /api/library/songs/{id}/uploads/                       start
+    GET    /api/library/songs/{id}/uploads/{upload}/              chunks received so far
+    PUT    /api/library/songs/{id}/uploads/{upload}/chunks/{n}/   one chunk, X-Content-SHA256 header
+    POST   /api/library/songs/{id}/uploads/{upload}/finalize/     assemble and store
+    DELETE /api/library/songs/{id}/uploads/{upload}/              abort
+
+Every one of these requires a staff user.
+
+Request bodies are streamed to disk in STREAM_BLOCK_SIZE blocks, so a
+chunk never has to fit in memory. A chunk is written to a temporary file
+while it is hashed and only renamed into place when its length and
+checksum match; finalizing concatenates the chunks the same way, checks
+the whole-file checksum and moves the result into the song's
+songs/{quality}/ file field. Nothing reaches media storage unless every
+check has passed.
+"""
+import hashlib
+import os
+import re
+import shutil
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AudioUpload, AUDIO_QUALITY_FIELDS
+
+ALLOWED_EXTENSIONS = ['.mp3', '.flac', '.wav', '.m4a']
+STREAM_BLOCK_SIZE = 64 * 1024
+SHA256_HEX = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(Exception):
+    """
+    A request that doesn't fit the upload; the message is meant for the client
+    """
+
+
+class StagedFile(File):
+    """
+    A finished file on local disk. FileSystemStorage moves files that have
+    a temporary path into place instead of copying them.
+    """
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def upload_dir(upload):
+    return os.path.join(_setting('AUDIO_UPLOAD_TEMP_DIR', os.path.join(settings.BASE_DIR, 'upload_chunks')), str(upload.id))
+
+
+def _chunk_path(upload, index):
+    return os.path.join(upload_dir(upload), f'{index}.part')
+
+
+def _copy_hashed(read, out, length=None):
+    """
+    Copy blocks from read(size) into out, returning (sha256 hex, bytes copied).
+    Stops after length bytes when it is given.
+    """
+    digest, copied = hashlib.sha256(), 0
+    while length is None or copied < length:
+        block_size = STREAM_BLOCK_SIZE if length is None else min(STREAM_BLOCK_SIZE, length - copied)
+        block = read(block_size)
+        if not block:
+            break
+        digest.update(block)
+        out.write(block)
+        copied += len(block)
+    return digest.hexdigest(), copied
+
+
+def start(song, quality, file_name, size, checksum):
+    """
+    Validate the announced file and create its AudioUpload
+    """
+    if quality not in AUDIO_QUALITY_FIELDS:
+        raise UploadError(f'Invalid quality. Must be one of: {", ".join(AUDIO_QUALITY_FIELDS)}')
+    extension = os.path.splitext(file_name or '')[1].lower()
+    if extension not in ALLOWED_EXTENSIONS:
+        raise UploadError(f'Invalid file format. Allowed formats: {", ".join(ALLOWED_EXTENSIONS)}')
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('size must be the file size in bytes')
+    max_size = _setting('AUDIO_UPLOAD_MAX_SIZE', 2 * 1024 ** 3)
+    if not 0 < size <= max_size:
+        raise UploadError(f'size must be between 1 and {max_size} bytes')
+    checksum = (checksum or '').lower()
+    if not SHA256_HEX.match(checksum):
+        raise UploadError('checksum must be the SHA-256 of the file as 64 hex digits')
+
+    upload = AudioUpload.objects.create(
+        song=song,
+        quality=quality,
+        file_name=os.path.basename(file_name),
+        size=size,
+        chunk_size=_setting('AUDIO_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024),
+        checksum=checksum,
+    )
+    os.makedirs(upload_dir(upload), exist_ok=True)
+    return upload
+
+
+def received_chunks(upload):
+    """
+    Sorted indexes of the chunks stored so far
+    """
+    try:
+        names = os.listdir(upload_dir(upload))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-5]) for name in names if name.endswith('.part') and name[:-5].isdigit())
+
+
+def write_chunk(upload, index, stream, content_length, checksum):
+    """
+    Store chunk index read from stream. Writing the same chunk again
+    replaces it, so clients can simply retry.
+    """
+    if upload.status != AudioUpload.STATUS_PENDING:
+        raise UploadError('Upload is already complete')
+    if not 0 <= index < upload.chunk_count:
+        raise UploadError(f'Chunk index must be between 0 and {upload.chunk_count - 1}')
+    expected_length = upload.chunk_length(index)
+    if content_length != expected_length:
+        raise UploadError(f'Chunk {index} must be {expected_length} bytes')
+    checksum = (checksum or '').lower()
+    if not SHA256_HEX.match(checksum):
+        raise UploadError('X-Content-SHA256 header must be the SHA-256 of the chunk as 64 hex digits')
+
+    os.makedirs(upload_dir(upload), exist_ok=True)
+    path = _chunk_path(upload, index)
+    # Unique per request, so concurrent retries of a chunk never share a file
+    partial = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(partial, 'wb') as out:
+            digest, copied = _copy_hashed(stream.read, out, expected_length)
+        if copied != expected_length:
+            raise UploadError(f'Chunk {index} ended after {copied} of {expected_length} bytes')
+        if digest != checksum:
+            raise UploadError(f'Checksum mismatch for chunk {index}')
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    # Keeps an upload that is still making progress from looking abandoned
+    AudioUpload.objects.filter(pk=upload.pk).update(updated_at=timezone.now())
+
+
+def finalize(upload):
+    """
+    Assemble the chunks, check the whole-file checksum and store the file
+    in the song's field for the upload's quality. The upload's row stays
+    locked until it is marked complete, so a second finalize of the same
+    upload waits and then finds it complete.
+    """
+    with transaction.atomic():
+        upload = AudioUpload.objects.select_for_update().select_related('song').get(pk=upload.pk)
+        if upload.status != AudioUpload.STATUS_PENDING:
+            raise UploadError('Upload is already complete')
+        missing = sorted(set(range(upload.chunk_count)) - set(received_chunks(upload)))
+        if missing:
+            raise UploadError(f'Missing chunks: {", ".join(map(str, missing[:20]))}')
+
+        # Unique per request, like the chunks' temporary files, for backends
+        # where select_for_update doesn't lock (SQLite)
+        assembled = os.path.join(
+            upload_dir(upload), f'assembled.{uuid.uuid4().hex}' + os.path.splitext(upload.file_name)[1].lower()
+        )
+        try:
+            digest = hashlib.sha256()
+            with open(assembled, 'wb') as out:
+                for index in range(upload.chunk_count):
+                    with open(_chunk_path(upload, index), 'rb') as chunk:
+                        # The chunks were verified when they arrived; only the file hash is needed
+                        while block := chunk.read(STREAM_BLOCK_SIZE):
+                            digest.update(block)
+                            out.write(block)
+            if digest.hexdigest() != upload.checksum:
+                raise UploadError('Checksum mismatch for the assembled file')
+
+            song = upload.song
+            with open(assembled, 'rb') as assembled_file:
+                # The field's upload_to puts it at songs/{quality}/{song id}{extension}
+                getattr(song, AUDIO_QUALITY_FIELDS[upload.quality]).save(upload.file_name, StagedFile(assembled_file), save=False)
+        finally:
+            # Moved into storage unless something failed
+            if os.path.exists(assembled):
+                os.remove(assembled)
+        # Saving also records the file's size, duration, bitrate and checksum
+        # (see signals.sync_audio_metadata)
+        song.save()
+
+        upload.status = AudioUpload.STATUS_COMPLETE
+        upload.save(update_fields=['status', 'updated_at'])
+    discard_chunks(upload)
+    return song
+
+
+def discard_chunks(upload):
+    shutil.rmtree(upload_dir(upload), ignore_errors=True)
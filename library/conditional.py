@@ -0,0 +1,124 @@
+"""
+Conditional GET support (ETag / Last-Modified) for catalog and playlist responses.
+
+The validators are derived from a version stamp of the tables a response
+is built from: per table the latest updated_at (or the highest primary key
+for tables without one) and the row count, so deletions change the stamp
+too. All tables are read in a single query of scalar subqueries, and the
+body is only rendered when the client's copy is stale.
+"""
+import hashlib
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from . import signed_media
+
+
+def _stamp_columns(model):
+    try:
+        return model._meta.get_field('updated_at').column, True
+    except FieldDoesNotExist:
+        return model._meta.pk.column, False
+
+
+def version_stamp(models):
+    """
+    Return (list of per-table values, latest modification time or None)
+    for models, in one query
+    """
+    quote = connection.ops.quote_name
+    selects, timestamps = [], []
+    for model in models:
+        column, is_timestamp = _stamp_columns(model)
+        table = quote(model._meta.db_table)
+        selects.append(f'(SELECT MAX({quote(column)}) FROM {table})')
+        selects.append(f'(SELECT COUNT(*) FROM {table})')
+        timestamps.append(is_timestamp)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {", ".join(selects)}')
+        values = list(cursor.fetchone())
+
+    last_modified = None
+    for is_timestamp, value in zip(timestamps, values[::2]):
+        if not is_timestamp or value is None:
+            continue
+        if isinstance(value, str):
+            value = parse_datetime(value)
+        if settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value, dt_timezone.utc)
+        if last_modified is None or value > last_modified:
+            last_modified = value
+    return values, last_modified
+
+
+def validators(models, *scope):
+    """
+    (weak ETag, Last-Modified timestamp or None) for a response built from
+    models; scope adds anything else the response depends on, such as the
+    requesting user
+    """
+    values, last_modified = version_stamp(models)
+    digest = hashlib.sha1(repr((values, scope)).encode('utf-8')).hexdigest()
+    # HTTP dates have whole seconds
+    return f'W/"{digest}"', int(last_modified.timestamp()) if last_modified else None
+
+
+class ConditionalGetMixin:
+    """
+    Answer GET requests with 304 Not Modified when the tables in
+    conditional_models haven't changed since the client's copy, and tag
+    fresh responses with ETag and Last-Modified.
+    """
+    conditional_models = ()
+
+    def conditional_scope(self, request):
+        # Responses differ per user (ownership, friendships), never share
+        # validators; the media URL expiry keeps 304s from reviving expired links
+        return (request.user.pk, signed_media.expiry())
+
+    def conditional_response(self, request, build_response, *scope):
+        """
+        build_response() unless the client's copy is current; scope adds to
+        conditional_scope, e.g. the primary key of a retrieved object
+        """
+        if request.method not in ('GET', 'HEAD'):
+            return build_response()
+
+        etag, last_modified = validators(self.conditional_models, *self.conditional_scope(request), *scope)
+        not_modified = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = build_response()
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            # Let clients keep the body but check back every time
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class ConditionalViewSetMixin(ConditionalGetMixin):
+    """
+    ConditionalGetMixin for the list and retrieve actions of a viewset; a
+    viewset with its own list or retrieve calls conditional_response itself
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(ConditionalViewSetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        # The lookup and the object permissions run first: a 304 must not
+        # answer for an object that doesn't exist or that the user can't see
+        instance = self.get_object()
+        return self.conditional_response(request, lambda: Response(self.get_serializer(instance).data), instance.pk)
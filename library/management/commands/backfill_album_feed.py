@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from library import album_feed
+
+class Command(BaseCommand):
+    help = 'Give albums created without the post_save signal (bulk_create, loaddata) their places in the shuffled album feed'
+
+    def handle(self, *args, **options):
+        added = album_feed.backfill()
+        self.stdout.write(self.style.SUCCESS(f'Added {added} albums to the feed'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from library import audio_metadata
+from library.models import Song
+
+class Command(BaseCommand):
+    help = 'Record size, duration, bitrate, codec and checksum for song audio files that have no stored metadata yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            dest='force',
+            help='Describe every file again, even those whose metadata is up to date',
+        )
+
+    def handle(self, *args, **options):
+        songs = Song.objects.order_by('pk')
+        self.stdout.write(f'Checking {songs.count()} songs for audio files without metadata...')
+
+        described_count = missing_count = 0
+        for song in songs.iterator(chunk_size=500):
+            described, missing = audio_metadata.sync(song, force=options['force'])
+            for quality in described:
+                self.stdout.write(f'  ✓ Song {song.id} "{song.title}": {quality}')
+            for quality in missing:
+                self.stdout.write(self.style.WARNING(f'  - Song {song.id} "{song.title}": {quality} file missing from storage'))
+            described_count += len(described)
+            missing_count += len(missing)
+
+        self.stdout.write(self.style.SUCCESS(f'Described {described_count} audio files ({missing_count} missing)'))
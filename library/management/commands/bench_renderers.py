@@ -0,0 +1,99 @@
+import gzip
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from library.models import Song, Artist, Album, Playlist
+from library.serializers import PlaylistDetailSerializer, AlbumSerializer
+from symphonia.renderers import FastJSONRenderer, MessagePackRenderer
+
+RENDERERS = [
+    ('json (DRF)', JSONRenderer()),
+    ('json (fast)', FastJSONRenderer()),
+    ('msgpack', MessagePackRenderer()),
+]
+
+class Command(BaseCommand):
+    help = 'Compare payload size and encode time of the API renderers on playlist detail and album responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--playlists', type=int, default=20, help='Synthetic playlists to build')
+        parser.add_argument('--songs', type=int, default=50, help='Songs per synthetic playlist')
+        parser.add_argument('--repeat', type=int, default=20, help='Encodes per renderer and payload')
+        parser.add_argument(
+            '--existing',
+            action='store_true',
+            dest='existing',
+            help='Benchmark the playlists and albums already in the database instead of synthetic ones',
+        )
+
+    def handle(self, *args, **options):
+        if options['existing']:
+            self.run(options)
+            return
+        # Build a realistic catalog, measure, then roll everything back
+        with transaction.atomic():
+            self.build_catalog(options['playlists'], options['songs'])
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def build_catalog(self, playlist_count, songs_per_playlist):
+        owner = User.objects.create_user(username='bench_renderers_owner')
+        artists = [Artist.objects.create(name=f'Nghệ sĩ {i}', bio='Tiểu sử ' * 40) for i in range(20)]
+        albums = []
+        for i in range(20):
+            album = Album.objects.create(title=f'Album số {i}')
+            album.artist.set(artists[i % 20:i % 20 + 2])
+            albums.append(album)
+        songs = []
+        for i in range(playlist_count * songs_per_playlist):
+            song = Song.objects.create(
+                title=f'Bài hát {i}',
+                duration=timedelta(seconds=180 + i % 120),
+                lyric={'lines': [{'time': line * 4.5, 'text': f'Lời bài hát dòng {line}'} for line in range(40)]},
+            )
+            song.artist.set(artists[i % 20:i % 20 + 2])
+            song.album.set([albums[i % 20]])
+            songs.append(song)
+        for i in range(playlist_count):
+            playlist = Playlist.objects.create(owner=owner, name=f'Playlist {i}', description='Mô tả ' * 10)
+            playlist.songs.set(songs[i * songs_per_playlist:(i + 1) * songs_per_playlist])
+
+    def run(self, options):
+        playlists = Playlist.objects.prefetch_related('songs__artist', 'songs__album').select_related('owner')
+        albums = Album.objects.prefetch_related('artist', 'songs')
+        payloads = [
+            ('playlist detail', [PlaylistDetailSerializer(playlist).data for playlist in playlists]),
+            ('album list', [AlbumSerializer(albums, many=True).data]),
+        ]
+
+        for label, documents in payloads:
+            if not documents:
+                continue
+            self.stdout.write(f'\n{label} ({len(documents)} documents)')
+            baseline = None
+            for name, renderer in RENDERERS:
+                size, compressed, seconds = self.measure(renderer, documents, options['repeat'])
+                baseline = baseline or (size, seconds)
+                self.stdout.write(
+                    f'  {name:<12} {size / len(documents):10.0f} B/doc  '
+                    f'gzip {compressed / len(documents):9.0f} B/doc  '
+                    f'{seconds * 1e6 / len(documents):8.1f} µs/doc  '
+                    f'size x{size / baseline[0]:.2f}  time x{seconds / baseline[1]:.2f}'
+                )
+
+    def measure(self, renderer, documents, repeat):
+        size = compressed = 0
+        for document in documents:
+            body = renderer.render(document)
+            size += len(body)
+            compressed += len(gzip.compress(body))
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for document in documents:
+                renderer.render(document)
+        return size, compressed, (time.perf_counter() - started) / repeat
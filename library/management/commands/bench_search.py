@@ -0,0 +1,111 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client, AsyncClient
+from django.test.utils import override_settings
+from django.urls import reverse
+
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+class Command(BaseCommand):
+    help = 'Compare search latency through the WSGI handler (SearchView) and the ASGI handler (AsyncSearchView) under concurrent load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', default=['love', 'em', 'anh'], help='Search queries, used in turn')
+        parser.add_argument('--requests', type=int, default=200, dest='requests', help='Requests per handler')
+        parser.add_argument('--concurrency', type=int, default=10, dest='concurrency', help='Requests in flight at once')
+        parser.add_argument('--max-results', type=int, default=5, dest='max_results')
+        parser.add_argument('--mode', default='full', dest='mode', help='Search response mode (full or compact)')
+        parser.add_argument(
+            '--with-cache',
+            action='store_true',
+            dest='with_cache',
+            help='Keep the search result cache enabled (disabled by default so every request hits the database)',
+        )
+        parser.add_argument(
+            '--query-delay',
+            type=float,
+            default=0.0,
+            dest='query_delay',
+            help='Milliseconds added to every query, to stand in for a networked database',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        params = [
+            {'query': query, 'max_results': options['max_results'], 'mode': options['mode']}
+            for query in options['queries']
+        ]
+        requests = [params[i % len(params)] for i in range(options['requests'])]
+
+        self.stdout.write(
+            f'{options["requests"]} requests, concurrency {options["concurrency"]}, '
+            f'queries: {", ".join(options["queries"])}'
+        )
+        if options['query_delay']:
+            self.add_query_delay(options['query_delay'] / 1000)
+        if options['with_cache']:
+            self.run_benchmarks(requests)
+        else:
+            with override_settings(CACHES=NO_CACHE):
+                self.run_benchmarks(requests)
+
+    def add_query_delay(self, seconds):
+        def delay(execute, sql, params, many, context):
+            # sleep() releases the GIL, like waiting on a database server
+            time.sleep(seconds)
+            return execute(sql, params, many, context)
+
+        # Every connection, including those opened later by worker threads
+        for connection in connections.all():
+            connection.execute_wrappers.append(delay)
+        connection_created.connect(
+            lambda sender, connection, **kwargs: connection.execute_wrappers.append(delay), weak=False,
+        )
+
+    def run_benchmarks(self, requests):
+        self.report('WSGI  SearchView', *self.bench_wsgi(reverse('search'), requests))
+        self.report('ASGI  AsyncSearchView', *asyncio.run(self.bench_asgi(reverse('search_async'), requests)))
+
+    def bench_wsgi(self, url, requests):
+        def fetch(params):
+            started = time.perf_counter()
+            response = Client().get(url, params)
+            assert response.status_code == 200, response.content
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.options['concurrency']) as pool:
+            latencies = list(pool.map(fetch, requests))
+        return latencies, time.perf_counter() - started
+
+    async def bench_asgi(self, url, requests):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(self.options['concurrency'])
+
+        async def fetch(params):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(url, params)
+                assert response.status_code == 200, response.content
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(fetch(params) for params in requests))
+        return latencies, time.perf_counter() - started
+
+    def report(self, label, latencies, elapsed):
+        latencies = sorted(latencies)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f'{label:<24} mean {statistics.mean(latencies) * 1000:7.2f}ms  '
+            f'p50 {statistics.median(latencies) * 1000:7.2f}ms  '
+            f'p95 {p95 * 1000:7.2f}ms  '
+            f'max {latencies[-1] * 1000:7.2f}ms  '
+            f'{len(latencies) / elapsed:7.1f} req/s'
+        )
@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from library import waveform
+
+class Command(BaseCommand):
+    help = 'Compute the waveform peaks of songs that have none or whose audio changed, in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Decoding processes')
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            dest='force',
+            help='Recompute the peaks of every song',
+        )
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            dest='watch',
+            help='Keep running and compute peaks for new uploads as they arrive',
+        )
+        parser.add_argument('--poll', type=float, default=30.0, help='Seconds between checks for new audio with --watch')
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        self.computed = self.failed = 0
+        # (song id, file name) that failed; not retried until the file changes
+        self.failures = set()
+        started = time.perf_counter()
+
+        # Pool processes only decode files; don't hand them this process's connections
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            try:
+                self.run(pool, workers, options)
+            except KeyboardInterrupt:
+                self.stdout.write(self.style.WARNING('Interrupted'))
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Computed {self.computed} waveforms ({self.failed} failed) in {elapsed:.1f}s: '
+            f'{self.computed / elapsed if elapsed else 0:.1f} songs/s'
+        ))
+
+    def run(self, pool, workers, options):
+        force = options['force']
+        while True:
+            tasks = [
+                task for task in map(waveform.task_for, waveform.songs_needing_waveforms(force=force))
+                if task is not None and (task[0], task[2]) not in self.failures
+            ]
+            if tasks:
+                self.stdout.write(f'Computing {len(tasks)} waveforms with {workers} processes...')
+            for song_id, quality, file_name, peaks, error in pool.imap_unordered(waveform.compute_task, tasks, chunksize=4):
+                if error:
+                    self.failed += 1
+                    self.failures.add((song_id, file_name))
+                    self.stdout.write(self.style.WARNING(f'  - Song {song_id} {quality}: {error}'))
+                    continue
+                waveform.store(song_id, quality, file_name, peaks)
+                self.computed += 1
+
+            if not options['watch']:
+                return
+            force = False
+            time.sleep(options['poll'])
@@ -0,0 +1,84 @@
+import multiprocessing
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from library import thumbnails
+
+class Command(BaseCommand):
+    help = 'Make the missing or outdated fixed-size thumbnails of all artwork and their WebP/AVIF variants, in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Resizing processes')
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            dest='force',
+            help='Make every thumbnail again, even the up-to-date ones',
+        )
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            dest='prune',
+            help='Also delete thumbnails and variants of images that no longer exist',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        tasks, missing = self.collect_tasks(options['force'])
+        self.stdout.write(f'Resizing {len(tasks)} images with {options["workers"]} processes ({missing} missing)...')
+
+        made = failed = 0
+        # Pool processes only read and resize files; storing goes through this
+        # process, so don't hand them its connections
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(max(options['workers'], 1)) as pool:
+            for name, renditions, error in pool.imap_unordered(thumbnails.render_task, tasks, chunksize=8):
+                if error:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f'  - {name}: {error}'))
+                    continue
+                thumbnails.store(default_storage, name, renditions)
+                made += len(renditions)
+
+        pruned = self.prune() if options['prune'] else 0
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Made {made} thumbnails and variants of {len(tasks) - failed} images ({failed} unreadable) in {elapsed:.1f}s: '
+            f'{(len(tasks) - failed) / elapsed if elapsed else 0:.1f} images/s'
+            + (f'; pruned {pruned} thumbnails' if options['prune'] else '')
+        ))
+
+    def collect_tasks(self, force):
+        """
+        (name, path, sizes to make) for every image with thumbnails to make,
+        and the number of images missing from storage
+        """
+        tasks, missing = [], 0
+        for name in sorted(thumbnails.stored_image_names()):
+            try:
+                requested = thumbnails.stale_sizes(default_storage, name, force)
+            except FileNotFoundError:
+                missing += 1
+                continue
+            if requested:
+                tasks.append((name, default_storage.path(name), requested))
+        return tasks, missing
+
+    def prune(self):
+        root = default_storage.path(thumbnails.THUMBNAIL_DIR)
+        pruned = 0
+        for directory, _, files in os.walk(root):
+            for file_name in files:
+                name = os.path.relpath(os.path.join(directory, file_name), default_storage.location).replace('\\', '/')
+                if not (self.has_original(name) or self.has_original(thumbnails.rendition_of(name))):
+                    default_storage.delete(name)
+                    pruned += 1
+        return pruned
+
+    def has_original(self, name):
+        parsed = thumbnails.parse_thumbnail_name(name) if name else None
+        return parsed is not None and default_storage.exists(parsed[1])
@@ -0,0 +1,62 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from library import thumbnails
+from library.utils import format_bytes
+
+class Command(BaseCommand):
+    help = 'Report the bytes artwork thumbnails and their WebP/AVIF variants save over the stored images'
+
+    def handle(self, *args, **options):
+        formats = thumbnails.variant_formats()
+        originals = missing = 0
+        # Size -> {'renditions': count, 'bytes': total, format: total, 'best': total}
+        by_size = {size: {'renditions': 0, 'bytes': 0, 'best': 0, **dict.fromkeys(formats, 0)} for size in thumbnails.sizes()}
+        names = thumbnails.stored_image_names()
+
+        for name in names:
+            try:
+                originals += default_storage.size(name)
+            except OSError:
+                missing += 1
+                continue
+            for size, totals in by_size.items():
+                rendition = thumbnails.thumbnail_name(name, size)
+                try:
+                    rendition_size = os.path.getsize(default_storage.path(rendition))
+                except OSError:
+                    continue
+                totals['renditions'] += 1
+                totals['bytes'] += rendition_size
+                # What a client accepting every variant format is sent
+                best = rendition_size
+                for image_format in formats:
+                    try:
+                        variant_size = os.path.getsize(default_storage.path(thumbnails.variant_name(rendition, image_format)))
+                    except OSError:
+                        # Not made, or the rendition already has this format
+                        variant_size = rendition_size
+                    totals[image_format] += variant_size
+                    best = min(best, variant_size)
+                totals['best'] += best
+
+        self.stdout.write(f'{len(names) - missing} images stored as {format_bytes(originals)} ({missing} missing)')
+        self.stdout.write(f'Variant formats: {", ".join(formats) or "none (this Pillow build writes neither WebP nor AVIF)"}')
+        for size, totals in by_size.items():
+            if not totals['renditions']:
+                self.stdout.write(f'{size}px: no thumbnails yet')
+                continue
+            line = f'{size}px: {totals["renditions"]} thumbnails, {format_bytes(totals["bytes"])}'
+            for image_format in formats:
+                line += f'; {image_format} {format_bytes(totals[image_format])} ({self.saved(totals["bytes"], totals[image_format])})'
+            self.stdout.write(line)
+            self.stdout.write(self.style.SUCCESS(
+                f'  best per image {format_bytes(totals["best"])}: '
+                f'{self.saved(totals["bytes"], totals["best"])} on the thumbnails, '
+                f'{self.saved(originals, totals["best"])} on the images as uploaded'
+            ))
+
+    def saved(self, before, after):
+        return f'{(before - after) * 100 / before:.0f}% smaller' if before else 'n/a'
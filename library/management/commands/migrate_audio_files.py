@@ -1,8 +1,8 @@
 import os
-import shutil
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from library.models import Song
+from library.storage import share_file
 
 class Command(BaseCommand):
     help = 'Migrate existing audio files to quality-based structure'
@@ -46,14 +46,9 @@ class Command(BaseCommand):
                 self.stdout.write(f'  To: {new_audio_path}')
                 
                 if not dry_run:
-                    # Ensure the destination directory exists
-                    os.makedirs(os.path.dirname(new_audio_path), exist_ok=True)
-                    
-                    # Copy the file to new location (we copy instead of move to be safe)
-                    shutil.copy2(current_audio_path, new_audio_path)
-                    
-                    # Update the song's audio_320kbps field
-                    song.audio_320kbps = f'songs/320kbps/{new_filename}'
+                    # Share the file at the new location (the legacy one is kept to be
+                    # safe); the media store links it rather than copying the bytes
+                    song.audio_320kbps = share_file(song.audio, f'songs/320kbps/{new_filename}')
                     song.save()
                     
                     self.stdout.write(self.style.SUCCESS(f'  ✓ Successfully migrated'))
@@ -0,0 +1,131 @@
+import multiprocessing
+import os
+import time
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from library import audio_metadata
+from library.models import Song, AudioFileMetadata, AUDIO_QUALITY_FIELDS
+
+# Song.duration comes from the best quality that could be read
+DURATION_PRIORITY = [*AUDIO_QUALITY_FIELDS, 'legacy']
+
+class Command(BaseCommand):
+    help = 'Read duration and bitrate from the headers of stored audio files in a process pool, filling empty song durations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Probing processes')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per bulk_update')
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            dest='force',
+            help='Probe every file and overwrite song durations that are already set',
+        )
+
+    def handle(self, *args, **options):
+        self.force = options['force']
+        self.batch_size = options['batch_size']
+        self.pending_metadata = []
+        # Song id -> (rank in DURATION_PRIORITY, duration) for songs whose duration is filled
+        self.song_durations = {}
+        self.songs_needing_duration = set()
+        tasks = self.collect_tasks()
+        self.stdout.write(f'Probing {len(tasks)} audio files with {options["workers"]} processes...')
+
+        probed = unreadable = missing = 0
+        started = time.perf_counter()
+
+        # Pool processes only read files; don't hand them this process's connections
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(max(options['workers'], 1)) as pool:
+            for (song_id, quality), probed_values, error in pool.imap_unordered(audio_metadata.probe_path, tasks, chunksize=16):
+                if error:
+                    missing += 1
+                    self.stdout.write(self.style.WARNING(f'  - Song {song_id} {quality}: {error}'))
+                    continue
+                if probed_values is None:
+                    unreadable += 1
+                    self.stdout.write(self.style.WARNING(f'  - Song {song_id} {quality}: no readable header'))
+                    continue
+                probed += 1
+                self.record(song_id, quality, *probed_values)
+        filled = self.flush()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Probed {probed} files ({unreadable} unreadable, {missing} missing) in {elapsed:.1f}s: '
+            f'{len(tasks) / elapsed if elapsed else 0:.0f} files/s; '
+            f'{filled} song durations filled'
+        ))
+
+    def collect_tasks(self):
+        """
+        ((song id, quality), path) for every file that needs probing
+        """
+        metadata = {
+            (song_id, quality): (pk, file_name, duration)
+            for pk, song_id, quality, file_name, duration in AudioFileMetadata.objects.values_list(
+                'pk', 'song_id', 'quality', 'file_name', 'duration',
+            )
+        }
+        self.metadata_ids = {}
+        tasks = []
+        songs = Song.objects.values_list('pk', 'duration', *AUDIO_QUALITY_FIELDS.values(), 'audio')
+        for song_id, duration, *names in songs.iterator(chunk_size=2000):
+            files = [(quality, name) for quality, name in zip(DURATION_PRIORITY, names) if name]
+            queued = set()
+            for quality, name in files:
+                pk, file_name, stored_duration = metadata.get((song_id, quality), (None, None, None))
+                if pk and file_name == name:
+                    self.metadata_ids[song_id, quality] = pk
+                    if stored_duration is None or self.force:
+                        tasks.append(((song_id, quality), default_storage.path(name)))
+                        queued.add(quality)
+
+            if files and (duration is None or self.force):
+                self.songs_needing_duration.add(song_id)
+                quality, name = files[0]
+                stored = metadata.get((song_id, quality))
+                if stored and stored[1] == name and stored[2] and not self.force:
+                    # Already measured when the file was stored
+                    self.song_durations[song_id] = (0, stored[2])
+                elif quality not in queued:
+                    tasks.append(((song_id, quality), default_storage.path(name)))
+        return tasks
+
+    def record(self, song_id, quality, duration, bitrate):
+        duration = timedelta(seconds=round(duration, 3))
+        metadata_id = self.metadata_ids.get((song_id, quality))
+        if metadata_id:
+            self.pending_metadata.append(AudioFileMetadata(
+                pk=metadata_id, duration=duration, bitrate=round(bitrate), updated_at=timezone.now(),
+            ))
+
+        if song_id in self.songs_needing_duration:
+            # Results arrive in any order: keep the best quality seen for each song
+            rank = DURATION_PRIORITY.index(quality)
+            best = self.song_durations.get(song_id)
+            if best is None or rank < best[0]:
+                self.song_durations[song_id] = (rank, duration)
+        self.flush_metadata(full_batches_only=True)
+
+    def flush_metadata(self, full_batches_only=False):
+        if full_batches_only and len(self.pending_metadata) < self.batch_size:
+            return
+        AudioFileMetadata.objects.bulk_update(self.pending_metadata, ['duration', 'bitrate', 'updated_at'])
+        self.pending_metadata = []
+
+    def flush(self):
+        self.flush_metadata()
+        # Song durations are written last, once every file of a song has been seen
+        songs = [Song(pk=song_id, duration=duration, updated_at=timezone.now()) for song_id, (_, duration) in self.song_durations.items()]
+        filled = Song.objects
+        if not self.force:
+            # Never overwrite a duration set since the scan started
+            filled = filled.filter(duration__isnull=True)
+        return filled.bulk_update(songs, ['duration', 'updated_at'], batch_size=self.batch_size)
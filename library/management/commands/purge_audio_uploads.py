@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from library import chunked_upload
+from library.models import AudioUpload
+
+class Command(BaseCommand):
+    help = 'Delete abandoned resumable audio uploads and their staged chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=48, help='Age after which a pending upload counts as abandoned')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        uploads = AudioUpload.objects.filter(status=AudioUpload.STATUS_PENDING, updated_at__lt=cutoff)
+
+        purged_count = 0
+        for upload in uploads.iterator():
+            chunks = len(chunked_upload.received_chunks(upload))
+            chunked_upload.discard_chunks(upload)
+            upload.delete()
+            self.stdout.write(f'  ✓ Upload {upload.id} for song {upload.song_id}: {chunks} of {upload.chunk_count} chunks')
+            purged_count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged_count} abandoned uploads'))
@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from library import search
+from library.models import Song, Artist, Album
+from authentication.models import UserProfile
+
+class Command(BaseCommand):
+    help = 'Rebuild the search indexes for songs, artists, albums and users'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=search.REBUILD_BATCH_SIZE,
+            dest='batch_size',
+            help='Number of rows inserted per batch',
+        )
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stdout.write(self.style.WARNING('Full-text search index is only available on SQLite - nothing to do'))
+            return
+
+        started = time.monotonic()
+        counts = search.rebuild(Song, Artist, Album, UserProfile, batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+
+        for kind, count in counts.items():
+            self.stdout.write(f'  Indexed {count} {kind}s')
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt in {elapsed:.2f}s'))
@@ -0,0 +1,83 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Sum
+
+from library.models import MediaBlob, MediaLink
+from library.utils import format_bytes
+
+class Command(BaseCommand):
+    help = 'Remove media blobs nothing references any more and report the space the content-addressed store saves'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--adopt',
+            action='store_true',
+            dest='adopt',
+            help='First fold files stored before the content-addressed store into it, linking duplicates',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            help='Report what would be reclaimed without deleting anything',
+        )
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        if not hasattr(storage, 'blob_root'):
+            raise CommandError('The default storage is not library.storage.ContentAddressedStorage')
+        dry_run = options['dry_run']
+
+        if options['adopt'] and not dry_run:
+            adopted, saved = self.adopt(storage)
+            self.stdout.write(f'Adopted {adopted} files, {format_bytes(saved)} of duplicates replaced by links')
+
+        # Names whose file was removed without going through the storage
+        dropped = 0
+        for link in MediaLink.objects.iterator():
+            if not os.path.exists(storage.path(link.name)):
+                dropped += 1
+                self.stdout.write(self.style.WARNING(f'  - {link.name}: file is gone, dropping its reference'))
+                if not dry_run:
+                    storage.delete(link.name)
+
+        freed = removed = 0
+        for blob in MediaBlob.objects.filter(ref_count__lte=0).iterator():
+            if dry_run:
+                removed += 1
+                freed += blob.size
+                continue
+            # Only if nothing referenced it in the meantime
+            if MediaBlob.objects.filter(pk=blob.pk, ref_count__lte=0, links__isnull=True).delete()[0]:
+                try:
+                    os.remove(storage.blob_path(blob.sha256))
+                except FileNotFoundError:
+                    pass
+                removed += 1
+                freed += blob.size
+
+        totals = MediaBlob.objects.filter(ref_count__gt=0).aggregate(
+            stored=Sum('size'), referenced=Sum(F('size') * F('ref_count')),
+        )
+        stored, referenced = totals['stored'] or 0, totals['referenced'] or 0
+        verb = 'Would remove' if dry_run else 'Removed'
+        self.stdout.write(f'{verb} {removed} unreferenced blobs ({format_bytes(freed)}), {dropped} dangling references')
+        self.stdout.write(self.style.SUCCESS(
+            f'{format_bytes(referenced)} of media stored as {format_bytes(stored)}: '
+            f'{format_bytes(referenced - stored)} saved by deduplication'
+        ))
+
+    def adopt(self, storage):
+        adopted = saved = 0
+        known = set(MediaLink.objects.values_list('name', flat=True))
+        for directory, subdirectories, files in os.walk(storage.location):
+            subdirectories[:] = [name for name in subdirectories if os.path.join(directory, name) != storage.blob_root]
+            for file_name in files:
+                name = os.path.relpath(os.path.join(directory, file_name), storage.location).replace('\\', '/')
+                if name in known:
+                    continue
+                saved += storage.adopt(name)
+                adopted += 1
+        return adopted, saved
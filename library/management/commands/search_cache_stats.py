@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from library import search_cache
+
+class Command(BaseCommand):
+    help = 'Show search result cache hit/miss counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            dest='reset',
+            help='Reset the counters after printing them',
+        )
+
+    def handle(self, *args, **options):
+        stats = search_cache.stats()
+        self.stdout.write(f'Hits: {stats["hits"]}')
+        self.stdout.write(f'Misses: {stats["misses"]}')
+        self.stdout.write(f'Hit rate: {stats["hit_rate"]:.1%}')
+        self.stdout.write(f'Catalog version: {stats["catalog_version"]}')
+
+        if options['reset']:
+            search_cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Avg, Count, Sum
+
+from library import transcoding
+from library.models import Song, AudioJob
+
+class Command(BaseCommand):
+    help = 'Run queued transcoding jobs that derive missing 320kbps/128kbps renditions, in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Transcoder processes')
+        parser.add_argument('--poll', type=float, default=5.0, help='Seconds between queue checks when idle')
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            dest='once',
+            help='Exit once no job is due instead of waiting for new ones',
+        )
+        parser.add_argument(
+            '--enqueue-missing',
+            action='store_true',
+            dest='enqueue_missing',
+            help='Queue jobs for every song in the catalog that lacks a rendition before starting',
+        )
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            dest='retry_failed',
+            help='Queue new jobs for renditions whose jobs failed, even from the same source file',
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            dest='stats',
+            help='Print the queue state and throughput of finished jobs, then exit',
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.print_stats()
+            return
+        if options['enqueue_missing']:
+            queued = sum(len(transcoding.enqueue_missing(song)) for song in Song.objects.defer('lyric').iterator(chunk_size=500))
+            self.stdout.write(f'Queued {queued} jobs for missing renditions')
+        if options['retry_failed']:
+            self.stdout.write(f'Queued {len(transcoding.retry_failed())} jobs to retry failed renditions')
+
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        workers = max(options['workers'], 1)
+        self.done = self.failed = self.retried = 0
+        self.output_bytes = self.busy_seconds = 0
+        started = time.perf_counter()
+
+        # Pool processes are forked and never touch the database; don't hand
+        # them this process's connections
+        connections.close_all()
+        self.stdout.write(f'Worker {worker} running {workers} transcoder processes ({transcoding.get_transcoder_path()})')
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                self.run(pool, worker, workers, options)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Interrupted; running jobs will be requeued once they time out'))
+
+        wall = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{self.done} done, {self.failed} failed, {self.retried} retried in {wall:.1f}s: '
+            f'{self.done * 60 / wall if wall else 0:.1f} jobs/min, '
+            f'{self.output_bytes / 1e6 / wall if wall else 0:.2f} MB/s written, '
+            f'{self.busy_seconds / self.done if self.done else 0:.1f}s per rendition'
+        ))
+
+    def run(self, pool, worker, workers, options):
+        running = {}
+        while True:
+            transcoding.requeue_stale()
+            for job in transcoding.claim(worker, workers - len(running)):
+                try:
+                    task = transcoding.prepare(job)
+                except transcoding.TranscodeError as e:
+                    self.report(transcoding.finish(job, None, str(e), 0, retry=False))
+                    continue
+                running[pool.submit(transcoding.transcode_task, task)] = job
+
+            if not running:
+                if options['once']:
+                    return
+                time.sleep(options['poll'])
+                continue
+
+            finished, _ = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                _, output_path, error, elapsed = future.result()
+                self.report(transcoding.finish(job, output_path, error, elapsed))
+
+    def report(self, job):
+        label = f'Song {job.song_id} {job.target_quality}'
+        if job.status == AudioJob.STATUS_DONE:
+            self.done += 1
+            self.output_bytes += job.output_size or 0
+            self.busy_seconds += job.elapsed or 0
+            self.stdout.write(f'  ✓ {label} from {job.source_quality} in {job.elapsed:.1f}s')
+        elif job.status == AudioJob.STATUS_QUEUED:
+            self.retried += 1
+            self.stdout.write(self.style.WARNING(f'  - {label} attempt {job.attempts} failed, retrying: {job.error}'))
+        else:
+            self.failed += 1
+            self.stdout.write(self.style.ERROR(f'  ✗ {label} failed after {job.attempts} attempts: {job.error}'))
+
+    def print_stats(self):
+        counts = dict(AudioJob.objects.values_list('status').annotate(Count('pk')).order_by())
+        for status, label in AudioJob.STATUS_CHOICES:
+            self.stdout.write(f'{label:<8} {counts.get(status, 0)}')
+        finished = AudioJob.objects.filter(status=AudioJob.STATUS_DONE).aggregate(
+            jobs=Count('pk'), seconds=Sum('elapsed'), average=Avg('elapsed'), output=Sum('output_size'),
+        )
+        if finished['jobs']:
+            self.stdout.write(
+                f"Finished renditions: {finished['average']:.1f}s on average, "
+                f"{(finished['output'] or 0) / 1e6 / finished['seconds'] if finished['seconds'] else 0:.2f} MB/s per process"
+            )
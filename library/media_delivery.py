@@ -0,0 +1,74 @@
+"""
+Delivery of media files that need an authorization check.
+
+Views decide whether a request may see a file and then call deliver().
+Depending on settings.MEDIA_DELIVERY the bytes are either streamed by the
+worker (streaming.file_response, with Range support) or handed to the
+front proxy with an X-Accel-Redirect (nginx) or X-Sendfile (Apache,
+lighttpd) header, so the worker is free as soon as the headers are sent.
+The proxy then handles Range, conditional requests and the transfer.
+
+Example nginx location for MEDIA_DELIVERY = 'x-accel-redirect':
+
+    location /protected-media/ {
+        internal;
+        alias /srv/symphonia/media/;
+    }
+"""
+from collections import namedtuple
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+
+from .streaming import file_response, content_type_for
+
+DELIVERY_DJANGO = 'django'
+DELIVERY_X_ACCEL_REDIRECT = 'x-accel-redirect'
+DELIVERY_X_SENDFILE = 'x-sendfile'
+
+# A stored file known only by name, standing in for a FieldFile in deliver()
+StoredFile = namedtuple('StoredFile', ['storage', 'name'])
+
+
+def delivery_mode():
+    mode = getattr(settings, 'MEDIA_DELIVERY', DELIVERY_DJANGO)
+    if mode not in (DELIVERY_DJANGO, DELIVERY_X_ACCEL_REDIRECT, DELIVERY_X_SENDFILE):
+        raise ImproperlyConfigured(f'Unknown MEDIA_DELIVERY mode: {mode!r}')
+    return mode
+
+
+def deliver(request, field_file, checksum=None):
+    """
+    Response sending an authorized FieldFile. checksum, when known, is
+    used as the ETag for in-process delivery. Raises OSError if the file
+    is missing and the worker serves it itself.
+    """
+    mode = delivery_mode()
+    if mode == DELIVERY_DJANGO:
+        return file_response(request, field_file, checksum=checksum)
+
+    # The proxy sets the length, ranges and validators from the file itself
+    response = HttpResponse(content_type=content_type_for(field_file.name))
+    if mode == DELIVERY_X_ACCEL_REDIRECT:
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(field_file.name)
+    else:
+        response['X-Sendfile'] = field_file.storage.path(field_file.name)
+    return response
+
+
+def media_response(request, field_file, missing_error, checksum=None):
+    """
+    deliver() for a DRF view, or a 404 with missing_error when the field
+    is empty or the file is gone
+    """
+    if not field_file or not field_file.name:
+        return Response({'error': missing_error}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        return deliver(request._request, field_file, checksum=checksum)
+    except FileNotFoundError:
+        return Response({'error': missing_error}, status=status.HTTP_404_NOT_FOUND)
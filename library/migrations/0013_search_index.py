@@ -0,0 +1,54 @@
+from django.db import migrations
+
+# Inlined rather than imported from library.search, so the migration keeps
+# creating and filling the same table whatever that module becomes
+SEARCH_INDEX_TABLE = 'library_search_index'
+
+# rowid = object id * 4 + kind code (library.search.KIND_CODES)
+KIND_STRIDE = 4
+SONG_CODE, ARTIST_CODE, ALBUM_CODE = 1, 2, 3
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Create the FTS5 full-text index and fill it from the existing catalog.
+    Only SQLite ships FTS5; other backends keep using icontains lookups.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_INDEX_TABLE} "
+        f"USING fts5(title, context, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+
+    Song = apps.get_model('library', 'Song')
+    Artist = apps.get_model('library', 'Artist')
+    Album = apps.get_model('library', 'Album')
+    rows = []
+    for song in Song.objects.prefetch_related('artist', 'album').iterator(chunk_size=1000):
+        context = [artist.name for artist in song.artist.all()] + [album.title for album in song.album.all()]
+        rows.append((song.pk * KIND_STRIDE + SONG_CODE, song.title, ' '.join(context)))
+    for artist in Artist.objects.iterator(chunk_size=1000):
+        rows.append((artist.pk * KIND_STRIDE + ARTIST_CODE, artist.name, ''))
+    for album in Album.objects.prefetch_related('artist').iterator(chunk_size=1000):
+        rows.append((album.pk * KIND_STRIDE + ALBUM_CODE, album.title, ' '.join(artist.name for artist in album.artist.all())))
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {SEARCH_INDEX_TABLE} (rowid, title, context) VALUES (%s, %s, %s)', rows)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_INDEX_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0012_rename_140kbps_to_128kbps'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
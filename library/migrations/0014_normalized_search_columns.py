@@ -0,0 +1,103 @@
+from django.db import migrations, models
+
+from symphonia.text import normalize_text
+
+# Inlined rather than imported from library.search, so the migration keeps
+# creating and filling the same tables whatever that module becomes
+SEARCH_INDEX_TABLE = 'library_search_index'
+TRIGRAM_INDEX_TABLE = 'library_search_trigram'
+
+# rowid = object id * 4 + kind code (library.search.KIND_CODES)
+KIND_STRIDE = 4
+USER_CODE, SONG_CODE, ARTIST_CODE, ALBUM_CODE = 0, 1, 2, 3
+
+
+def fill_normalized_columns(apps, schema_editor):
+    for model_name, source_field, normalized_field in [
+        ('Song', 'title', 'title_normalized'),
+        ('Artist', 'name', 'name_normalized'),
+        ('Album', 'title', 'title_normalized'),
+    ]:
+        model = apps.get_model('library', model_name)
+        instances = list(model.objects.all())
+        for instance in instances:
+            setattr(instance, normalized_field, normalize_text(getattr(instance, source_field)))
+        model.objects.bulk_update(instances, [normalized_field], batch_size=1000)
+
+
+def create_trigram_index(apps, schema_editor):
+    """
+    Create the trigram index and re-index everything, both indexes now
+    from the normalized columns
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TRIGRAM_INDEX_TABLE} "
+        f"USING fts5(text, tokenize = 'trigram')"
+    )
+
+    Song = apps.get_model('library', 'Song')
+    Artist = apps.get_model('library', 'Artist')
+    Album = apps.get_model('library', 'Album')
+    UserProfile = apps.get_model('authentication', 'UserProfile')
+    documents, texts = [], []
+    for song in Song.objects.prefetch_related('artist', 'album').iterator(chunk_size=1000):
+        rowid = song.pk * KIND_STRIDE + SONG_CODE
+        context = [artist.name for artist in song.artist.all()] + [album.title for album in song.album.all()]
+        documents.append((rowid, song.title_normalized, normalize_text(' '.join(context))))
+        texts.append((rowid, song.title_normalized))
+    for artist in Artist.objects.iterator(chunk_size=1000):
+        rowid = artist.pk * KIND_STRIDE + ARTIST_CODE
+        documents.append((rowid, artist.name_normalized, ''))
+        texts.append((rowid, artist.name_normalized))
+    for album in Album.objects.prefetch_related('artist').iterator(chunk_size=1000):
+        rowid = album.pk * KIND_STRIDE + ALBUM_CODE
+        context = ' '.join(artist.name for artist in album.artist.all())
+        documents.append((rowid, album.title_normalized, normalize_text(context)))
+        texts.append((rowid, album.title_normalized))
+    # Users only live in the trigram index, under their user's id
+    for profile in UserProfile.objects.iterator(chunk_size=1000):
+        texts.append((profile.user_id * KIND_STRIDE + USER_CODE, profile.username_normalized))
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_INDEX_TABLE}')
+        cursor.executemany(f'INSERT INTO {SEARCH_INDEX_TABLE} (rowid, title, context) VALUES (%s, %s, %s)', documents)
+        cursor.executemany(f'INSERT INTO {TRIGRAM_INDEX_TABLE} (rowid, text) VALUES (%s, %s)', texts)
+        for table in (SEARCH_INDEX_TABLE, TRIGRAM_INDEX_TABLE):
+            cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {TRIGRAM_INDEX_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0013_search_index'),
+        ('authentication', '0012_userprofile_username_normalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='title_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='name_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='title_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_normalized_columns, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
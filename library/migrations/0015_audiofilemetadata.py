@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-16 22:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0014_normalized_search_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AudioFileMetadata',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quality', models.CharField(choices=[('lossless', 'lossless'), ('320kbps', '320kbps'), ('128kbps', '128kbps')], max_length=10)),
+                ('file_name', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('duration', models.DurationField(blank=True, null=True)),
+                ('bitrate', models.PositiveIntegerField(blank=True, help_text='Average bitrate in kbps', null=True)),
+                ('codec', models.CharField(blank=True, max_length=20)),
+                ('checksum', models.CharField(help_text='SHA-256 of the file contents', max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='audio_metadata', to='library.song')),
+            ],
+            options={
+                'unique_together': {('song', 'quality')},
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2 on 2026-10-16 22:41
+
+import secrets
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Inlined rather than imported from library.album_feed, so the migration
+# keeps filling the same positions whatever that module becomes
+FEED_SLOTS = 16
+KEY_BITS = 62
+
+
+def fill_feed_positions(apps, schema_editor):
+    Album = apps.get_model('library', 'Album')
+    AlbumFeedPosition = apps.get_model('library', 'AlbumFeedPosition')
+    AlbumFeedPosition.objects.bulk_create(
+        [
+            AlbumFeedPosition(slot=slot, key=secrets.randbits(KEY_BITS), album_id=album_id)
+            for album_id in Album.objects.values_list('pk', flat=True)
+            for slot in range(FEED_SLOTS)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0015_audiofilemetadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlbumFeedPosition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('key', models.BigIntegerField()),
+                ('album', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_positions', to='library.album')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['slot', 'key', 'album'], name='library_alb_slot_5b54ec_idx')],
+                'unique_together': {('slot', 'album')},
+            },
+        ),
+        migrations.RunPython(fill_feed_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-16 22:53
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0017_catalog_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AudioUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('quality', models.CharField(choices=[('lossless', 'lossless'), ('320kbps', '320kbps'), ('128kbps', '128kbps')], max_length=10)),
+                ('file_name', models.CharField(help_text='Original file name; its extension decides the stored one', max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('chunk_size', models.PositiveIntegerField()),
+                ('checksum', models.CharField(help_text='Expected SHA-256 of the whole file', max_length=64)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('complete', 'Complete')], default='pending', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='audio_uploads', to='library.song')),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-16 22:55
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0018_audio_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AudioJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target_quality', models.CharField(choices=[('lossless', 'lossless'), ('320kbps', '320kbps'), ('128kbps', '128kbps')], max_length=10)),
+                ('source_quality', models.CharField(blank=True, help_text="Quality the last attempt read from ('legacy' for the old audio field)", max_length=10)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Not claimed before this time (retry backoff)')),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('error', models.TextField(blank=True)),
+                ('output_size', models.BigIntegerField(blank=True, null=True)),
+                ('elapsed', models.FloatField(blank=True, help_text='Seconds spent transcoding', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='audio_jobs', to='library.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'available_at'], name='library_aud_status_503f75_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('song', 'target_quality'), name='unique_active_audio_job')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-16 23:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0020_media_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongWaveform',
+            fields=[
+                ('song', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='waveform', serialize=False, to='library.song')),
+                ('source_quality', models.CharField(help_text="Quality the peaks were read from ('legacy' for the old audio field)", max_length=10)),
+                ('file_name', models.CharField(max_length=255)),
+                ('buckets', models.PositiveIntegerField()),
+                ('peaks', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
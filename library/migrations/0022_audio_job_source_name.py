@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-16 23:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0021_song_waveform'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audiojob',
+            name='source_name',
+            field=models.CharField(blank=True, help_text='File the job derives the rendition from; a failed job is not queued again for the same file', max_length=255),
+        ),
+    ]
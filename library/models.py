@@ -1,7 +1,13 @@
 from django.db import models
+from django.utils import timezone
 import os
+import uuid
 
 from django.contrib.auth.models import User
+
+from symphonia.text import normalize_text
+
+from .signed_media import signed_url
     
 def song_audio_upload_path(instance, filename, quality):
     """
@@ -23,25 +29,57 @@ def high_quality_upload_path(instance, filename):
 def standard_quality_upload_path(instance, filename):
     return song_audio_upload_path(instance, filename, '128kbps')
 
+# Audio quality -> Song file field
+AUDIO_QUALITY_FIELDS = {
+    'lossless': 'audio_lossless',
+    '320kbps': 'audio_320kbps',
+    '128kbps': 'audio_128kbps',
+}
+
+def save_with_normalized(instance, source_field, normalized_field, save, *args, **kwargs):
+    """
+    Fill an accent-stripped, case-folded shadow column from source_field before saving
+    """
+    setattr(instance, normalized_field, normalize_text(getattr(instance, source_field)))
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None:
+        # Partial saves still count as modifications for conditional GETs
+        extra_fields = {'updated_at'}
+        if source_field in update_fields:
+            extra_fields.add(normalized_field)
+        kwargs['update_fields'] = {*update_fields, *extra_fields}
+    save(*args, **kwargs)
+
 class Artist(models.Model):
     name = models.CharField(max_length=255)
+    name_normalized = models.CharField(max_length=255, blank=True, editable=False, db_index=True)
     bio = models.TextField(blank=True, null=True)
     artist_picture = models.ImageField(upload_to='images/artist_picture/', blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def save(self, *args, **kwargs):
+        save_with_normalized(self, 'name', 'name_normalized', super().save, *args, **kwargs)
 
     def __str__(self):
         return self.name
     
 class Album(models.Model):
     title = models.CharField(max_length=255)
+    title_normalized = models.CharField(max_length=255, blank=True, editable=False, db_index=True)
     artist = models.ManyToManyField(Artist, related_name='albums')
     release_date = models.DateField(blank=True, null=True)
     cover_art = models.ImageField(upload_to='images/album_art/', blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def save(self, *args, **kwargs):
+        save_with_normalized(self, 'title', 'title_normalized', super().save, *args, **kwargs)
 
     def __str__(self):
         return self.title
     
 class Song(models.Model):
     title = models.CharField(max_length=255)
+    title_normalized = models.CharField(max_length=255, blank=True, editable=False, db_index=True)
     artist = models.ManyToManyField('Artist', related_name='songs')
     album = models.ManyToManyField('Album', related_name='songs')
     release_date = models.DateField(blank=True, null=True)
@@ -58,10 +96,16 @@ class Song(models.Model):
     
     liked_by = models.ManyToManyField(User, related_name='liked_songs', blank=True)
     lyric = models.JSONField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
-    def get_audio_url(self, quality='320kbps'):
+    def save(self, *args, **kwargs):
+        save_with_normalized(self, 'title', 'title_normalized', super().save, *args, **kwargs)
+
+    def get_audio_file(self, quality='320kbps'):
         """
-        Get audio URL for the requested quality with fallback logic
+        Get (served quality, audio file) for the requested quality with the
+        same fallback logic as get_audio_url; the served quality is 'legacy'
+        for the legacy audio field and None when there is no audio at all
         """
         quality_map = {
             'lossless': self.audio_lossless,
@@ -72,19 +116,26 @@ class Song(models.Model):
         # Try to get the requested quality
         audio_file = quality_map.get(quality)
         if audio_file and audio_file.name:
-            return audio_file.url
+            return quality, audio_file
         
         # Fallback to legacy audio field if no quality-specific file
         if self.audio and self.audio.name:
-            return self.audio.url
+            return 'legacy', self.audio
             
         # Fallback to any available quality (prioritize higher quality)
         for fallback_quality in ['lossless', '320kbps', '128kbps']:
             fallback_file = quality_map.get(fallback_quality)
             if fallback_file and fallback_file.name:
-                return fallback_file.url
+                return fallback_quality, fallback_file
                 
-        return None
+        return None, None
+
+    def get_audio_url(self, quality='320kbps'):
+        """
+        Get a signed, expiring audio URL for the requested quality with fallback logic
+        """
+        _, audio_file = self.get_audio_file(quality)
+        return signed_url(audio_file)
 
     def get_available_qualities(self):
         """
@@ -104,27 +155,197 @@ class Song(models.Model):
             
         return qualities
 
+    def get_audio_metadata(self, quality):
+        """
+        Stored metadata for the file currently set for quality, or None.
+        Reads the audio_metadata relation, so prefetch it when listing songs.
+        """
+        audio_file = getattr(self, AUDIO_QUALITY_FIELDS[quality], None) if quality in AUDIO_QUALITY_FIELDS else None
+        if not audio_file or not audio_file.name:
+            return None
+        for metadata in self.audio_metadata.all():
+            # Metadata recorded for a file that has since been replaced is stale
+            if metadata.quality == quality and metadata.file_name == audio_file.name:
+                return metadata
+        return None
+
     def get_file_size(self, quality='320kbps'):
         """
-        Get file size for the requested quality
+        Get file size for the requested quality from the stored metadata,
+        without touching storage
         """
-        quality_map = {
-            'lossless': self.audio_lossless,
-            '320kbps': self.audio_320kbps,
-            '128kbps': self.audio_128kbps,
-        }
-        
-        audio_file = quality_map.get(quality)
-        if audio_file and audio_file.name:
-            try:
-                return audio_file.size
-            except:
-                return 0
-        return 0
+        metadata = self.get_audio_metadata(quality)
+        return metadata.size if metadata else 0
 
     def __str__(self):
         return f"{self.title} by {', '.join([artist.name for artist in self.artist.all()])}"
     
+class AlbumFeedPosition(models.Model):
+    """
+    Precomputed shuffles of the album catalog for the home screen feed.
+    Each album gets an independent random key in every slot; a feed seed
+    picks a slot and a starting key, and pages are range reads on
+    (slot, key). Maintained by library/album_feed.py.
+    """
+    slot = models.PositiveSmallIntegerField()
+    key = models.BigIntegerField()
+    album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name='feed_positions')
+
+    class Meta:
+        unique_together = ('slot', 'album')
+        indexes = [models.Index(fields=['slot', 'key', 'album'])]
+
+    def __str__(self):
+        return f"{self.album_id} at {self.key} in slot {self.slot}"
+
+class AudioFileMetadata(models.Model):
+    """
+    Size, duration, bitrate, codec and checksum of one quality of a song's
+    audio, recorded when the file is stored so responses never stat or read
+    the media volume. Kept in sync by library/audio_metadata.py.
+    """
+    QUALITY_CHOICES = [(quality, quality) for quality in AUDIO_QUALITY_FIELDS]
+
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='audio_metadata')
+    quality = models.CharField(max_length=10, choices=QUALITY_CHOICES)
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    duration = models.DurationField(blank=True, null=True)
+    bitrate = models.PositiveIntegerField(blank=True, null=True, help_text="Average bitrate in kbps")
+    codec = models.CharField(max_length=20, blank=True)
+    checksum = models.CharField(max_length=64, help_text="SHA-256 of the file contents")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('song', 'quality')
+
+    def __str__(self):
+        return f"{self.song_id} {self.quality} ({self.codec}, {self.size} bytes)"
+
+class AudioUpload(models.Model):
+    """
+    A resumable, chunked upload of one quality of a song's audio. Chunks are
+    staged on local disk until the upload is finalized; the chunks received
+    so far are whatever has been written there (see library/chunked_upload.py).
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [(STATUS_PENDING, 'Pending'), (STATUS_COMPLETE, 'Complete')]
+    QUALITY_CHOICES = [(quality, quality) for quality in AUDIO_QUALITY_FIELDS]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='audio_uploads')
+    quality = models.CharField(max_length=10, choices=QUALITY_CHOICES)
+    file_name = models.CharField(max_length=255, help_text="Original file name; its extension decides the stored one")
+    size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    checksum = models.CharField(max_length=64, help_text="Expected SHA-256 of the whole file")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def chunk_count(self):
+        return -(-self.size // self.chunk_size)
+
+    def chunk_length(self, index):
+        """
+        Expected length of chunk index: chunk_size for all but the last one
+        """
+        if index < self.chunk_count - 1:
+            return self.chunk_size
+        return self.size - self.chunk_size * (self.chunk_count - 1)
+
+    def __str__(self):
+        return f"{self.song_id} {self.quality} upload {self.id} ({self.status})"
+
+class AudioJob(models.Model):
+    """
+    A queued transcode deriving one lower quality of a song's audio from the
+    best file it already has. Claimed and run by the transcode_audio
+    command; see library/transcoding.py.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = [STATUS_QUEUED, STATUS_RUNNING]
+    QUALITY_CHOICES = [(quality, quality) for quality in AUDIO_QUALITY_FIELDS]
+
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='audio_jobs')
+    target_quality = models.CharField(max_length=10, choices=QUALITY_CHOICES)
+    source_quality = models.CharField(max_length=10, blank=True, help_text="Quality the last attempt read from ('legacy' for the old audio field)")
+    source_name = models.CharField(max_length=255, blank=True, help_text="File the job derives the rendition from; a failed job is not queued again for the same file")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, help_text="Not claimed before this time (retry backoff)")
+    worker = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    output_size = models.BigIntegerField(blank=True, null=True)
+    elapsed = models.FloatField(blank=True, null=True, help_text="Seconds spent transcoding")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'available_at'])]
+        constraints = [
+            # At most one pending job per rendition
+            models.UniqueConstraint(
+                fields=['song', 'target_quality'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='unique_active_audio_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.song_id} {self.target_quality} job ({self.status}, {self.attempts} attempts)"
+
+class SongWaveform(models.Model):
+    """
+    Downsampled peaks of a song's audio for drawing seek bars: a (min, max)
+    pair of signed bytes per bucket, computed from the file named by
+    file_name by the compute_waveforms command; see library/waveform.py.
+    """
+    song = models.OneToOneField(Song, on_delete=models.CASCADE, primary_key=True, related_name='waveform')
+    source_quality = models.CharField(max_length=10, help_text="Quality the peaks were read from ('legacy' for the old audio field)")
+    file_name = models.CharField(max_length=255)
+    buckets = models.PositiveIntegerField()
+    peaks = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.song_id} waveform ({self.buckets} buckets from {self.source_quality})"
+
+class MediaBlob(models.Model):
+    """
+    One stored content blob of the content-addressed media store, with the
+    number of storage names that share it. Maintained by library/storage.py.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes, {self.ref_count} refs)"
+
+class MediaLink(models.Model):
+    """
+    A storage name (what file fields hold) and the blob its file shares
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+    blob = models.ForeignKey(MediaBlob, on_delete=models.PROTECT, related_name='links')
+
+    def __str__(self):
+        return f"{self.name} -> {self.blob_id[:12]}"
+
 class ListeningHistory(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='listening_history')
     song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='listening_history')
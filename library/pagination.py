@@ -0,0 +1,43 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CatalogCursorPagination(CursorPagination):
+    """
+    Default pagination for catalog listings: keyset pages on id, so every
+    page is one indexed range read however deep the client scrolls
+    """
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class CatalogPageNumberPagination(PageNumberPagination):
+    """
+    Numbered pages for clients that need to jump to a page or show a total
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not queryset.ordered:
+            queryset = queryset.order_by('id')
+        return super().paginate_queryset(queryset, request, view)
+
+
+class CatalogPaginationMixin:
+    """
+    Let catalog viewsets pick the pagination style with ?pagination=cursor
+    (the default) or ?pagination=page
+    """
+    pagination_classes = {
+        'cursor': CatalogCursorPagination,
+        'page': CatalogPageNumberPagination,
+    }
+
+    @property
+    def pagination_class(self):
+        request = getattr(self, 'request', None)
+        mode = request.query_params.get('pagination', 'cursor') if request is not None else 'cursor'
+        return self.pagination_classes.get(mode, CatalogCursorPagination)
@@ -0,0 +1,397 @@
+"""
+Search indexes for songs, artists, albums and users.
+
+Two SQLite FTS5 virtual tables are kept in sync by the signal handlers in
+library/signals.py (and authentication/models.py for users):
+
+- library_search_index: word index over normalized titles plus the artist
+  and album names attached to them, ranked with bm25.
+- library_search_trigram: character trigram index over the normalized
+  shadow columns, used for accentless substring and typo-tolerant matching.
+
+Each row's rowid encodes the object id and its kind, so updates and deletes
+are primary key lookups instead of scans over the virtual table.
+
+On database backends without FTS5 the index helpers are no-ops and callers
+fall back to icontains filtering on the normalized columns.
+"""
+import re
+
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+
+from symphonia.text import normalize_text
+
+SEARCH_INDEX_TABLE = 'library_search_index'
+TRIGRAM_INDEX_TABLE = 'library_search_trigram'
+
+KIND_SONG = 'song'
+KIND_ARTIST = 'artist'
+KIND_ALBUM = 'album'
+KIND_USER = 'user'
+
+# rowid = object_id * KIND_STRIDE + kind code
+KIND_CODES = {
+    KIND_USER: 0,
+    KIND_SONG: 1,
+    KIND_ARTIST: 2,
+    KIND_ALBUM: 3,
+}
+KIND_STRIDE = 4
+
+# Shadow column holding the normalized text of each indexed model
+NORMALIZED_FIELDS = {
+    KIND_SONG: 'title_normalized',
+    KIND_ARTIST: 'name_normalized',
+    KIND_ALBUM: 'title_normalized',
+    KIND_USER: 'username_normalized',
+}
+
+# bm25 column weights: a hit in the title outranks a hit in the context
+# (artist and album names attached to the document)
+TITLE_WEIGHT = 10.0
+CONTEXT_WEIGHT = 1.0
+
+# Fuzzy matching: how many trigram candidates to score, and the share of
+# the query's trigrams a candidate must contain to be returned
+FUZZY_CANDIDATES = 50
+FUZZY_THRESHOLD = 0.5
+
+# Estimated totals stop counting here
+ESTIMATE_CAP = 1000
+
+CURSOR_SALT = 'library.search.cursor'
+
+REBUILD_BATCH_SIZE = 1000
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def trigram_similarity(query, text):
+    """
+    Share of the query's trigrams found in text (1.0 means query is a substring)
+    """
+    query_trigrams = trigrams(query)
+    if not query_trigrams:
+        return 0.0
+    return len(query_trigrams & trigrams(text)) / len(query_trigrams)
+
+
+def is_available():
+    """
+    The FTS5 indexes are only created on SQLite (see migrations 0013 and 0014)
+    """
+    return connection.vendor == 'sqlite'
+
+
+def _rowid(kind, object_id):
+    return object_id * KIND_STRIDE + KIND_CODES[kind]
+
+
+def _object_id(rowid):
+    return rowid // KIND_STRIDE
+
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def build_match_expression(query):
+    """
+    Turn free text typed by a user into an FTS5 MATCH expression.
+    Every word must match; the last one is treated as a prefix so results
+    show up while the user is still typing.
+    """
+    tokens = _TOKEN_RE.findall(normalize_text(query))
+    if not tokens:
+        return None
+    terms = [_quote(token) for token in tokens[:-1]]
+    terms.append(_quote(tokens[-1]) + '*')
+    return ' '.join(terms)
+
+
+def song_document(song):
+    artist_names = [artist.name for artist in song.artist.all()]
+    album_titles = [album.title for album in song.album.all()]
+    return song.title_normalized, normalize_text(' '.join(artist_names + album_titles))
+
+
+def artist_document(artist):
+    return artist.name_normalized, ''
+
+
+def album_document(album):
+    return album.title_normalized, normalize_text(' '.join(artist.name for artist in album.artist.all()))
+
+
+DOCUMENT_BUILDERS = {
+    KIND_SONG: song_document,
+    KIND_ARTIST: artist_document,
+    KIND_ALBUM: album_document,
+}
+
+
+def index_object(kind, instance, object_id=None):
+    """
+    Insert or replace the index rows for a single object.
+    Users only live in the trigram index; pass object_id for them since the
+    indexed instance is the user's profile.
+    """
+    if not is_available():
+        return
+    rowid = _rowid(kind, object_id if object_id is not None else instance.pk)
+    with connection.cursor() as cursor:
+        if kind in DOCUMENT_BUILDERS:
+            title, context = DOCUMENT_BUILDERS[kind](instance)
+            cursor.execute(f'DELETE FROM {SEARCH_INDEX_TABLE} WHERE rowid = %s', [rowid])
+            cursor.execute(
+                f'INSERT INTO {SEARCH_INDEX_TABLE} (rowid, title, context) VALUES (%s, %s, %s)',
+                [rowid, title, context],
+            )
+        cursor.execute(f'DELETE FROM {TRIGRAM_INDEX_TABLE} WHERE rowid = %s', [rowid])
+        cursor.execute(
+            f'INSERT INTO {TRIGRAM_INDEX_TABLE} (rowid, text) VALUES (%s, %s)',
+            [rowid, getattr(instance, NORMALIZED_FIELDS[kind])],
+        )
+
+
+def index_objects(kind, instances):
+    for instance in instances:
+        index_object(kind, instance)
+
+
+def remove_object(kind, object_id):
+    if not is_available():
+        return
+    rowid = _rowid(kind, object_id)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_INDEX_TABLE} WHERE rowid = %s', [rowid])
+        cursor.execute(f'DELETE FROM {TRIGRAM_INDEX_TABLE} WHERE rowid = %s', [rowid])
+
+
+def rebuild(song_model, artist_model, album_model, profile_model=None, batch_size=REBUILD_BATCH_SIZE):
+    """
+    Drop every row and re-index the whole catalog in batches.
+    Models are passed in so data migrations can call this with historical models.
+    Returns a dict with the number of indexed objects per kind.
+    """
+    counts = {}
+    if not is_available():
+        return counts
+
+    sources = [
+        (KIND_SONG, song_model.objects.prefetch_related('artist', 'album')),
+        (KIND_ARTIST, artist_model.objects.all()),
+        (KIND_ALBUM, album_model.objects.prefetch_related('artist')),
+    ]
+    if profile_model is not None:
+        sources.append((KIND_USER, profile_model.objects.all()))
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_INDEX_TABLE}')
+        cursor.execute(f'DELETE FROM {TRIGRAM_INDEX_TABLE}')
+        for kind, queryset in sources:
+            builder = DOCUMENT_BUILDERS.get(kind)
+            normalized_field = NORMALIZED_FIELDS[kind]
+            # Profiles are indexed under their user's id
+            id_field = 'user_id' if kind == KIND_USER else 'pk'
+            documents, texts = [], []
+            counts[kind] = 0
+            for instance in queryset.order_by('pk').iterator(chunk_size=batch_size):
+                rowid = _rowid(kind, getattr(instance, id_field))
+                if builder:
+                    documents.append((rowid, *builder(instance)))
+                texts.append((rowid, getattr(instance, normalized_field)))
+                if len(texts) >= batch_size:
+                    _insert_rows(cursor, documents, texts)
+                    counts[kind] += len(texts)
+                    documents, texts = [], []
+            if texts:
+                _insert_rows(cursor, documents, texts)
+                counts[kind] += len(texts)
+        for table in (SEARCH_INDEX_TABLE, TRIGRAM_INDEX_TABLE):
+            cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+    return counts
+
+
+def _insert_rows(cursor, documents, texts):
+    if documents:
+        cursor.executemany(
+            f'INSERT INTO {SEARCH_INDEX_TABLE} (rowid, title, context) VALUES (%s, %s, %s)',
+            documents,
+        )
+    cursor.executemany(
+        f'INSERT INTO {TRIGRAM_INDEX_TABLE} (rowid, text) VALUES (%s, %s)',
+        texts,
+    )
+
+
+def _ranked_rows(table, score_expression, match, kind, after, limit, extra_where='', extra_params=(), columns=''):
+    """
+    Rows of table matching match for kind, ordered by (score, rowid) and
+    starting after the (score, rowid) position of a previous page
+    """
+    sql = (
+        f'SELECT rowid, score{columns} FROM ('
+        f'SELECT rowid, {score_expression} AS score{columns} FROM {table} '
+        f'WHERE {table} MATCH %s AND rowid %% {KIND_STRIDE} = %s{extra_where}'
+        f')'
+    )
+    params = [match, KIND_CODES[kind], *extra_params]
+    if after is not None:
+        sql += ' WHERE score > %s OR (score = %s AND rowid > %s)'
+        params += [after[0], after[0], after[1]]
+    sql += ' ORDER BY score, rowid LIMIT %s'
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _fuzzy_candidates(kind, normalized, words_match):
+    """
+    Ids of the trigram matches of normalized that are not word matches,
+    most similar first: accentless substrings, then typos. Only the
+    FUZZY_CANDIDATES best bm25 trigram matches are scored.
+    """
+    fuzzy_match = ' OR '.join(_quote(trigram) for trigram in sorted(trigrams(normalized)))
+    extra_where, extra_params = '', ()
+    if words_match:
+        # Word matches were already returned by the first stage
+        extra_where = f' AND rowid NOT IN (SELECT rowid FROM {SEARCH_INDEX_TABLE} WHERE {SEARCH_INDEX_TABLE} MATCH %s)'
+        extra_params = (words_match,)
+    rows = _ranked_rows(
+        TRIGRAM_INDEX_TABLE, f'bm25({TRIGRAM_INDEX_TABLE})', fuzzy_match, kind,
+        None, FUZZY_CANDIDATES, extra_where, extra_params, columns=', text',
+    )
+    scored = []
+    for rowid, _, text in rows:
+        similarity = trigram_similarity(normalized, text)
+        if similarity >= FUZZY_THRESHOLD:
+            scored.append((-similarity, rowid))
+    return [_object_id(rowid) for _, rowid in sorted(scored)]
+
+
+def search_page(kind, query, limit, after=None):
+    """
+    One page of the ranked results for query: objects whose words match
+    (best bm25 first), then objects that only match through trigrams,
+    i.e. accentless substrings and typos, most similar first.
+
+    after is the position returned for the previous page. Returns
+    (ids, position) where position is None once there is nothing left.
+
+    Word matches are paged on the (bm25 score, rowid) of the last one
+    returned. Scores depend on the whole index, so a catalog write between
+    two pages can move a result across the boundary, repeating or skipping
+    it. Trigram matches are scored once, when the word matches run out,
+    and the position carries the ids still to return, so their pages are
+    a snapshot.
+    """
+    if limit <= 0:
+        return [], None
+    words_match = build_match_expression(query) if kind in DOCUMENT_BUILDERS else None
+    stage, position = after if after is not None else ('words', None)
+    ids = []
+
+    if stage == 'words' and words_match:
+        rows = _ranked_rows(
+            SEARCH_INDEX_TABLE, f'bm25({SEARCH_INDEX_TABLE}, {TITLE_WEIGHT}, {CONTEXT_WEIGHT})',
+            words_match, kind, position, limit,
+        )
+        ids = [_object_id(rowid) for rowid, _ in rows]
+        if len(ids) == limit:
+            last_rowid, last_score = rows[-1]
+            return ids, ('words', (last_score, last_rowid))
+
+    if stage == 'trigrams':
+        remaining = position
+    else:
+        normalized = normalize_text(query)
+        # Queries shorter than three characters have no trigrams
+        remaining = _fuzzy_candidates(kind, normalized, words_match) if len(normalized) >= 3 else []
+
+    taken = limit - len(ids)
+    ids += remaining[:taken]
+    return ids, ('trigrams', remaining[taken:]) if remaining[taken:] else None
+
+
+def find_ids(kind, query, limit):
+    """
+    Ids of the best limit matches for query, best first
+    """
+    return search_page(kind, query, limit)[0]
+
+
+def estimate_total(kind, query):
+    """
+    Cheap upper-bounded count of the results of query: word matches plus
+    accentless substring matches, each count capped at ESTIMATE_CAP.
+    Typo-only matches are not counted.
+    """
+    words_match = build_match_expression(query) if kind in DOCUMENT_BUILDERS else None
+    normalized = normalize_text(query)
+    total = 0
+    with connection.cursor() as cursor:
+        if words_match:
+            cursor.execute(
+                f'SELECT count(*) FROM (SELECT 1 FROM {SEARCH_INDEX_TABLE} '
+                f'WHERE {SEARCH_INDEX_TABLE} MATCH %s AND rowid %% {KIND_STRIDE} = %s LIMIT %s)',
+                [words_match, KIND_CODES[kind], ESTIMATE_CAP],
+            )
+            total += cursor.fetchone()[0]
+        if len(normalized) >= 3:
+            sql = (
+                f'SELECT count(*) FROM (SELECT 1 FROM {TRIGRAM_INDEX_TABLE} '
+                f'WHERE {TRIGRAM_INDEX_TABLE} MATCH %s AND rowid %% {KIND_STRIDE} = %s'
+            )
+            params = [_quote(normalized), KIND_CODES[kind]]
+            if words_match:
+                sql += f' AND rowid NOT IN (SELECT rowid FROM {SEARCH_INDEX_TABLE} WHERE {SEARCH_INDEX_TABLE} MATCH %s)'
+                params.append(words_match)
+            cursor.execute(sql + ' LIMIT %s)', params + [ESTIMATE_CAP])
+            total += cursor.fetchone()[0]
+    return min(total, ESTIMATE_CAP)
+
+
+def cursor_max_age():
+    return getattr(settings, 'SEARCH_CURSOR_MAX_AGE', 60 * 60)
+
+
+def encode_cursor(kind, query, position, estimated_total):
+    """
+    Opaque, signed and timestamped cursor pointing after position in the
+    results of query
+    """
+    return signing.TimestampSigner(salt=CURSOR_SALT).sign_object(
+        {'k': kind, 'q': normalize_text(query), 'p': position, 't': estimated_total},
+        compress=True,
+    )
+
+
+def decode_cursor(cursor, kind, query):
+    """
+    Return (position, estimated_total) from a cursor made by encode_cursor
+    for the same kind and query, or None if it is invalid or older than
+    SEARCH_CURSOR_MAX_AGE seconds
+    """
+    try:
+        payload = signing.TimestampSigner(salt=CURSOR_SALT).unsign_object(cursor, max_age=cursor_max_age())
+    except signing.BadSignature:
+        return None
+    if payload.get('k') != kind or payload.get('q') != normalize_text(query):
+        return None
+    position = payload['p']
+    # JSON turns the position tuples into lists
+    if position[0] == 'words':
+        position = ('words', tuple(position[1]))
+    elif position[0] == 'trigrams':
+        position = ('trigrams', position[1])
+    else:
+        position = tuple(position)
+    return position, payload['t']
@@ -0,0 +1,111 @@
+"""
+Cache for SearchView results.
+
+Entries are keyed on the normalized query, the request parameters that shape
+the response and a global catalog version. The signal handlers in
+library/signals.py bump the version whenever a song, artist or album changes,
+so stale entries are never read again and simply age out of the backend.
+
+Everything goes through Django's cache API, so it works the same on the
+local-memory backend (per process) and on the file-based one (shared by all
+workers on a host, including the version counter).
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from symphonia.text import normalize_text
+
+CATALOG_VERSION_KEY = 'library:catalog_version'
+HITS_KEY = 'library:search_cache:hits'
+MISSES_KEY = 'library:search_cache:misses'
+
+
+def _cache():
+    return caches[getattr(settings, 'SEARCH_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'SEARCH_CACHE_TIMEOUT', 300)
+
+
+def catalog_version():
+    cache = _cache()
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Start from the clock rather than 1 so a counter that was evicted
+        # never comes back to a version older entries were stored under
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    cache = _cache()
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def _count(key):
+    cache = _cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def cache_key(query, **params):
+    payload = json.dumps([normalize_text(query), params], sort_keys=True, default=str)
+    digest = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    return f'library:search:{catalog_version()}:{digest}'
+
+
+def lookup(query, **params):
+    """
+    Return (key, cached results or None). The key is taken before any
+    results are computed, so a catalog change while they are being computed
+    files them under the version they were read from.
+    """
+    key = cache_key(query, **params)
+    results = _cache().get(key)
+    _count(HITS_KEY if results is not None else MISSES_KEY)
+    return key, results
+
+
+def store(key, results):
+    _cache().set(key, results, timeout=_timeout())
+
+
+def get_or_compute(query, compute, **params):
+    """
+    Return the cached results for query and params, or call compute()
+    and cache what it returns
+    """
+    key, results = lookup(query, **params)
+    if results is None:
+        results = compute()
+        store(key, results)
+    return results
+
+
+def stats():
+    cache = _cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / lookups if lookups else 0.0,
+        'catalog_version': cache.get(CATALOG_VERSION_KEY),
+    }
+
+
+def reset_stats():
+    _cache().delete_many([HITS_KEY, MISSES_KEY])
@@ -1,60 +1,208 @@
+from django.db import models
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from .models import Song, Artist, Album, Playlist, ListeningHistory
+from .signed_media import signed_url
+from . import thumbnails
 from datetime import timedelta
 
-class ArtistSerializer(serializers.ModelSerializer):
+def parse_field_selection(value):
+    """
+    Turn a ?fields= or ?expand= value such as "id,title,songs.title" into a
+    tree: {'id': {}, 'title': {}, 'songs': {'title': {}}}. Returns None when
+    there is no selection.
+    """
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return value
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+def field_selection(request):
+    """
+    (fields tree or None, expand tree) requested by the ?fields= and ?expand= query parameters.
+    Writes ignore them: a selection would drop input fields from validation
+    and expanding would turn writable relations read-only.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None, {}
+    return (
+        parse_field_selection(request.query_params.get('fields')),
+        parse_field_selection(request.query_params.get('expand')) or {},
+    )
+
+def nested_selection(selected, name):
+    """
+    Selection inside the nested field name: None for every field, {} when
+    the field itself is not selected
+    """
+    if selected is None:
+        return None
+    if name not in selected:
+        return {}
+    return selected[name] or None
+
+class SparseFieldsMixin:
+    """
+    Render only the fields named in ?fields= and replace the primary keys of
+    the relations named in ?expand= with nested objects. Dotted names select
+    inside nested serializers, e.g. ?fields=id,songs.title&expand=songs.album.
+    The selection can also be passed as fields=/expand= keyword arguments.
+
+    expandable_fields maps a field to the (serializer class, kwargs) used
+    when it is expanded. deferrable_fields maps a field to the model columns
+    only it reads, which views can defer when it is not requested (see
+    deferred_columns).
+    """
+    expandable_fields = {}
+    deferrable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        self._selection = (parse_field_selection(kwargs.pop('fields', None)), parse_field_selection(kwargs.pop('expand', None)))
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def deferred_columns(cls, selected):
+        if selected is None:
+            return []
+        return [
+            column
+            for name, columns in cls.deferrable_fields.items() if name not in selected
+            for column in columns
+        ]
+
+    def _is_root(self):
+        parent = self.parent
+        return parent is None or (parent.parent is None and isinstance(parent, serializers.ListSerializer))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected, expand = self._selection
+        if selected is None and expand is None and self._is_root():
+            selected, expand = field_selection(self.context.get('request'))
+        expand = expand or {}
+
+        for name, (serializer_class, options) in self.expandable_fields.items():
+            if name in expand and name in fields:
+                if isinstance(serializer_class, str):
+                    # Named to refer to serializers defined further down this module
+                    serializer_class = globals()[serializer_class]
+                fields[name] = serializer_class(read_only=True, **options)
+        if selected is not None:
+            fields = {name: field for name, field in fields.items() if name in selected}
+
+        # Hand the dotted sub-selections down to nested serializers
+        for name, field in fields.items():
+            child = getattr(field, 'child', field)
+            if isinstance(child, SparseFieldsMixin):
+                child._selection = (nested_selection(selected, name), expand.get(name) or {})
+        return fields
+
+class SignedURLMixin:
+    def to_representation(self, value):
+        return signed_url(value, self.context.get('request'))
+
+class SignedFileField(SignedURLMixin, serializers.FileField):
+    pass
+
+class SignedImageField(SignedURLMixin, serializers.ImageField):
+    pass
+
+class ThumbnailURLsField(serializers.ReadOnlyField):
+    """
+    Signed URLs of the fixed-size thumbnails of an image field, by size
+    (see library/thumbnails.py); source names the image field
+    """
+    def to_representation(self, value):
+        return thumbnails.urls(value, self.context.get('request'))
+
+class SignedMediaMixin:
+    """
+    Render the model's file and image fields as signed, expiring URLs (see
+    signed_media) instead of permanent /media/ paths
+    """
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.FileField: SignedFileField,
+        models.ImageField: SignedImageField,
+    }
+
+class ArtistSerializer(SparseFieldsMixin, SignedMediaMixin, serializers.ModelSerializer):
+    deferrable_fields = {'bio': ['bio']}
+
+    artist_picture_thumbnails = ThumbnailURLsField(source='artist_picture')
+
     class Meta:
         model = Artist
-        fields = ['id', 'name', 'bio', 'artist_picture']
+        fields = ['id', 'name', 'bio', 'artist_picture', 'artist_picture_thumbnails']
+
+class SimpleArtistSerializer(SparseFieldsMixin, SignedMediaMixin, serializers.ModelSerializer):
+    artist_picture_thumbnails = ThumbnailURLsField(source='artist_picture')
 
-class SimpleArtistSerializer(serializers.ModelSerializer):
     class Meta:
         model = Artist
-        fields = ['id', 'name', 'artist_picture']
+        fields = ['id', 'name', 'artist_picture', 'artist_picture_thumbnails']
+
+class AlbumSerializer(SparseFieldsMixin, SignedMediaMixin, serializers.ModelSerializer):
+    expandable_fields = {'songs': ('SimpleSongSerializer', {'many': True})}
 
-class AlbumSerializer(serializers.ModelSerializer):
     artist = ArtistSerializer(many=True)
     songs = serializers.SerializerMethodField()
+    cover_art_thumbnails = ThumbnailURLsField(source='cover_art')
 
     class Meta:
         model = Album
-        fields = ['id', 'title', 'artist', 'songs', 'release_date', 'cover_art']
+        fields = ['id', 'title', 'artist', 'songs', 'release_date', 'cover_art', 'cover_art_thumbnails']
 
     def get_songs(self, obj):
         return [
             {
                 'id': song.id,
                 'title': song.title,
-                'cover_art': song.cover_art.url if song.cover_art else None
+                'cover_art': signed_url(song.cover_art),
+                'cover_art_thumbnails': thumbnails.urls(song.cover_art),
             }
             for song in obj.songs.all()
         ]
     
-class SimpleAlbumSerializer(serializers.ModelSerializer):
+class SimpleAlbumSerializer(SparseFieldsMixin, SignedMediaMixin, serializers.ModelSerializer):
+    expandable_fields = {'artist': (SimpleArtistSerializer, {'many': True})}
+
+    cover_art_thumbnails = ThumbnailURLsField(source='cover_art')
+
     class Meta:
         model = Album
-        fields = ['id', 'title', 'artist', 'release_date', 'cover_art']
+        fields = ['id', 'title', 'artist', 'release_date', 'cover_art', 'cover_art_thumbnails']
+
+class SongSerializer(SparseFieldsMixin, SignedMediaMixin, serializers.ModelSerializer):
+    deferrable_fields = {'lyric': ['lyric']}
 
-class SongSerializer(serializers.ModelSerializer):
     artist = SimpleArtistSerializer(many=True) 
     album = SimpleAlbumSerializer(many=True)
     available_qualities = serializers.SerializerMethodField()
     audio_urls = serializers.SerializerMethodField()
     audio_file_sizes = serializers.SerializerMethodField()
+    cover_art_thumbnails = ThumbnailURLsField(source='cover_art')
 
     class Meta:
         model = Song
-        fields = ['id', 'title', 'artist', 'album', 'release_date', 'duration', 'cover_art', 'audio', 'audio_urls', 'available_qualities', 'audio_file_sizes', 'lyric']
+        fields = ['id', 'title', 'artist', 'album', 'release_date', 'duration', 'cover_art', 'cover_art_thumbnails', 'audio', 'audio_urls', 'available_qualities', 'audio_file_sizes', 'lyric']
 
     def get_available_qualities(self, obj):
         return obj.get_available_qualities()
     
     def get_audio_urls(self, obj):
         return {
-            'lossless': obj.audio_lossless.url if obj.audio_lossless and obj.audio_lossless.name else None,
-            '320kbps': obj.audio_320kbps.url if obj.audio_320kbps and obj.audio_320kbps.name else None,
-            '128kbps': obj.audio_128kbps.url if obj.audio_128kbps and obj.audio_128kbps.name else None,
-            'legacy': obj.audio.url if obj.audio and obj.audio.name else None,
+            'lossless': signed_url(obj.audio_lossless),
+            '320kbps': signed_url(obj.audio_320kbps),
+            '128kbps': signed_url(obj.audio_128kbps),
+            'legacy': signed_url(obj.audio),
         }
     
     def get_audio_file_sizes(self, obj):
@@ -64,17 +212,20 @@ class SongSerializer(serializers.ModelSerializer):
             '128kbps': obj.get_file_size('128kbps'),
         }
 
-class SimpleSongSerializer(serializers.ModelSerializer):
+class SimpleSongSerializer(SparseFieldsMixin, SignedMediaMixin, serializers.ModelSerializer):
+    deferrable_fields = {'lyric': ['lyric']}
+
     artist = serializers.SerializerMethodField()
     album = serializers.SerializerMethodField()
     cover_art = serializers.SerializerMethodField()
     duration_seconds = serializers.SerializerMethodField()
     available_qualities = serializers.SerializerMethodField()
     audio_urls = serializers.SerializerMethodField()
+    cover_art_thumbnails = ThumbnailURLsField(source='cover_art')
 
     class Meta:
         model = Song
-        fields = ['id', 'title', 'artist', 'album', 'release_date', 'cover_art', 'audio', 'audio_urls', 'available_qualities', 'lyric', 'duration_seconds']
+        fields = ['id', 'title', 'artist', 'album', 'release_date', 'cover_art', 'cover_art_thumbnails', 'audio', 'audio_urls', 'available_qualities', 'lyric', 'duration_seconds']
 
     def get_artist(self, obj):
         return [{'id': artist.id, 'name': artist.name} for artist in obj.artist.all()]
@@ -83,7 +234,7 @@ class SimpleSongSerializer(serializers.ModelSerializer):
         return [{'id': album.id, 'title': album.title, 'release_date': album.release_date} for album in obj.album.all()]
     
     def get_cover_art(self, obj):
-        return obj.cover_art.url if obj.cover_art else None
+        return signed_url(obj.cover_art)
     
     def get_duration_seconds(self, obj):
         if obj.duration:
@@ -95,31 +246,76 @@ class SimpleSongSerializer(serializers.ModelSerializer):
     
     def get_audio_urls(self, obj):
         return {
-            'lossless': obj.audio_lossless.url if obj.audio_lossless and obj.audio_lossless.name else None,
-            '320kbps': obj.audio_320kbps.url if obj.audio_320kbps and obj.audio_320kbps.name else None,
-            '128kbps': obj.audio_128kbps.url if obj.audio_128kbps and obj.audio_128kbps.name else None,
-            'legacy': obj.audio.url if obj.audio and obj.audio.name else None,
+            'lossless': signed_url(obj.audio_lossless),
+            '320kbps': signed_url(obj.audio_320kbps),
+            '128kbps': signed_url(obj.audio_128kbps),
+            'legacy': signed_url(obj.audio),
         }
 
-class PlaylistSerializer(serializers.ModelSerializer):
+class SearchSongSerializer(SignedMediaMixin, serializers.ModelSerializer):
+    """
+    Compact song representation for search results. Reads artists and albums
+    from prefetched relations and never touches storage: no lyrics, audio URLs
+    or file sizes.
+    """
+    artist = serializers.SerializerMethodField()
+    album = serializers.SerializerMethodField()
+    duration_seconds = serializers.SerializerMethodField()
+    available_qualities = serializers.SerializerMethodField()
+    cover_art_thumbnails = ThumbnailURLsField(source='cover_art')
+
+    class Meta:
+        model = Song
+        fields = ['id', 'title', 'artist', 'album', 'release_date', 'cover_art', 'cover_art_thumbnails', 'duration_seconds', 'available_qualities']
+
+    def get_artist(self, obj):
+        return [{'id': artist.id, 'name': artist.name} for artist in obj.artist.all()]
+
+    def get_album(self, obj):
+        return [{'id': album.id, 'title': album.title} for album in obj.album.all()]
+
+    def get_duration_seconds(self, obj):
+        if obj.duration:
+            return int(obj.duration.total_seconds())
+        return 0
+
+    def get_available_qualities(self, obj):
+        return obj.get_available_qualities()
+
+class SearchAlbumSerializer(SignedMediaMixin, serializers.ModelSerializer):
+    artist = serializers.SerializerMethodField()
+    cover_art_thumbnails = ThumbnailURLsField(source='cover_art')
+
+    class Meta:
+        model = Album
+        fields = ['id', 'title', 'artist', 'release_date', 'cover_art', 'cover_art_thumbnails']
+
+    def get_artist(self, obj):
+        return [{'id': artist.id, 'name': artist.name} for artist in obj.artist.all()]
+
+class PlaylistSerializer(SparseFieldsMixin, SignedMediaMixin, serializers.ModelSerializer):
+    expandable_fields = {'songs': (SimpleSongSerializer, {'many': True})}
+
     songs = serializers.PrimaryKeyRelatedField(queryset=Song.objects.all(), many=True, required=False)
+    cover_image_thumbnails = ThumbnailURLsField(source='cover_image')
 
     class Meta:
         model = Playlist
-        fields = ['id', 'owner', 'name', 'description', 'songs', 'cover_image', 'created_at', 'updated_at', 'share_permission']
+        fields = ['id', 'owner', 'name', 'description', 'songs', 'cover_image', 'cover_image_thumbnails', 'created_at', 'updated_at', 'share_permission']
         read_only_fields = ['id', 'owner', 'created_at', 'updated_at']
 
-class PlaylistDetailSerializer(serializers.ModelSerializer):
+class PlaylistDetailSerializer(SparseFieldsMixin, SignedMediaMixin, serializers.ModelSerializer):
     songs = SimpleSongSerializer(many=True, read_only=True)
     owner_name = serializers.SerializerMethodField()
     owner_avatar_url = serializers.SerializerMethodField()
     total_duration_seconds = serializers.SerializerMethodField()
     songs_count = serializers.SerializerMethodField()
     cover_image_url = serializers.SerializerMethodField()
+    cover_image_thumbnails = ThumbnailURLsField(source='cover_image')
 
     class Meta:
         model = Playlist
-        fields = ['id', 'owner', 'owner_name', 'owner_avatar_url', 'name', 'description', 'songs', 'cover_image', 'cover_image_url', 'created_at', 'updated_at', 'share_permission', 'total_duration_seconds', 'songs_count']
+        fields = ['id', 'owner', 'owner_name', 'owner_avatar_url', 'name', 'description', 'songs', 'cover_image', 'cover_image_url', 'cover_image_thumbnails', 'created_at', 'updated_at', 'share_permission', 'total_duration_seconds', 'songs_count']
         read_only_fields = ['id', 'owner', 'created_at', 'updated_at']
 
     def get_owner_name(self, obj):
@@ -139,9 +335,9 @@ class PlaylistDetailSerializer(serializers.ModelSerializer):
         return obj.songs.count()
     
     def get_cover_image_url(self, obj):
-        return obj.cover_image.url if obj.cover_image else None
+        return signed_url(obj.cover_image)
 
-class ListeningHistorySerializer(serializers.ModelSerializer):
+class ListeningHistorySerializer(SparseFieldsMixin, SignedMediaMixin, serializers.ModelSerializer):
     song = serializers.SerializerMethodField()
 
     class Meta:
@@ -152,5 +348,6 @@ class ListeningHistorySerializer(serializers.ModelSerializer):
         return {
             'id': obj.song.id,
             'title': obj.song.title,
-            'cover_art': obj.song.cover_art.url if obj.song.cover_art else None,
+            'cover_art': signed_url(obj.song.cover_art),
+            'cover_art_thumbnails': thumbnails.urls(obj.song.cover_art),
         }
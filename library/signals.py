@@ -0,0 +1,191 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from authentication.models import UserProfile
+
+from . import album_feed, audio_metadata, search, search_cache, thumbnails, transcoding
+from .autocomplete import prefix_index
+from .models import Song, Artist, Album, Playlist
+
+SEARCH_KINDS = {
+    Song: search.KIND_SONG,
+    Artist: search.KIND_ARTIST,
+    Album: search.KIND_ALBUM,
+}
+
+# Keep the full-text search index in sync with the catalog
+
+@receiver(post_save, sender=Song)
+def index_song(sender, instance, **kwargs):
+    search.index_object(search.KIND_SONG, instance)
+
+@receiver(post_save, sender=Album)
+def index_album(sender, instance, created, **kwargs):
+    search.index_object(search.KIND_ALBUM, instance)
+    if not created:
+        # Songs carry their album titles in the index
+        search.index_objects(search.KIND_SONG, instance.songs.all())
+
+@receiver(post_save, sender=Artist)
+def index_artist(sender, instance, created, **kwargs):
+    search.index_object(search.KIND_ARTIST, instance)
+    if not created:
+        # Songs and albums carry their artist names in the index
+        search.index_objects(search.KIND_SONG, instance.songs.all())
+        search.index_objects(search.KIND_ALBUM, instance.albums.all())
+
+@receiver(pre_delete, sender=Artist)
+@receiver(pre_delete, sender=Album)
+def remember_indexed_relations(sender, instance, **kwargs):
+    # The m2m rows are gone by post_delete, so collect dependents now
+    instance._search_song_ids = list(instance.songs.values_list('pk', flat=True))
+    instance._search_album_ids = list(instance.albums.values_list('pk', flat=True)) if sender is Artist else []
+
+@receiver(post_delete, sender=Song)
+def unindex_song(sender, instance, **kwargs):
+    search.remove_object(search.KIND_SONG, instance.pk)
+
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Album)
+def unindex_artist_or_album(sender, instance, **kwargs):
+    search.remove_object(SEARCH_KINDS[sender], instance.pk)
+    search.index_objects(search.KIND_SONG, Song.objects.filter(pk__in=getattr(instance, '_search_song_ids', [])))
+    search.index_objects(search.KIND_ALBUM, Album.objects.filter(pk__in=getattr(instance, '_search_album_ids', [])))
+
+def _reindex_m2m(kind, model, instance, action, reverse, pk_set, related_name):
+    """
+    Re-index the objects on the indexed side of an m2m relation.
+    When the change comes from the reverse side (e.g. artist.songs.add()),
+    the affected objects are those in pk_set, or every related object on clear.
+    """
+    if reverse and action == 'pre_clear':
+        # pk_set is None on clear, remember who is about to lose the relation
+        instance._search_cleared_ids = list(getattr(instance, related_name).values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        search.index_object(kind, instance)
+        return
+
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_search_cleared_ids', [])
+    search.index_objects(kind, model.objects.filter(pk__in=pk_set))
+
+@receiver(m2m_changed, sender=Song.artist.through)
+@receiver(m2m_changed, sender=Song.album.through)
+def index_song_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    _reindex_m2m(search.KIND_SONG, Song, instance, action, reverse, pk_set, 'songs')
+
+@receiver(m2m_changed, sender=Album.artist.through)
+def index_album_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    _reindex_m2m(search.KIND_ALBUM, Album, instance, action, reverse, pk_set, 'albums')
+
+# Users are indexed by username, which their profile keeps normalized
+
+@receiver(post_save, sender=UserProfile)
+def index_user_profile(sender, instance, **kwargs):
+    search.index_object(search.KIND_USER, instance, object_id=instance.user_id)
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    search.remove_object(search.KIND_USER, instance.pk)
+
+# Keep the autocomplete prefix index in sync
+
+@receiver(post_save, sender=Song)
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Album)
+def update_autocomplete(sender, instance, **kwargs):
+    kind = SEARCH_KINDS[sender]
+    prefix_index.update(kind, instance.pk, getattr(instance, 'name' if kind == search.KIND_ARTIST else 'title'))
+
+@receiver(post_delete, sender=Song)
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Album)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    prefix_index.remove(SEARCH_KINDS[sender], instance.pk)
+
+# Give new albums their place in the shuffled home screen feed
+
+@receiver(post_save, sender=Album)
+def add_album_to_feed(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        album_feed.add_albums([instance.pk])
+
+# Record size, duration, bitrate and checksum of newly stored audio files.
+# Runs before the catalog version bump so cached responses never keep stale sizes.
+
+@receiver(post_save, sender=Song)
+def sync_audio_metadata(sender, instance, raw=False, **kwargs):
+    if not raw:
+        audio_metadata.sync(instance)
+
+# Derive the 320kbps/128kbps renditions a song is missing in the background
+# (see library/transcoding.py and the transcode_audio command)
+
+@receiver(post_save, sender=Song)
+def queue_missing_renditions(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transcoding.enqueue_missing(instance)
+
+# Make the fixed-size thumbnails of newly stored artwork (see library/thumbnails.py)
+
+@receiver(post_save, sender=Song)
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Playlist)
+def make_thumbnails(sender, instance, raw=False, **kwargs):
+    if not raw:
+        thumbnails.generate_for(instance)
+
+# Relation changes don't save the model that declares them, but they change
+# its representation: move its updated_at for conditional GETs
+
+# m2m through model -> accessor from the other side back to the declaring model
+TOUCHED_RELATIONS = {
+    Song.artist.through: 'songs',
+    Song.album.through: 'songs',
+    Album.artist.through: 'albums',
+    Playlist.songs.through: 'playlists',
+}
+
+@receiver(m2m_changed, sender=Song.artist.through)
+@receiver(m2m_changed, sender=Song.album.through)
+@receiver(m2m_changed, sender=Album.artist.through)
+@receiver(m2m_changed, sender=Playlist.songs.through)
+def touch_relation_owner(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # pk_set is None on clear, remember who is about to lose the relation
+        instance._touch_cleared_ids = list(getattr(instance, TOUCHED_RELATIONS[sender]).values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        type(instance).objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_touch_cleared_ids', [])
+    model.objects.filter(pk__in=pk_set).update(updated_at=timezone.now())
+
+# Any catalog change invalidates cached search results
+
+@receiver(post_save, sender=Song)
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Song)
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Album)
+def bump_catalog_version(sender, **kwargs):
+    search_cache.bump_catalog_version()
+
+@receiver(m2m_changed, sender=Song.artist.through)
+@receiver(m2m_changed, sender=Song.album.through)
+@receiver(m2m_changed, sender=Album.artist.through)
+def bump_catalog_version_on_relations(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        search_cache.bump_catalog_version()
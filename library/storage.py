@@ -0,0 +1,218 @@
+"""
+Content-addressed, deduplicating media storage.
+
+ContentAddressedStorage is a FileSystemStorage that keeps every distinct
+file content once, as a blob named by its SHA-256 under MEDIA_BLOB_DIR, and
+makes each stored name a hardlink to its blob. MEDIA_BLOB_DIR belongs
+outside MEDIA_ROOT, so whatever serves MEDIA_ROOT never serves a blob by
+its hash, and on the same filesystem, so the links are possible. Names, URLs, storage.path()
+and the proxy offload work as before; saving bytes that are already stored
+only adds a link. MediaBlob rows count the names sharing each blob and
+MediaLink rows record which blob a name uses.
+
+Deleting a name removes its link and decrements the count; blobs nobody
+references any more are removed by the reclaim_media command, which can
+also fold files stored before this backend into the blob store.
+
+Where hardlinks aren't possible (another filesystem, no support) names get
+a plain copy of the blob and still count as references.
+
+Names sharing a blob are the same inode: writing to one in place (opening
+storage.path(name) or storage.open(name) for writing or appending) changes
+every other name and the blob with it. Replace stored files by deleting
+the name and saving it again, as the rest of the app does.
+"""
+import contextlib
+import hashlib
+import os
+import shutil
+import uuid
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+from .models import MediaBlob, MediaLink
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fileobj:
+        while block := fileobj.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    @property
+    def blob_root(self):
+        return getattr(settings, 'MEDIA_BLOB_DIR', os.path.join(settings.BASE_DIR, 'media_blobs'))
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blob_root, sha256[:2], sha256[2:4], sha256)
+
+    def _stage(self, content):
+        """
+        Write content to a temporary file in the blob store: (path, sha256, size)
+        """
+        os.makedirs(self.blob_root, exist_ok=True)
+        staged = os.path.join(self.blob_root, f'.incoming-{uuid.uuid4().hex}')
+        if hasattr(content, 'temporary_file_path'):
+            # Already on disk (uploads, assembled chunks, transcodes): move, don't copy
+            file_move_safe(content.temporary_file_path(), staged)
+            return staged, _hash_file(staged), os.path.getsize(staged)
+
+        digest, size = hashlib.sha256(), 0
+        with open(staged, 'wb') as out:
+            for chunk in content.chunks():
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        return staged, digest.hexdigest(), size
+
+    def _store_blob(self, staged, sha256, size):
+        """
+        Keep staged as the blob for sha256 unless it is already stored, and
+        count one more reference to it
+        """
+        with transaction.atomic():
+            MediaBlob.objects.get_or_create(sha256=sha256, defaults={'size': size})
+            # Counted before the file is linked, so reclaim_media never removes it underneath
+            MediaBlob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1)
+        blob_path = self.blob_path(sha256)
+        if os.path.exists(blob_path):
+            os.remove(staged)
+            return blob_path
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(staged, blob_path)
+        if self.file_permissions_mode is not None:
+            os.chmod(blob_path, self.file_permissions_mode)
+        return blob_path
+
+    def _link_or_copy(self, blob_path, full_path):
+        try:
+            os.link(blob_path, full_path)
+        except FileExistsError:
+            raise
+        except OSError:
+            # No hardlinks here: a copy still keeps the reference counted
+            with open(blob_path, 'rb') as source, open(full_path, 'xb') as target:
+                shutil.copyfileobj(source, target)
+
+    def _match_location(self, full_path):
+        """
+        Give a new name the mode and group FileSystemStorage gives the files
+        it saves. A link shares them with its blob and every other name.
+        """
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        if os.name == 'posix':
+            location_gid = os.stat(self.location).st_gid
+            if os.stat(full_path).st_gid != location_gid:
+                # Allowed only when the file's owner belongs to the group
+                with contextlib.suppress(PermissionError):
+                    os.chown(full_path, -1, location_gid)
+
+    def _link(self, blob_path, name):
+        """
+        Make name a link to blob_path, picking another name if it is taken;
+        returns the name used
+        """
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        while True:
+            try:
+                self._link_or_copy(blob_path, full_path)
+            except FileExistsError:
+                name = self.get_available_name(name)
+                full_path = self.path(name)
+            else:
+                break
+        self._match_location(full_path)
+        return os.path.relpath(full_path, self.location).replace('\\', '/')
+
+    def _record(self, name, sha256):
+        MediaLink.objects.update_or_create(name=name, defaults={'blob_id': sha256})
+
+    def _save(self, name, content):
+        staged, sha256, size = self._stage(content)
+        name = self._link(self._store_blob(staged, sha256, size), name)
+        self._record(name, sha256)
+        return name
+
+    def delete(self, name):
+        super().delete(name)
+        with transaction.atomic():
+            link = MediaLink.objects.filter(name=name).first()
+            if link is not None:
+                link.delete()
+                MediaBlob.objects.filter(sha256=link.blob_id).update(ref_count=F('ref_count') - 1)
+
+    def adopt(self, name):
+        """
+        Fold a file stored without this backend into the blob store. If its
+        content is already stored it is replaced by a link to that blob.
+        Returns the bytes this saves.
+        """
+        link = MediaLink.objects.filter(name=name).first()
+        if link is not None:
+            return 0
+        full_path = self.path(name)
+        sha256, size = _hash_file(full_path), os.path.getsize(full_path)
+        with transaction.atomic():
+            MediaBlob.objects.get_or_create(sha256=sha256, defaults={'size': size})
+            MediaBlob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1)
+        blob_path = self.blob_path(sha256)
+
+        saved = 0
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            try:
+                os.link(full_path, blob_path)
+            except OSError:
+                shutil.copyfile(full_path, blob_path)
+        elif not os.path.samefile(blob_path, full_path):
+            # Swap the duplicate for a link to the blob in one rename
+            replacement = f'{full_path}.{uuid.uuid4().hex}.tmp'
+            try:
+                os.link(blob_path, replacement)
+            except OSError:
+                pass
+            else:
+                os.replace(replacement, full_path)
+                saved = size
+        self._record(name, sha256)
+        return saved
+
+    def duplicate(self, source_name, name):
+        """
+        Store the content of source_name under name (or an available variant)
+        without copying it; returns the name used
+        """
+        link = MediaLink.objects.filter(name=source_name).first()
+        if link is None:
+            self.adopt(source_name)
+            link = MediaLink.objects.get(name=source_name)
+        MediaBlob.objects.filter(sha256=link.blob_id).update(ref_count=F('ref_count') + 1)
+        name = self._link(self.blob_path(link.blob_id), self.get_available_name(name))
+        self._record(name, link.blob_id)
+        return name
+
+
+def share_file(field_file, name):
+    """
+    Store field_file's content under name (made available) and return the
+    name used. Shares the stored blob when the storage deduplicates,
+    copies otherwise.
+    """
+    storage = field_file.storage
+    if hasattr(storage, 'duplicate'):
+        return storage.duplicate(field_file.name, name)
+    with field_file.open('rb') as source:
+        return storage.save(name, source)
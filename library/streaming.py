@@ -0,0 +1,214 @@
+"""
+Media file responses with HTTP Range support.
+
+A request without a usable Range header gets the whole file through
+FileResponse, which lets the server use wsgi.file_wrapper (sendfile) where
+it has one. Single ranges get a 206 with Content-Range; multiple ranges
+get a multipart/byteranges body. Range bodies are read in
+STREAM_CHUNK_SIZE blocks, so seeking in a large file never reads more than
+the requested bytes. If-Range, If-None-Match and If-Modified-Since are
+honoured with the file's ETag and modification time.
+"""
+import mimetypes
+import os
+import re
+import secrets
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.negotiation import BaseContentNegotiation
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Requests with more ranges than this are answered with the whole file
+MAX_RANGES = 16
+
+CONTENT_TYPES = {
+    '.mp3': 'audio/mpeg',
+    '.flac': 'audio/flac',
+    '.wav': 'audio/wav',
+    '.m4a': 'audio/mp4',
+}
+
+RANGE_SPEC = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def content_type_for(name):
+    extension = os.path.splitext(name)[1].lower()
+    return CONTENT_TYPES.get(extension) or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+class StreamContentNegotiation(BaseContentNegotiation):
+    """
+    Media players and image tags send Accept headers (audio/*, image/*)
+    that no API renderer matches; render errors with the first renderer
+    instead of refusing
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0] if parsers else None
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+def parse_range_header(header, size):
+    """
+    Return the byte ranges of a Range header as sorted, merged, inclusive
+    (start, end) pairs; [] if none of them can be satisfied; None when the
+    header is missing, malformed or asks for too many ranges, in which case
+    the whole file is served.
+    """
+    if not header:
+        return None
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        match = RANGE_SPEC.match(spec)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first == '':
+            # Suffix range: the last n bytes
+            length = int(last)
+            if length == 0:
+                continue
+            ranges.append((max(size - length, 0), size - 1))
+            continue
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Strong comparison only: weak validators never match
+        return etag is not None and if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and last_modified is not None and date == last_modified
+
+
+def _read_range(fileobj, start, end):
+    fileobj.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = fileobj.read(min(STREAM_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _single_range_body(fileobj, start, end):
+    try:
+        yield from _read_range(fileobj, start, end)
+    finally:
+        fileobj.close()
+
+
+def _multipart_body(fileobj, parts, boundary):
+    try:
+        for header, (start, end) in parts:
+            yield header
+            yield from _read_range(fileobj, start, end)
+        yield f'\r\n--{boundary}--\r\n'.encode('ascii')
+    finally:
+        fileobj.close()
+
+
+def file_validators(field_file, size, checksum=None):
+    """
+    (strong ETag, Last-Modified timestamp or None) for a stored file. The
+    content checksum makes the best ETag; size and mtime stand in without it.
+    """
+    try:
+        last_modified = int(field_file.storage.get_modified_time(field_file.name).timestamp())
+    except NotImplementedError:
+        last_modified = None
+    if checksum:
+        return f'"{checksum}"', last_modified
+    return f'"{size:x}-{last_modified or 0:x}"', last_modified
+
+
+def file_response(request, field_file, checksum=None):
+    """
+    Serve a stored FieldFile, honouring Range, If-Range and conditional
+    headers. Raises OSError (e.g. FileNotFoundError) if the file is missing.
+    """
+    storage, name = field_file.storage, field_file.name
+    size = storage.size(name)
+    etag, last_modified = file_validators(field_file, size, checksum)
+    content_type = content_type_for(name)
+
+    ranges = None
+    if _if_range_matches(request, etag, last_modified):
+        ranges = parse_range_header(request.META.get('HTTP_RANGE'), size)
+
+    if ranges is None:
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=content_type)
+        else:
+            response = FileResponse(storage.open(name, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(size)
+    elif not ranges:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        if request.method == 'HEAD':
+            response = HttpResponse(status=206, content_type=content_type)
+        else:
+            body = _single_range_body(storage.open(name, 'rb'), start, end)
+            response = StreamingHttpResponse(body, status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        boundary = secrets.token_hex(16)
+        parts = [
+            (
+                f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'.encode('ascii'),
+                (start, end),
+            )
+            for start, end in ranges
+        ]
+        length = sum(len(header) + end - start + 1 for header, (start, end) in parts)
+        length += len(f'\r\n--{boundary}--\r\n')
+        multipart_type = f'multipart/byteranges; boundary={boundary}'
+        if request.method == 'HEAD':
+            response = HttpResponse(status=206, content_type=multipart_type)
+        else:
+            body = _multipart_body(storage.open(name, 'rb'), parts, boundary)
+            response = StreamingHttpResponse(body, status=206, content_type=multipart_type)
+        response['Content-Length'] = str(length)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
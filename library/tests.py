@@ -1,3 +1,922 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import wave
+from array import array
+from datetime import timedelta
+from unittest import mock, skipIf
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+import msgpack
+from PIL import Image
+from rest_framework.test import APIClient
+
+from authentication.models import Friendship
+from symphonia.text import normalize_text
+
+from .models import Song, Artist, Album, AlbumFeedPosition, AudioFileMetadata, AudioJob, MediaBlob, Playlist, SharingPermission
+from . import album_feed, audio_metadata, autocomplete, search, search_cache, signed_media, thumbnails, transcoding, waveform
+
+
+class TempMediaRootMixin:
+    """
+    Point MEDIA_ROOT, MEDIA_BLOB_DIR and any other directory settings in
+    temp_settings at fresh temporary directories for each test
+    """
+    temp_settings = ('MEDIA_ROOT', 'MEDIA_BLOB_DIR')
+
+    def setUp(self):
+        super().setUp()
+        for name in self.temp_settings:
+            directory = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, directory)
+            settings_override = override_settings(**{name: directory})
+            settings_override.enable()
+            self.addCleanup(settings_override.disable)
+
+
+class SearchIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.artist = Artist.objects.create(name='Sơn Tùng M-TP')
+        cls.album = Album.objects.create(title='Sky Tour')
+        cls.song = Song.objects.create(title='Lạc Trôi')
+        cls.song.artist.add(cls.artist)
+        cls.song.album.add(cls.album)
+
+    def song_ids(self, query):
+        return search.find_ids(search.KIND_SONG, query, 10)
+
+    def test_songs_match_on_title_artist_and_album_words(self):
+        self.assertEqual(self.song_ids('lac troi'), [self.song.id])
+        self.assertEqual(self.song_ids('son tung'), [self.song.id])
+        self.assertEqual(self.song_ids('sky tour'), [self.song.id])
+        # Title hits outrank context hits
+        sky = Song.objects.create(title='Sky')
+        self.assertEqual(self.song_ids('sky'), [sky.id, self.song.id])
+
+    def test_saves_relation_changes_and_deletes_update_the_index(self):
+        self.artist.name = 'Hoàng Thùy Linh'
+        self.artist.save()
+        self.assertEqual(self.song_ids('hoang thuy'), [self.song.id])
+        self.assertEqual(self.song_ids('son tung'), [])
+
+        other = Artist.objects.create(name='Đen Vâu')
+        self.song.artist.add(other)
+        self.assertEqual(self.song_ids('den vau'), [self.song.id])
+        other.songs.clear()
+        self.assertEqual(self.song_ids('den vau'), [])
+
+        self.album.delete()
+        self.assertEqual(self.song_ids('sky tour'), [])
+        self.song.delete()
+        self.assertEqual(self.song_ids('lac troi'), [])
+
+    def test_rebuild_command_restores_the_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.SEARCH_INDEX_TABLE}')
+            cursor.execute(f'DELETE FROM {search.TRIGRAM_INDEX_TABLE}')
+        self.assertEqual(self.song_ids('lac troi'), [])
+        output = io.StringIO()
+        call_command('rebuild_search_index', batch_size=1, stdout=output)
+        self.assertIn('Indexed 1 songs', output.getvalue())
+        self.assertEqual(self.song_ids('lac troi'), [self.song.id])
+        self.assertEqual(search.find_ids(search.KIND_ARTIST, 'son tung', 10), [self.artist.id])
+
+
+class NormalizedSearchTests(TestCase):
+    def test_normalize_text_folds_accents_case_and_spaces(self):
+        self.assertEqual(normalize_text('  Sơn   TÙNG '), 'son tung')
+        self.assertEqual(normalize_text('Đen Vâu'), 'den vau')
+        self.assertEqual(normalize_text('Straße'), 'strasse')
+        self.assertEqual(normalize_text(None), '')
+
+    def test_shadow_columns_follow_saves(self):
+        artist = Artist.objects.create(name='Hoàng Thùy Linh')
+        self.assertEqual(artist.name_normalized, 'hoang thuy linh')
+        artist.name = 'Đức Phúc'
+        artist.save(update_fields=['name'])
+        artist.refresh_from_db()
+        self.assertEqual(artist.name_normalized, 'duc phuc')
+
+    def test_accentless_substrings_and_typos_match(self):
+        song = Song.objects.create(title='Chúng Ta Của Hiện Tại')
+        self.assertEqual(search.find_ids(search.KIND_SONG, 'ta cua hie', 10), [song.id])
+        self.assertEqual(search.find_ids(search.KIND_SONG, 'hien tia', 10), [song.id])
+
+    def test_fuzzy_matches_rank_by_similarity_above_the_threshold(self):
+        # Created first, so a rowid order would put it first
+        typo = User.objects.create_user('hientai99')
+        substring = User.objects.create_user('xhientiax')
+        exact = User.objects.create_user('hientia')
+        User.objects.create_user('hxxntia')  # 2 of the query's 5 trigrams
+        ids = search.find_ids(search.KIND_USER, 'HiệnTía', 10)
+        self.assertCountEqual(ids[:2], [substring.id, exact.id])
+        self.assertEqual(ids[2:], [typo.id])
+
+
+class CompactSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        artists = [Artist.objects.create(name=f'Artist {i}') for i in range(2)]
+        albums = [Album.objects.create(title=f'Album {i}') for i in range(2)]
+        for album in albums:
+            album.artist.set(artists)
+        for i in range(12):
+            song = Song.objects.create(title=f'Melody {i}')
+            song.artist.set(artists)
+            song.album.set(albums)
+
+    def search(self, max_results):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('search'), {'query': 'melody', 'mode': 'compact', 'max_results': max_results})
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_compact_results_cost_the_same_queries_for_any_page_size(self):
+        few, few_queries = self.search(2)
+        many, many_queries = self.search(12)
+        self.assertEqual((len(few['songs']), len(many['songs'])), (2, 12))
+        # Per category: the index lookup, the objects, then songs' artists and albums
+        self.assertEqual(few_queries, many_queries)
+        self.assertLessEqual(many_queries, 8)
+
+    def test_compact_song_shape(self):
+        song = self.search(5)[0]['songs'][0]
+        self.assertEqual(set(song), {
+            'id', 'title', 'artist', 'album', 'release_date', 'cover_art', 'cover_art_thumbnails',
+            'duration_seconds', 'available_qualities',
+        })
+        self.assertEqual(song['artist'][0], {'id': Artist.objects.get(name='Artist 0').id, 'name': 'Artist 0'})
+        self.assertEqual(song['album'][0], {'id': Album.objects.get(title='Album 0').id, 'title': 'Album 0'})
+        self.assertNotIn('lyric', song)
+
+
+class SearchCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.song = Song.objects.create(title='Cached Song')
+
+    def setUp(self):
+        # Rolling back a test's writes doesn't bump the catalog version
+        cache.clear()
+
+    def titles(self):
+        response = self.client.get(reverse('search'), {'query': 'cached'})
+        self.assertEqual(response.status_code, 200)
+        return [song['title'] for song in response.data['songs']]
+
+    def test_repeated_searches_are_served_from_the_cache(self):
+        self.assertEqual(self.titles(), ['Cached Song'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(), ['Cached Song'])
+
+    def test_catalog_writes_retire_cached_results(self):
+        self.assertEqual(self.titles(), ['Cached Song'])
+        version = search_cache.catalog_version()
+        self.song.title = 'Cached Song (Remix)'
+        self.song.save()
+        self.assertGreater(search_cache.catalog_version(), version)
+        self.assertEqual(self.titles(), ['Cached Song (Remix)'])
+
+        artist = Artist.objects.create(name='Cached Artist')
+        self.song.artist.add(artist)
+        response = self.client.get(reverse('search'), {'query': 'cached'})
+        self.assertEqual(response.data['songs'][0]['artist'][0]['name'], 'Cached Artist')
+        self.assertEqual([found['name'] for found in response.data['artists']], ['Cached Artist'])
+
+
+# Not a TestCase: the lookups run on worker threads with their own
+# connections, which can't see another connection's open transaction
+class AsyncSearchTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        artist = Artist.objects.create(name='Night Owl')
+        Album.objects.create(title='Night Drive').artist.add(artist)
+        for i in range(4):
+            Song.objects.create(title=f'Night {i}').artist.add(artist)
+
+    def tearDown(self):
+        # The flush after each test leaves the search index rows behind
+        for model in (Song, Album, Artist):
+            model.objects.all().delete()
+
+    def search(self, name, params):
+        cache.clear()
+        if name == 'search_async':
+            response = async_to_sync(self.async_client.get)(reverse(name), params)
+        else:
+            response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_same_results_as_search_view(self):
+        params = {'query': 'night', 'max_results': 2}
+        expected, results = self.search('search', params), self.search('search_async', params)
+        # Cursors are signed with a timestamp
+        self.assertEqual(results.keys(), expected.keys())
+        self.assertEqual(len(results['songs']), 2)
+        for category in ('songs', 'artists', 'albums'):
+            self.assertEqual(results[category], expected[category])
+            self.assertEqual(bool(results['next_cursors'][category]), bool(expected['next_cursors'][category]))
+
+        params.update(category='songs', cursor=results['next_cursors']['songs'])
+        expected, results = self.search('search', params), self.search('search_async', params)
+        self.assertEqual((results['results'], results['estimated_total']), (expected['results'], expected['estimated_total']))
+
+    def test_category_lookups_run_on_worker_threads(self):
+        threads = []
+
+        def record(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return [], None
+
+        with mock.patch('library.views.search_category', record):
+            self.search('search_async', {'query': 'night'})
+        self.assertEqual(len(threads), 3)
+        self.assertTrue(all(name.startswith('search') for name in threads))
+
+
+class SearchCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Word matches, an accentless substring match and a typo
+        for title in ['Love 0', 'Love 1', 'Love 2', 'Love 3', 'Love 4', 'Lovr', 'Glove']:
+            Song.objects.create(title=title)
+        Song.objects.create(title='Unrelated')
+
+    def walk(self, max_results):
+        seen = []
+        params = {'query': 'love', 'category': 'songs', 'max_results': max_results}
+        while True:
+            response = self.client.get(reverse('search'), params)
+            self.assertEqual(response.status_code, 200)
+            seen += [song['title'] for song in response.data['results']]
+            if not response.data['next_cursor']:
+                return seen
+            params['cursor'] = response.data['next_cursor']
+
+    def test_pages_cover_every_match_once_in_rank_order(self):
+        seen = self.walk(2)
+        self.assertEqual(seen, self.walk(3))
+        self.assertCountEqual(seen[:5], ['Love 0', 'Love 1', 'Love 2', 'Love 3', 'Love 4'])
+        # Fuzzy matches come by similarity: the substring before the typo
+        self.assertEqual(seen[5:], ['Glove', 'Lovr'])
+
+    def test_tampered_foreign_or_expired_cursors_are_refused(self):
+        params = {'query': 'love', 'category': 'songs', 'max_results': 2}
+        cursor = self.client.get(reverse('search'), params).data['next_cursor']
+        self.assertEqual(self.client.get(reverse('search'), {**params, 'cursor': cursor[:-1] + 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('search'), {**params, 'query': 'glove', 'cursor': cursor}).status_code, 400)
+        with override_settings(SEARCH_CURSOR_MAX_AGE=-1):
+            self.assertEqual(self.client.get(reverse('search'), {**params, 'cursor': cursor}).status_code, 400)
+
+    def test_fuzzy_stage_scores_a_bounded_candidate_set(self):
+        for i in range(5):
+            Song.objects.create(title=f'Glove {i}')
+        with mock.patch.object(search, 'FUZZY_CANDIDATES', 3):
+            ids = search.find_ids(search.KIND_SONG, 'love', 100)
+        # 5 word matches, then no more than FUZZY_CANDIDATES trigram matches
+        self.assertEqual(len(ids), 8)
+
+
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.artist = Artist.objects.create(name='Sơn Tùng M-TP')
+        for title in ['My Love', 'Love Story', 'Love', 'Star 0', 'Star 1', 'Star 2']:
+            Song.objects.create(title=title)
+        cls.album = Album.objects.create(title='Star Album')
+
+    def setUp(self):
+        autocomplete.prefix_index.build()
+        # Other tests' data would be left in the process-wide index
+        self.addCleanup(setattr, autocomplete.prefix_index, 'loaded', False)
+
+    def titles(self, query, **kwargs):
+        return [hit['title'] for hit in autocomplete.prefix_index.lookup(query, **kwargs)]
+
+    def test_any_word_start_matches_without_accents(self):
+        self.assertEqual(self.titles('son'), ['Sơn Tùng M-TP'])
+        self.assertEqual(self.titles('TUNG'), ['Sơn Tùng M-TP'])
+        self.assertEqual(self.titles('ung'), [])
+
+    def test_titles_starting_with_the_query_rank_first_then_shorter(self):
+        self.assertEqual(self.titles('love'), ['Love', 'Love Story', 'My Love'])
+
+    def test_limit_caps_the_hits(self):
+        self.assertEqual(len(self.titles('star', limit=2)), 2)
+        for i in range(60):
+            Song.objects.create(title=f'Lullaby {i}')
+        response = self.client.get(reverse('autocomplete'), {'query': 'lull', 'limit': 100})
+        self.assertEqual(len(response.data), 50)
+
+    def test_kinds_are_filtered_before_the_scan_limit(self):
+        with mock.patch.object(autocomplete, 'MAX_SCAN', 2):
+            self.assertEqual(self.titles('star', kinds={search.KIND_ALBUM}), ['Star Album'])
+
+    def test_saves_and_deletes_update_the_index(self):
+        song = Song.objects.create(title='New Hit')
+        self.assertEqual(self.titles('hit'), ['New Hit'])
+        song.title = 'Old Hit'
+        song.save()
+        self.assertEqual(self.titles('new'), [])
+        self.assertEqual(self.titles('old'), ['Old Hit'])
+        self.album.title = 'Moon Album'
+        self.album.save()
+        self.assertEqual(self.titles('star', kinds={search.KIND_ALBUM}), [])
+        self.assertEqual(self.titles('moon'), ['Moon Album'])
+        song.delete()
+        self.assertEqual(self.titles('hit'), [])
+
+
+class AudioMetadataTests(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.song = Song.objects.create(title='Song')
+
+    def wav(self, seconds):
+        data = io.BytesIO()
+        with wave.open(data, 'wb') as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(8000)
+            out.writeframes(b'\x00\x01' * 8000 * seconds)
+        return data.getvalue()
+
+    def upload(self, data):
+        response = self.client.post(reverse('song-upload-audio', args=[self.song.id]), {
+            'quality': '128kbps',
+            'audio_file': SimpleUploadedFile('song.wav', data),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.song.refresh_from_db()
+        return response
+
+    def test_saving_audio_records_and_refreshes_its_metadata(self):
+        first = self.wav(1)
+        response = self.upload(first)
+        # 128kbps uploads land in audio_128kbps (they used to go to a missing audio_140kbps attribute)
+        self.assertTrue(self.song.audio_128kbps.name.startswith('songs/128kbps/'))
+        self.assertEqual(response.data['song']['audio_file_sizes']['128kbps'], len(first))
+        metadata = AudioFileMetadata.objects.get(song=self.song)
+        self.assertEqual(
+            (metadata.quality, metadata.file_name, metadata.size, metadata.codec, metadata.duration, metadata.checksum),
+            ('128kbps', self.song.audio_128kbps.name, len(first), 'pcm', timedelta(seconds=1), hashlib.sha256(first).hexdigest()),
+        )
+
+        second = self.wav(2)
+        self.upload(second)
+        metadata = AudioFileMetadata.objects.get(song=self.song)
+        self.assertEqual((metadata.file_name, metadata.size, metadata.duration), (self.song.audio_128kbps.name, len(second), timedelta(seconds=2)))
+        song = Song.objects.prefetch_related('audio_metadata').get(pk=self.song.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(song.get_file_size('128kbps'), len(second))
+
+        self.song.audio_128kbps = None
+        self.song.save()
+        self.assertFalse(AudioFileMetadata.objects.filter(song=self.song).exists())
+
+
+class CatalogListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        artists = [Artist.objects.create(name=f'Artist {i}') for i in range(3)]
+        albums = [Album.objects.create(title=f'Album {i}') for i in range(3)]
+        for album in albums:
+            album.artist.set(artists[:2])
+        for i in range(30):
+            song = Song.objects.create(title=f'Song {i}')
+            song.artist.set(artists)
+            song.album.set(albums[i % 3:])
+
+    def test_song_list_query_count_does_not_grow_with_page_size(self):
+        # version stamp + page + artists + albums + album artists + audio metadata
+        for page_size in (5, 25):
+            with self.assertNumQueries(6):
+                response = self.client.get(reverse('song-list'), {'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_song_list_cursor_pages_cover_catalog_once(self):
+        seen = []
+        url, params = reverse('song-list'), {'page_size': 7}
+        while url:
+            response = self.client.get(url, params)
+            seen += [song['id'] for song in response.data['results']]
+            url, params = response.data['next'], None
+        self.assertEqual(seen, list(Song.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_song_list_page_number_mode(self):
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('song-list'), {'pagination': 'page', 'page_size': 10, 'page': 2})
+        self.assertEqual(response.data['count'], 30)
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_artist_list_is_paginated(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('artist-list'), {'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+
+class AlbumFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(23):
+            Album.objects.create(title=f'Album {i}')
+
+    def walk(self, seed, page_size):
+        seen = []
+        url, params = reverse('album-list'), {'seed': seed, 'page_size': page_size}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.data['seed'], seed)
+            seen += [album['id'] for album in response.data['results']]
+            url, params = response.data['next'], None
+        return seen
+
+    def test_feed_covers_every_album_once_in_a_stable_order(self):
+        seen = self.walk('session-1', 5)
+        self.assertCountEqual(seen, Album.objects.values_list('id', flat=True))
+        self.assertEqual(seen, self.walk('session-1', 4))
+
+    def test_backfill_command_adds_albums_created_without_signals(self):
+        bulk = Album.objects.bulk_create([Album(title='Bulk 1'), Album(title='Bulk 2')])
+        self.assertNotIn(bulk[0].id, self.walk('session-1', 10))
+        output = io.StringIO()
+        call_command('backfill_album_feed', stdout=output)
+        self.assertIn('Added 2 albums', output.getvalue())
+        self.assertCountEqual(self.walk('session-1', 10), Album.objects.values_list('id', flat=True))
+        call_command('backfill_album_feed', stdout=io.StringIO())
+        self.assertEqual(AlbumFeedPosition.objects.filter(album=bulk[0]).count(), album_feed.FEED_SLOTS)
+
+    def test_page_query_count_is_constant(self):
+        # version stamp, one or two feed range reads (the second when the page
+        # wraps around), then albums, artists and songs
+        for seed in ('session-1', 'session-2', 'session-3'):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('album-list'), {'seed': seed, 'page_size': 10})
+            self.assertLessEqual(len(queries), 6)
+
+
+class SparseFieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        artist = Artist.objects.create(name='Artist')
+        album = Album.objects.create(title='Album')
+        album.artist.add(artist)
+        song = Song.objects.create(title='Song', lyric={'lines': ['la'] * 100})
+        song.artist.add(artist)
+        song.album.add(album)
+
+    def test_fields_trims_response_and_defers_lyric(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('song-list'), {'fields': 'id,title'})
+        self.assertEqual(response.data['results'][0], {'id': Song.objects.get().id, 'title': 'Song'})
+        self.assertNotIn('lyric', queries.captured_queries[0]['sql'])
+
+    def test_expand_nests_related_objects(self):
+        response = self.client.get(reverse('song-list'), {'fields': 'album.title,album.artist', 'expand': 'album.artist'})
+        self.assertEqual(response.data['results'][0]['album'][0]['artist'][0]['name'], 'Artist')
+
+    def test_writes_ignore_the_selection(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('owner'))
+        song = Song.objects.get()
+        response = client.post(
+            reverse('playlist-list') + '?fields=id&expand=songs',
+            {'name': 'Mix', 'description': 'Evening', 'songs': [song.id]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 201)
+        playlist = Playlist.objects.get(pk=response.data['id'])
+        self.assertEqual((playlist.name, playlist.description), ('Mix', 'Evening'))
+        self.assertEqual(list(playlist.songs.all()), [song])
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.artist = Artist.objects.create(name='Artist')
+        cls.song = Song.objects.create(title='Song')
+        cls.song.artist.add(cls.artist)
+
+    def test_unchanged_list_is_not_modified_after_one_query(self):
+        response = self.client.get(reverse('song-list'))
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('song-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_related_changes_and_deletions_change_the_etag(self):
+        etag = self.client.get(reverse('song-list'))['ETag']
+        Artist.objects.create(name='Other').songs.add(self.song)
+        response = self.client.get(reverse('song-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        Artist.objects.get(name='Other').delete()
+        self.assertEqual(self.client.get(reverse('song-list'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_etag_does_not_bypass_permissions(self):
+        owner, other = User.objects.create_user('owner'), User.objects.create_user('other')
+        own = Playlist.objects.create(owner=owner, name='Mine')
+        private = Playlist.objects.create(owner=other, name='Theirs')
+        client = APIClient()
+        client.force_authenticate(owner)
+        etag = client.get(reverse('playlist-detail', args=[own.id]))['ETag']
+        self.assertEqual(client.get(reverse('playlist-detail', args=[own.id]), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(client.get(reverse('playlist-detail', args=[private.id]), HTTP_IF_NONE_MATCH=etag).status_code, 403)
+        self.assertEqual(client.get(reverse('playlist-detail', args=[private.id + 1]), HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+    def test_unfriending_revokes_a_cached_friends_playlist(self):
+        owner, friend = User.objects.create_user('owner'), User.objects.create_user('friend')
+        Friendship.objects.create(user1=owner, user2=friend)
+        playlist = Playlist.objects.create(owner=owner, name='Shared', share_permission=SharingPermission.FRIENDS)
+        client = APIClient()
+        client.force_authenticate(friend)
+        url = reverse('playlist-detail', args=[playlist.id])
+        etag = client.get(url)['ETag']
+        Friendship.remove_friendship(owner, friend)
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 403)
+
+
+class RendererTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        artist = Artist.objects.create(name='Sơn Tùng')
+        cls.song = Song.objects.create(title='Lạc Trôi', lyric={'lines': ['la', 'la']})
+        cls.song.artist.add(artist)
+
+    def test_msgpack_carries_the_same_data_as_json(self):
+        url = reverse('song-detail', args=[self.song.id])
+        as_json = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(as_json.status_code, 200)
+        self.assertEqual(as_json['Content-Type'], 'application/json')
+        as_msgpack = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(as_msgpack.status_code, 200)
+        self.assertEqual(as_msgpack['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(as_msgpack.content), json.loads(as_json.content))
+        self.assertEqual(msgpack.unpackb(self.client.get(url, {'format': 'msgpack'}).content), json.loads(as_json.content))
+
+    def test_plain_views_negotiate_too(self):
+        url = reverse('signed-media', args=['songs/128kbps/missing.mp3'])
+        as_json = self.client.get(url, HTTP_ACCEPT='application/json')
+        as_msgpack = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual((as_json.status_code, as_msgpack.status_code), (403, 403))
+        self.assertEqual(as_json['Content-Type'], 'application/json')
+        self.assertEqual(as_msgpack['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(as_msgpack.content), json.loads(as_json.content))
+
+
+class AudioStreamTests(TempMediaRootMixin, TestCase):
+    data = bytes(range(256)) * 40
+
+    def setUp(self):
+        super().setUp()
+        self.song = Song.objects.create(title='Song')
+        self.song.audio_lossless = SimpleUploadedFile('song.flac', self.data)
+        self.song.save()
+        self.url = reverse('song-stream', args=[self.song.id])
+
+    def test_single_range(self):
+        response = self.client.get(self.url, {'quality': 'lossless'}, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+        self.assertEqual(b''.join(response.streaming_content), self.data[100:200])
+
+    def test_stale_if_range_serves_whole_file(self):
+        response = self.client.get(self.url, {'quality': 'lossless'}, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, {'quality': 'lossless'}, HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    @override_settings(MEDIA_DELIVERY='x-accel-redirect', MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_accel_redirect_hands_file_to_proxy(self):
+        response = self.client.get(self.url, {'quality': 'lossless'}, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.song.audio_lossless.name}')
+        self.assertEqual(response.content, b'')
+
+
+class SignedMediaTests(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.song = Song.objects.create(title='Song')
+        self.song.audio_128kbps = SimpleUploadedFile('song.mp3', b'audio')
+        self.song.save()
+
+    def test_serialized_url_serves_file_without_queries(self):
+        url = self.client.get(reverse('song-detail', args=[self.song.id])).data['audio_urls']['128kbps']
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'audio')
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_urls_are_stable_within_a_bucket(self):
+        self.assertEqual(signed_media.signed_url(self.song.audio_128kbps), self.song.get_audio_url('128kbps'))
+
+    def test_tampered_or_expired_urls_are_refused(self):
+        name = self.song.audio_128kbps.name
+        other = signed_media.signed_url(self.song.audio_128kbps).replace(name, 'songs/128kbps/other.mp3')
+        self.assertEqual(self.client.get(other).status_code, 403)
+        expired = signed_media.signed_url(self.song.audio_128kbps, expires=1000)
+        self.assertEqual(self.client.get(expired).status_code, 403)
+
+
+@override_settings(AUDIO_UPLOAD_CHUNK_SIZE=1000)
+class ChunkedUploadTests(TempMediaRootMixin, TestCase):
+    client_class = APIClient
+    data = bytes(range(256)) * 10
+    temp_settings = ('MEDIA_ROOT', 'MEDIA_BLOB_DIR', 'AUDIO_UPLOAD_TEMP_DIR')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        self.song = Song.objects.create(title='Song')
+        response = self.client.post(reverse('song-start-upload', args=[self.song.id]), {
+            'quality': 'lossless',
+            'file_name': 'master.flac',
+            'size': len(self.data),
+            'checksum': hashlib.sha256(self.data).hexdigest(),
+        })
+        self.assertEqual(response.status_code, 201)
+        self.upload_id = response.data['upload_id']
+
+    def put_chunk(self, index, body, checksum=None):
+        return self.client.put(
+            reverse('song-upload-chunk', args=[self.song.id, self.upload_id, index]),
+            body,
+            content_type='application/octet-stream',
+            HTTP_X_CONTENT_SHA256=checksum or hashlib.sha256(body).hexdigest(),
+        )
+
+    def test_chunks_in_any_order_assemble_into_the_quality_field(self):
+        for index in (2, 0, 1):
+            response = self.put_chunk(index, self.data[index * 1000:(index + 1) * 1000])
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['received_chunks'], [0, 1, 2])
+
+        response = self.client.post(reverse('song-finalize-upload', args=[self.song.id, self.upload_id]))
+        self.assertEqual(response.status_code, 200)
+        self.song.refresh_from_db()
+        self.assertEqual(self.song.audio_lossless.name, f'songs/lossless/{self.song.id}.flac')
+        with self.song.audio_lossless.open('rb') as stored:
+            self.assertEqual(stored.read(), self.data)
+
+        # Finalizing again finds the upload complete instead of storing the file twice
+        response = self.client.post(reverse('song-finalize-upload', args=[self.song.id, self.upload_id]))
+        self.assertEqual(response.status_code, 400)
+
+    def test_bad_chunk_checksum_is_not_stored(self):
+        response = self.put_chunk(0, self.data[:1000], checksum='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        status = self.client.get(reverse('song-upload-status', args=[self.song.id, self.upload_id]))
+        self.assertEqual(status.data['received_chunks'], [])
+
+    def test_bad_extension_is_rejected_at_start(self):
+        response = self.client.post(reverse('song-start-upload', args=[self.song.id]), {
+            'file_name': 'master.exe', 'size': 10, 'checksum': '0' * 64,
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_admins_can_upload(self):
+        self.client.logout()
+        self.assertIn(self.client.get(reverse('song-upload-status', args=[self.song.id, self.upload_id])).status_code, (401, 403))
+        self.assertIn(self.put_chunk(0, self.data[:1000]).status_code, (401, 403))
+        self.client.force_authenticate(User.objects.create_user('listener'))
+        response = self.client.post(reverse('song-finalize-upload', args=[self.song.id, self.upload_id]))
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(AUDIO_TRANSCODER='library.transcoding.StubTranscoder', AUDIO_JOB_MAX_ATTEMPTS=2)
+class TranscodingQueueTests(TempMediaRootMixin, TestCase):
+    temp_settings = ('MEDIA_ROOT', 'MEDIA_BLOB_DIR', 'AUDIO_TRANSCODE_TEMP_DIR')
+
+    def setUp(self):
+        super().setUp()
+        self.song = Song.objects.create(title='Song')
+        self.song.audio_lossless = SimpleUploadedFile('song.flac', b'lossless')
+        self.song.save()
+
+    def run_jobs(self):
+        for job in transcoding.claim('test', 10):
+            transcoding.finish(job, *transcoding.transcode_task(transcoding.prepare(job))[1:])
+
+    def test_uploading_lossless_queues_and_fills_missing_renditions(self):
+        self.assertCountEqual(AudioJob.objects.values_list('target_quality', flat=True), ['320kbps', '128kbps'])
+        self.assertEqual(transcoding.enqueue_missing(self.song), [])
+
+        self.run_jobs()
+        self.song.refresh_from_db()
+        self.assertEqual(self.song.audio_320kbps.name, f'songs/320kbps/{self.song.id}.mp3')
+        self.assertEqual(self.song.audio_128kbps.name, f'songs/128kbps/{self.song.id}.mp3')
+        self.assertEqual(set(AudioJob.objects.values_list('status', flat=True)), {AudioJob.STATUS_DONE})
+
+    @override_settings(AUDIO_TRANSCODER='library.transcoding.Transcoder', AUDIO_JOB_RETRY_DELAY=0)
+    def test_failures_are_retried_then_marked_failed_without_touching_the_song(self):
+        self.run_jobs()
+        self.assertEqual(set(AudioJob.objects.values_list('status', 'attempts')), {(AudioJob.STATUS_QUEUED, 1)})
+        self.run_jobs()
+        self.assertEqual(set(AudioJob.objects.values_list('status', 'attempts')), {(AudioJob.STATUS_FAILED, 2)})
+        self.song.refresh_from_db()
+        self.assertFalse(self.song.audio_320kbps)
+
+    @override_settings(AUDIO_TRANSCODER='library.transcoding.Transcoder', AUDIO_JOB_RETRY_DELAY=0)
+    def test_failed_renditions_are_queued_again_only_for_a_new_source_or_on_request(self):
+        self.run_jobs()
+        self.run_jobs()
+        self.song.title = 'Renamed'
+        self.song.save()
+        self.assertEqual(AudioJob.objects.filter(status=AudioJob.STATUS_QUEUED).count(), 0)
+
+        call_command('transcode_audio', '--retry-failed', '--once', '--workers=1', stdout=io.StringIO())
+        self.assertEqual(AudioJob.objects.count(), 4)
+        self.assertEqual(AudioJob.objects.filter(status=AudioJob.STATUS_FAILED).count(), 4)
+
+        self.song.audio_lossless = SimpleUploadedFile('song.wav', b'lossless')
+        self.song.save()
+        self.assertCountEqual(
+            AudioJob.objects.filter(status=AudioJob.STATUS_QUEUED).values_list('target_quality', 'source_name'),
+            [(quality, self.song.audio_lossless.name) for quality in ('320kbps', '128kbps')],
+        )
+
+
+class AudioProbeTests(TempMediaRootMixin, TestCase):
+    def mp3_frame(self, bitrate_index, body=b''):
+        header = bytes([0xff, 0xfb, bitrate_index << 4, 0x00])
+        return (header + body).ljust(audio_metadata._mp3_frame(header)[0], b'\0')
+
+    def test_xing_frame_count_gives_vbr_duration(self):
+        xing = b'\0' * 32 + b'Xing' + struct.pack('>II', 1, 1000)
+        data = self.mp3_frame(9, xing) + b''.join(self.mp3_frame(9 if i % 2 else 14) for i in range(50))
+        duration, _ = audio_metadata.probe(io.BytesIO(data), len(data), 'mp3')
+        self.assertAlmostEqual(duration, 1000 * 1152 / 44100)
+
+    def test_upload_fills_empty_song_duration(self):
+        song = Song.objects.create(title='Song')
+        song.audio_128kbps = SimpleUploadedFile('song.mp3', b''.join(self.mp3_frame(9) for _ in range(100)))
+        song.save()
+        song.refresh_from_db()
+        self.assertAlmostEqual(song.duration.total_seconds(), 100 * 417 * 8 / 128000, places=2)
+
+
+class ContentAddressedStorageTests(TempMediaRootMixin, TestCase):
+    def test_identical_uploads_share_one_blob_until_reclaimed(self):
+        names = [default_storage.save('images/cover.jpg', SimpleUploadedFile('cover.jpg', b'cover')) for _ in range(2)]
+        self.assertNotEqual(*names)
+        blob = MediaBlob.objects.get()
+        self.assertEqual((blob.size, blob.ref_count), (5, 2))
+        self.assertTrue(os.path.samefile(*map(default_storage.path, names)))
+        # Not reachable by hash through anything that serves MEDIA_ROOT
+        self.assertFalse(os.path.realpath(default_storage.blob_path(blob.sha256)).startswith(os.path.realpath(settings.MEDIA_ROOT)))
+
+        for name in names:
+            default_storage.delete(name)
+        call_command('reclaim_media', stdout=io.StringIO())
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(os.path.exists(default_storage.blob_path(blob.sha256)))
+
+
+class UpNextManifestTests(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        owner = User.objects.create_user('owner', password='password')
+        self.playlist = Playlist.objects.create(owner=owner, name='Queue', share_permission=SharingPermission.PUBLIC)
+        self.songs = []
+        for number in range(4):
+            song = Song.objects.create(title=f'Song {number}', duration=timedelta(seconds=100))
+            song.audio_128kbps = SimpleUploadedFile('song.mp3', b'a' * 10000)
+            song.save()
+            self.playlist.songs.add(song)
+            self.songs.append(song)
+
+    def test_playlist_manifest_lists_tracks_after_position(self):
+        url = reverse('playlist-up-next', args=[self.playlist.id])
+        response = self.client.get(url, {'position': 1, 'count': 5, 'quality': '128kbps'})
+        self.assertEqual(response.status_code, 200)
+        tracks = response.data['tracks']
+        self.assertEqual([(track['position'], track['id']) for track in tracks], [(2, self.songs[2].id), (3, self.songs[3].id)])
+        self.assertEqual(tracks[0]['file_size'], 10000)
+        self.assertEqual(tracks[0]['prefetch_range'], 'bytes=0-999')
+        self.assertEqual(self.client.get(tracks[0]['audio_url']).status_code, 200)
+
+        # The playlist, its owner (for the access check), the songs and their metadata
+        with self.assertNumQueries(4):
+            self.client.get(url, {'count': 20})
+
+    def test_queue_manifest_skips_unknown_songs(self):
+        queue = ','.join(str(song_id) for song_id in [self.songs[3].id, 0, self.songs[0].id])
+        response = self.client.get(reverse('song-up-next'), {'queue': queue})
+        self.assertEqual([(track['position'], track['id']) for track in response.data['tracks']], [(0, self.songs[3].id), (2, self.songs[0].id)])
+        self.assertEqual(self.client.get(reverse('song-up-next'), {'queue': 'a,b'}).status_code, 400)
+
+
+@override_settings(WAVEFORM_BUCKETS=4)
+class WaveformTests(TempMediaRootMixin, TestCase):
+    def test_peaks_are_min_and_max_of_each_bucket(self):
+        samples = array('h', [0, 1000, -1000, 32767, -32768, 5, 256, 512])
+        self.assertEqual(waveform.peaks(samples, 4), struct.pack('8b', 0, 3, -4, 127, -128, 0, 1, 2))
+
+    @skipIf(waveform.np is None, 'NumPy is not installed')
+    def test_numpy_and_fallback_reductions_agree(self):
+        samples = array('h', [(i * 7919) % 65536 - 32768 for i in range(1001)])
+        for buckets in (1, 7, 1000, 1500):
+            with mock.patch.object(waveform, 'np', None):
+                fallback = waveform.peaks(samples, buckets)
+            self.assertEqual(len(fallback), 2 * buckets)
+            self.assertEqual(waveform.peaks(samples, buckets), fallback)
+            self.assertEqual(waveform.peaks(waveform._int16(samples.tobytes()), buckets), fallback)
+
+    def test_computed_peaks_are_served_until_the_audio_changes(self):
+        wav = io.BytesIO()
+        with wave.open(wav, 'wb') as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(8000)
+            out.writeframes(struct.pack('<8h', 0, 512, -512, 0, 32767, 0, -32768, 0))
+
+        song = Song.objects.create(title='Song')
+        song.audio_lossless = SimpleUploadedFile('song.wav', wav.getvalue())
+        song.save()
+        url = reverse('song-waveform', args=[song.id])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        call_command('compute_waveforms', workers=1, stdout=io.StringIO())
+        response = self.client.get(url)
+        self.assertEqual(response.content, struct.pack('8b', 0, 2, -2, 0, 0, 127, -128, 0))
+        self.assertIn('public', response['Cache-Control'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        song.audio_lossless = SimpleUploadedFile('other.wav', wav.getvalue())
+        song.save()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ThumbnailTests(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+    def png(self, size):
+        output = io.BytesIO()
+        Image.new('RGBA', size, (255, 0, 0, 128)).save(output, format='PNG')
+        return SimpleUploadedFile('cover.png', output.getvalue())
+
+    def image_size(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            return image.format, image.size
+
+    def test_uploaded_artwork_is_served_at_each_size(self):
+        album = Album.objects.create(title='Album', cover_art=self.png((1000, 500)))
+        urls = self.client.get(reverse('album-detail', args=[album.id])).data['cover_art_thumbnails']
+        self.assertEqual(sorted(urls, key=int), ['64', '256', '640'])
+        self.assertEqual(self.image_size(urls['640']), ('PNG', (640, 320)))
+        self.assertEqual(self.image_size(urls['64']), ('PNG', (64, 32)))
+
+    def test_missing_thumbnails_are_made_on_first_request(self):
+        name = default_storage.save('images/cover_art/small.png', self.png((100, 300)))
+        artist = Artist.objects.create(name='Artist')
+        Artist.objects.filter(pk=artist.pk).update(artist_picture=name)
+        artist.refresh_from_db()
+
+        urls = thumbnails.urls(artist.artist_picture)
+        self.assertFalse(default_storage.exists(thumbnails.thumbnail_name(name, 256)))
+        self.assertEqual(self.image_size(urls['256']), ('PNG', (85, 256)))
+        # Never upscaled
+        self.assertEqual(self.image_size(urls['640']), ('PNG', (100, 300)))
+
+    def test_thumbnails_are_sent_in_the_smallest_accepted_format(self):
+        output = io.BytesIO()
+        Image.effect_noise((300, 300), 64).convert('RGB').save(output, format='PNG')
+        song = Song.objects.create(title='Song', cover_art=SimpleUploadedFile('cover.png', output.getvalue()))
+        url = thumbnails.urls(song.cover_art)['256']
+
+        response = self.client.get(url, HTTP_ACCEPT='image/avif,image/webp,image/png,*/*;q=0.8')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('Accept', response['Vary'])
+        png = self.client.get(url, HTTP_ACCEPT='image/png,image/webp;q=0')
+        self.assertEqual(png['Content-Type'], 'image/png')
+        self.assertLess(int(response['Content-Length']), int(png['Content-Length']))
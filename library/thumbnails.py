@@ -0,0 +1,326 @@
+"""
+Fixed-size thumbnails of uploaded artwork.
+
+Cover art, artist pictures, playlist covers and profile pictures are
+stored at whatever resolution they were uploaded in, so a grid of album
+tiles used to pull full-size images. Every image now also gets a
+rendition at each of THUMBNAIL_SIZES (the longest side, never upscaled),
+stored next to the originals under a name derived from the original's:
+
+    images/cover_art/abc.jpg -> thumbnails/256/images/cover_art/abc.jpg
+
+Serializers expose the signed URL of each size (urls()), computed from
+the name alone: no query and no storage access per image. Renditions are
+made when a model with an image is saved (see signals.py), backfilled by
+the generate_thumbnails command, and made on first request by the media
+view for any image the other two missed. A rendition older than its
+original is made again, which covers originals replaced under the same
+name.
+
+Renditions keep the original's format: JPEG stays JPEG, PNG keeps its
+transparency. JPEG originals are decoded at reduced scale (Image.draft),
+and each size is resized from the next larger one, not from the original.
+
+Each rendition is also encoded in IMAGE_VARIANT_FORMATS (WebP, and AVIF
+when Pillow can write it), stored as "<thumbnail name>.webp" and so on.
+URLs keep naming the rendition; the media view sends the smallest file
+among it and the variants the request's Accept header allows
+(negotiate()), with "Vary: Accept".
+"""
+import io
+import os
+
+from django.apps import apps
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .media_delivery import StoredFile
+from .signed_media import expiry, signed_url
+
+THUMBNAIL_DIR = 'thumbnails'
+
+# Models and image fields that get thumbnails
+IMAGE_FIELDS = [
+    ('library.Song', 'cover_art'),
+    ('library.Album', 'cover_art'),
+    ('library.Artist', 'artist_picture'),
+    ('library.Playlist', 'cover_image'),
+    ('authentication.UserProfile', 'profile_picture'),
+]
+
+# Pillow format by file extension, for names it doesn't know (e.g. .jfif)
+FALLBACK_FORMAT = 'JPEG'
+
+# Pillow format -> (media type, extension) of the variants
+VARIANT_TYPES = {
+    'AVIF': ('image/avif', '.avif'),
+    'WEBP': ('image/webp', '.webp'),
+}
+
+ENCODE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'WEBP': {'quality': 80, 'method': 4},
+    'AVIF': {'quality': 60},
+}
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+def sizes():
+    return sorted(getattr(settings, 'THUMBNAIL_SIZES', (64, 256, 640)))
+
+
+def thumbnail_name(name, size):
+    return f'{THUMBNAIL_DIR}/{size}/{name}'
+
+
+def variant_formats():
+    """
+    Variant formats to make, among those this Pillow build can write
+    """
+    Image.init()
+    return [
+        image_format for image_format in getattr(settings, 'IMAGE_VARIANT_FORMATS', ('AVIF', 'WEBP'))
+        if image_format in VARIANT_TYPES and image_format in Image.SAVE
+    ]
+
+
+def variant_name(name, image_format):
+    return name + VARIANT_TYPES[image_format][1]
+
+
+def rendition_of(name):
+    """
+    The rendition name a variant name was made from, or None
+    """
+    for media_type, extension in VARIANT_TYPES.values():
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return None
+
+
+def parse_thumbnail_name(name):
+    """
+    (size, original name) for a thumbnail name, or None for other names
+    """
+    directory, _, rest = name.partition('/')
+    size, _, original = rest.partition('/')
+    if directory != THUMBNAIL_DIR or not size.isdigit() or int(size) not in sizes() or not original:
+        return None
+    return int(size), original
+
+
+def urls(field_file, request=None, expires=None):
+    """
+    Signed URL of every thumbnail of an image field by size, or None when
+    the field is empty
+    """
+    if not field_file or not field_file.name:
+        return None
+    expires = expiry() if expires is None else expires
+    return {
+        str(size): signed_url(StoredFile(field_file.storage, thumbnail_name(field_file.name, size)), request, expires)
+        for size in sizes()
+    }
+
+
+def _format_for(name):
+    return Image.registered_extensions().get(os.path.splitext(name)[1].lower(), FALLBACK_FORMAT)
+
+
+def _encode(image, image_format):
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    elif image_format == 'GIF' and image.mode not in ('P', 'L'):
+        image = image.convert('P', palette=Image.Palette.ADAPTIVE)
+    output = io.BytesIO()
+    image.save(output, format=image_format, **ENCODE_OPTIONS.get(image_format, {'optimize': True}))
+    return output.getvalue()
+
+
+def render(path, name, requested_sizes):
+    """
+    Encoded renditions of the image at path for each of requested_sizes,
+    in name's format and as variants: {(size, None or variant format):
+    bytes}. Raises ThumbnailError when the file is not an image Pillow can
+    read.
+    """
+    image_format = _format_for(name)
+    formats = [None, *(variant for variant in variant_formats() if variant != image_format)]
+    largest = max(requested_sizes)
+    try:
+        with Image.open(path) as original:
+            # JPEG decodes straight to the smallest scale still >= largest
+            original.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(original)
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                # Palette and other modes resample badly; GIF output goes back to a palette
+                image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+            image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, SyntaxError) as e:
+        raise ThumbnailError(str(e) or 'Not a readable image')
+
+    renditions = {}
+    for size in sorted(requested_sizes, reverse=True):
+        # In place: each size is made from the previous, larger one
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for variant in formats:
+            renditions[size, variant] = _encode(image, variant or image_format)
+    return renditions
+
+
+def _stored_at(path):
+    # ctime, not mtime: a name linked to a blob stored earlier keeps the
+    # blob's mtime, but making the link changes the ctime
+    return os.stat(path).st_ctime
+
+
+def stale_sizes(storage, name, force=False):
+    """
+    Sizes whose thumbnail of name is missing or older than the original,
+    or lacks a variant made after it
+    """
+    if force:
+        return sizes()
+    original_stored_at = _stored_at(storage.path(name))
+    image_format = _format_for(name)
+    variants = [variant for variant in variant_formats() if variant != image_format]
+    stale = []
+    for size in sizes():
+        thumbnail = thumbnail_name(name, size)
+        try:
+            stored_at = _stored_at(storage.path(thumbnail))
+            if stored_at < original_stored_at or any(
+                _stored_at(storage.path(variant_name(thumbnail, variant))) < stored_at for variant in variants
+            ):
+                stale.append(size)
+        except FileNotFoundError:
+            stale.append(size)
+    return stale
+
+
+def store(storage, name, renditions):
+    """
+    Save renditions ({(size, variant format): bytes}) of name, replacing
+    older ones; each rendition before its variants
+    """
+    for (size, variant), data in sorted(renditions.items(), key=lambda item: (item[0][0], item[0][1] is not None)):
+        target = thumbnail_name(name, size)
+        if variant is not None:
+            target = variant_name(target, variant)
+        storage.delete(target)
+        saved = storage.save(target, io.BytesIO(data))
+        if saved != target:
+            # Another process stored it in the meantime; keep theirs
+            storage.delete(saved)
+
+
+def generate(field_file, force=False):
+    """
+    Make the missing or outdated thumbnails of an image field; returns the
+    sizes made. Raises OSError when the original is missing and
+    ThumbnailError when it is not an image.
+    """
+    if not field_file or not field_file.name:
+        return []
+    storage, name = field_file.storage, field_file.name
+    requested = stale_sizes(storage, name, force)
+    if requested:
+        store(storage, name, render(storage.path(name), name, requested))
+    return requested
+
+
+def accepted_variants(accept):
+    """
+    Variant formats an Accept header allows, by their explicit media types
+    """
+    accepted = set()
+    for media_range in accept.split(','):
+        media_type, *params = (part.strip() for part in media_range.split(';'))
+        quality = next((param[2:] for param in params if param.startswith('q=')), '1')
+        try:
+            if float(quality) <= 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(media_type.lower())
+    return [image_format for image_format in variant_formats() if VARIANT_TYPES[image_format][0] in accepted]
+
+
+def negotiate(storage, name, accept):
+    """
+    Name of the file to send for a requested thumbnail name: the smallest
+    of the rendition and the variants accept allows. Missing ones are made
+    first. Other names are returned as they are.
+    """
+    parsed = parse_thumbnail_name(name)
+    if parsed is None:
+        return name
+    image_format = _format_for(name)
+    candidates = [
+        name, *(variant_name(name, variant) for variant in accepted_variants(accept) if variant != image_format),
+    ]
+
+    def file_sizes():
+        found = {}
+        for candidate in candidates:
+            try:
+                found[candidate] = storage.size(candidate)
+            except OSError:
+                pass
+        return found
+
+    found = file_sizes()
+    if len(found) < len(candidates):
+        # An image the upload and the backfill haven't made thumbnails of yet
+        try:
+            generate(StoredFile(storage, parsed[1]))
+        except (OSError, ThumbnailError):
+            pass
+        found = file_sizes()
+    # Ties go to the rendition itself, which every client can decode
+    return min(found, key=lambda candidate: (found[candidate], candidate != name), default=name)
+
+
+def stored_image_names():
+    """
+    Names of every image that gets thumbnails
+    """
+    names = set()
+    for label, field_name in IMAGE_FIELDS:
+        names.update(
+            apps.get_model(label).objects.exclude(**{f'{field_name}__isnull': True}).exclude(**{field_name: ''})
+            .values_list(field_name, flat=True).distinct()
+        )
+    return names
+
+
+def image_fields(model):
+    return [field_name for label, field_name in IMAGE_FIELDS if label == model._meta.label]
+
+
+def generate_for(instance):
+    """
+    generate() for every image field of a saved model instance. Images
+    that are missing or unreadable are left to the media view, which
+    serves their thumbnail URLs with a 404 until they are replaced.
+    """
+    for field_name in image_fields(type(instance)):
+        try:
+            generate(getattr(instance, field_name))
+        except (OSError, ThumbnailError):
+            pass
+
+
+def render_task(task):
+    """
+    render() for the generate_thumbnails process pool. Returns (name,
+    renditions or None, error or None).
+    """
+    name, path, requested = task
+    try:
+        return name, render(path, name, requested), None
+    except (OSError, ThumbnailError) as e:
+        return name, None, str(e)
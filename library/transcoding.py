@@ -0,0 +1,268 @@
+"""
+Background transcoding of missing audio renditions.
+
+When a song has a lossless (or higher quality) file but no 320kbps or
+128kbps one, an AudioJob is queued for each missing quality. The
+transcode_audio command claims queued jobs, runs the transcoder in a
+process pool and stores each rendition when its job finishes, so a song's
+quality fields only ever point at complete files.
+
+The queue lives in the database: claiming is a conditional UPDATE from
+queued to running, so several workers can share it. Failed attempts are
+retried with exponential backoff up to AUDIO_JOB_MAX_ATTEMPTS; jobs left
+running by a worker that died are requeued after AUDIO_JOB_TIMEOUT. A job
+that failed for good is not queued again for the same source file, only
+once the source changes or with transcode_audio --retry-failed.
+
+Transcoders are pluggable (settings.AUDIO_TRANSCODER). They run in the
+pool's processes and get file paths only, never database objects.
+"""
+import abc
+import os
+import shutil
+import subprocess
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .chunked_upload import StagedFile
+from .models import Song, AudioJob, AUDIO_QUALITY_FIELDS
+
+# Target quality -> qualities it may be derived from, best first
+RENDITION_SOURCES = {
+    '320kbps': ['lossless'],
+    '128kbps': ['lossless', '320kbps', 'legacy'],
+}
+
+
+class TranscodeError(Exception):
+    pass
+
+
+class Transcoder(abc.ABC):
+    """
+    Interface of the transcoders named by settings.AUDIO_TRANSCODER
+    """
+    extension = '.mp3'
+
+    @abc.abstractmethod
+    def transcode(self, source_path, output_path, quality):
+        """
+        Write the quality rendition of source_path to output_path, raising
+        TranscodeError (or any other exception) on failure
+        """
+
+
+class FFmpegTranscoder(Transcoder):
+    """
+    MP3 renditions through ffmpeg and LAME
+    """
+    bitrates = {'320kbps': '320k', '128kbps': '128k'}
+
+    def transcode(self, source_path, output_path, quality):
+        command = [
+            getattr(settings, 'FFMPEG_BINARY', 'ffmpeg'), '-nostdin', '-y', '-loglevel', 'error',
+            '-i', source_path, '-vn', '-map_metadata', '0',
+            '-codec:a', 'libmp3lame', '-b:a', self.bitrates[quality],
+            output_path,
+        ]
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+        except FileNotFoundError:
+            raise TranscodeError(f'{command[0]} not found')
+        except subprocess.CalledProcessError as e:
+            raise TranscodeError(e.stderr.decode('utf-8', 'replace').strip()[-500:] or f'ffmpeg exited with {e.returncode}')
+
+
+class StubTranscoder(Transcoder):
+    """
+    Copies the source unchanged; for tests and development machines without ffmpeg
+    """
+
+    def transcode(self, source_path, output_path, quality):
+        shutil.copyfile(source_path, output_path)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def get_transcoder_path():
+    return _setting('AUDIO_TRANSCODER', 'library.transcoding.FFmpegTranscoder')
+
+
+def _audio_file(song, quality):
+    return song.audio if quality == 'legacy' else getattr(song, AUDIO_QUALITY_FIELDS[quality])
+
+
+def best_source(song, target_quality):
+    """
+    (quality, file) to derive target_quality from, or (None, None)
+    """
+    for quality in RENDITION_SOURCES[target_quality]:
+        audio_file = _audio_file(song, quality)
+        if audio_file and audio_file.name:
+            return quality, audio_file
+    return None, None
+
+
+def missing_renditions(song):
+    """
+    Qualities the song lacks but could be derived from a file it has
+    """
+    return [
+        quality for quality in RENDITION_SOURCES
+        if not _audio_file(song, quality).name and best_source(song, quality)[0]
+    ]
+
+
+def enqueue_missing(song, retry_failed=False):
+    """
+    Queue a job for every missing rendition that has none pending yet and
+    hasn't failed on its current source file (unless retry_failed); returns
+    the new jobs
+    """
+    qualities = missing_renditions(song)
+    if not qualities:
+        return []
+    failed = set() if retry_failed else set(
+        AudioJob.objects.filter(song=song, status=AudioJob.STATUS_FAILED).values_list('target_quality', 'source_name')
+    )
+    jobs = []
+    for quality in qualities:
+        source_name = best_source(song, quality)[1].name
+        if (quality, source_name) in failed:
+            continue
+        try:
+            with transaction.atomic():
+                jobs.append(AudioJob.objects.create(song=song, target_quality=quality, source_name=source_name))
+        except IntegrityError:
+            # Already queued or running (unique_active_audio_job)
+            pass
+    return jobs
+
+
+def retry_failed():
+    """
+    Queue a new job for every missing rendition of songs with failed jobs;
+    returns the new jobs
+    """
+    songs = Song.objects.filter(audio_jobs__status=AudioJob.STATUS_FAILED).distinct().defer('lyric')
+    return [job for song in songs.iterator(chunk_size=500) for job in enqueue_missing(song, retry_failed=True)]
+
+
+def requeue_stale():
+    """
+    Give jobs whose worker stopped reporting back to another worker, or fail
+    them when they have no attempts left
+    """
+    now = timezone.now()
+    stale = AudioJob.objects.filter(
+        status=AudioJob.STATUS_RUNNING,
+        started_at__lt=now - timedelta(seconds=_setting('AUDIO_JOB_TIMEOUT', 60 * 60)),
+    )
+    max_attempts = _setting('AUDIO_JOB_MAX_ATTEMPTS', 3)
+    error = 'Worker stopped before the job finished'
+    stale.filter(attempts__gte=max_attempts).update(status=AudioJob.STATUS_FAILED, error=error, finished_at=now)
+    return stale.update(status=AudioJob.STATUS_QUEUED, error=error, available_at=now)
+
+
+def claim(worker, limit):
+    """
+    Mark up to limit due jobs as running for worker and return them
+    """
+    if limit <= 0:
+        return []
+    now = timezone.now()
+    candidates = AudioJob.objects.filter(
+        status=AudioJob.STATUS_QUEUED, available_at__lte=now,
+    ).order_by('available_at', 'pk').values_list('pk', flat=True)[:limit * 2]
+
+    claimed = []
+    for pk in candidates:
+        # Another worker may have taken it since the read; the update only
+        # succeeds for the worker that still sees it queued
+        if AudioJob.objects.filter(pk=pk, status=AudioJob.STATUS_QUEUED).update(
+            status=AudioJob.STATUS_RUNNING, worker=worker, started_at=now, attempts=F('attempts') + 1,
+        ):
+            claimed.append(pk)
+            if len(claimed) == limit:
+                break
+    return list(AudioJob.objects.filter(pk__in=claimed).select_related('song').order_by('available_at', 'pk'))
+
+
+def prepare(job):
+    """
+    The picklable task for transcode_task: (job id, transcoder, source path,
+    target quality, output path). Raises TranscodeError when the song has no
+    source for the job any more.
+    """
+    source_quality, source_file = best_source(job.song, job.target_quality)
+    if source_file is None:
+        raise TranscodeError('No source audio to derive this quality from')
+    job.source_quality = source_quality
+    job.source_name = source_file.name
+    job.save(update_fields=['source_quality', 'source_name'])
+
+    transcoder_path = get_transcoder_path()
+    temp_dir = _setting('AUDIO_TRANSCODE_TEMP_DIR', os.path.join(settings.BASE_DIR, 'transcode_tmp'))
+    os.makedirs(temp_dir, exist_ok=True)
+    output_path = os.path.join(temp_dir, f'{job.pk}-{job.attempts}{import_string(transcoder_path).extension}')
+    return job.pk, transcoder_path, source_file.path, job.target_quality, output_path
+
+
+def transcode_task(task):
+    """
+    Run one transcode; executed in the worker pool. Returns (job id, output
+    path or None, error or None, seconds taken).
+    """
+    job_id, transcoder_path, source_path, quality, output_path = task
+    started = time.perf_counter()
+    try:
+        import_string(transcoder_path)().transcode(source_path, output_path, quality)
+    except Exception as e:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return job_id, None, f'{type(e).__name__}: {e}', time.perf_counter() - started
+    return job_id, output_path, None, time.perf_counter() - started
+
+
+def finish(job, output_path, error, elapsed, retry=True):
+    """
+    Record the outcome of an attempt. A successful rendition is moved into
+    the song's field for the job's quality; a failed attempt is queued again
+    after a backoff while attempts remain.
+    """
+    now = timezone.now()
+    job.elapsed = elapsed
+    job.finished_at = now
+
+    if error is None:
+        field_name = AUDIO_QUALITY_FIELDS[job.target_quality]
+        song = Song.objects.get(pk=job.song_id)
+        job.output_size = os.path.getsize(output_path)
+        if getattr(song, field_name).name:
+            # Someone uploaded this quality while the job ran; theirs wins
+            os.remove(output_path)
+        else:
+            with open(output_path, 'rb') as output:
+                # The field's upload_to puts it at songs/{quality}/{song id}{extension}
+                getattr(song, field_name).save(os.path.basename(output_path), StagedFile(output), save=False)
+            # Saving also records the new file's metadata (see signals.sync_audio_metadata)
+            song.save(update_fields=[field_name])
+        job.status = AudioJob.STATUS_DONE
+        job.error = ''
+    elif retry and job.attempts < _setting('AUDIO_JOB_MAX_ATTEMPTS', 3):
+        job.status = AudioJob.STATUS_QUEUED
+        job.available_at = now + timedelta(seconds=_setting('AUDIO_JOB_RETRY_DELAY', 60) * 2 ** (job.attempts - 1))
+        job.error = error
+    else:
+        job.status = AudioJob.STATUS_FAILED
+        job.error = error
+    job.save()
+    return job
@@ -0,0 +1,124 @@
+"""
+Prefetch manifests for gapless "up next" playback.
+
+Instead of asking SongViewSet.audio for each track as the queue advances,
+a client fetches the manifest of the next few tracks of a playlist (or of
+its own queue) in one request. Each entry has the signed URL of the chosen
+quality, its size, duration and bitrate from the stored metadata, and the
+byte range covering its first UP_NEXT_PREFETCH_SECONDS, so the client can
+fetch the opening of the next track while the current one plays.
+
+Songs come from one read on the playlist's through table (ordered by its
+primary key, the order songs were added) joined to the songs, plus one
+prefetch of their metadata; nothing here touches the media volume.
+"""
+import math
+
+from django.conf import settings
+from django.db.models import Prefetch
+
+from .models import Song, Playlist, AudioFileMetadata
+from . import signed_media
+
+SONG_COLUMNS = [
+    'id', 'title', 'duration', 'audio_lossless', 'audio_320kbps', 'audio_128kbps', 'audio',
+]
+METADATA_COLUMNS = ['id', 'song_id', 'quality', 'file_name', 'size', 'duration', 'bitrate', 'codec', 'checksum']
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def max_tracks():
+    return _setting('UP_NEXT_MAX_TRACKS', 20)
+
+
+def _metadata_prefetch(lookup):
+    return Prefetch(lookup, queryset=AudioFileMetadata.objects.only(*METADATA_COLUMNS))
+
+
+def playlist_songs(playlist, start, count):
+    """
+    The songs at positions start to start + count - 1 of playlist
+    """
+    entries = (
+        Playlist.songs.through.objects
+        .filter(playlist_id=playlist.pk)
+        .order_by('pk')
+        .select_related('song')
+        .only('song', *(f'song__{column}' for column in SONG_COLUMNS))
+        .prefetch_related(_metadata_prefetch('song__audio_metadata'))
+    )
+    return [entry.song for entry in entries[start:start + count]]
+
+
+def queue_songs(song_ids):
+    """
+    The songs of a client-side queue, in queue order, with None for ids
+    that don't exist
+    """
+    songs = Song.objects.only(*SONG_COLUMNS).prefetch_related(_metadata_prefetch('audio_metadata'))
+    found = songs.in_bulk(song_ids)
+    return [found.get(song_id) for song_id in song_ids]
+
+
+def prefetch_range(size, duration, bitrate):
+    """
+    (first, last) bytes covering the first UP_NEXT_PREFETCH_SECONDS of a
+    file, or None when its length in seconds is unknown
+    """
+    seconds = _setting('UP_NEXT_PREFETCH_SECONDS', 10)
+    if size and duration:
+        # The average rate over the whole file also covers any tags in front
+        length = math.ceil(size * seconds / duration)
+    elif bitrate:
+        length = bitrate * 1000 // 8 * seconds
+    else:
+        return None
+    return 0, min(size or length, length) - 1
+
+
+def track(song, quality, position, expires):
+    """
+    Manifest entry for song when played at quality; None when there is no
+    such song or it has no audio at all
+    """
+    if song is None:
+        return None
+    served_quality, audio_file = song.get_audio_file(quality)
+    if audio_file is None:
+        return None
+    metadata = song.get_audio_metadata(served_quality)
+    duration = metadata.duration if metadata and metadata.duration else song.duration
+    size = metadata.size if metadata else None
+    bitrate = metadata.bitrate if metadata else None
+
+    byte_range = prefetch_range(size, duration.total_seconds() if duration else None, bitrate)
+    return {
+        'position': position,
+        'id': song.id,
+        'title': song.title,
+        'quality': served_quality,
+        'audio_url': signed_media.signed_url(audio_file, expires=expires),
+        'file_size': size,
+        'duration': duration.total_seconds() if duration else None,
+        'bitrate': bitrate,
+        'codec': metadata.codec if metadata else None,
+        'checksum': metadata.checksum if metadata else None,
+        'prefetch_range': f'bytes={byte_range[0]}-{byte_range[1]}' if byte_range else None,
+    }
+
+
+def manifest(songs, quality, start):
+    """
+    Manifest of songs, the first at position start, with one expiry for
+    every URL in it
+    """
+    expires = signed_media.expiry()
+    tracks = [track(song, quality, start + offset, expires) for offset, song in enumerate(songs)]
+    return {
+        'quality': quality,
+        'expires': expires,
+        'tracks': [entry for entry in tracks if entry is not None],
+    }
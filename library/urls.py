@@ -2,7 +2,7 @@ from django.urls import path
 from rest_framework.routers import DefaultRouter
 
 from .views import SongViewSet, ArtistViewSet, AlbumViewSet, PlaylistViewSet
-from .views import SearchView, UpdateListeningHistoryView, ListeningHistoryView, AddSongToPlaylistView, RemoveSongFromPlaylistView, LikedSongsView, UploadLyricsView, UserPlaylistsView, PublicPlaylistsView, FriendsPlaylistsView
+from .views import SignedMediaView, SearchView, AsyncSearchView, AutocompleteView, UpdateListeningHistoryView, ListeningHistoryView, AddSongToPlaylistView, RemoveSongFromPlaylistView, LikedSongsView, UploadLyricsView, UserPlaylistsView, PublicPlaylistsView, FriendsPlaylistsView
 
 router = DefaultRouter()
 router.register(r'songs', SongViewSet, basename='song')
@@ -11,7 +11,10 @@ router.register(r'albums', AlbumViewSet, basename='album')
 router.register(r'playlists', PlaylistViewSet, basename='playlist')
 
 urlpatterns = router.urls + [
+    path('media/<path:name>', SignedMediaView.as_view(), name='signed-media'),
     path('search/', SearchView.as_view(), name='search'),
+    path('search/async/', AsyncSearchView.as_view(), name='search_async'),
+    path('autocomplete/', AutocompleteView.as_view(), name='autocomplete'),
     path('update-position/', UpdateListeningHistoryView.as_view(), name='update_position'),
     path('history/', ListeningHistoryView.as_view(), name='listening_history'),
     path('add-song-to-playlist/', AddSongToPlaylistView.as_view(), name='add_song_to_playlist'),
@@ -0,0 +1,17 @@
+def in_rank_order(queryset, ids):
+    """
+    Fetch ids from queryset and return the objects in the order of ids
+    """
+    objects = queryset.in_bulk(ids)
+    return [objects[object_id] for object_id in ids if object_id in objects]
+
+
+def format_bytes(size):
+    """
+    size in bytes for humans, e.g. 1.5 MB
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
+    return f'{size:.1f} TB'
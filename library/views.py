@@ -1,44 +1,325 @@
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ReadOnlyModelViewSet, ModelViewSet
-from rest_framework.permissions import IsAuthenticated
-from django.db.models import Q
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from django.db.models import Q, Prefetch
 from django.db import models
 from django.contrib.auth.models import User
+import asyncio
+import hashlib
 import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.views import View
+from django.core.files.storage import default_storage
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
 from rest_framework import status
 from rest_framework.decorators import api_view, action
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from rest_framework.utils.urls import replace_query_param
 
-from .models import Song, Artist, Album, ListeningHistory, Playlist
-from .serializers import SongSerializer, SimpleSongSerializer, ArtistSerializer, AlbumSerializer, PlaylistSerializer, PlaylistDetailSerializer, ListeningHistorySerializer
+from .models import Song, Artist, Album, ListeningHistory, Playlist, AudioFileMetadata, AudioUpload, AUDIO_QUALITY_FIELDS
+from authentication.models import Friendship, UserProfile
+from .serializers import SongSerializer, SimpleSongSerializer, ArtistSerializer, SimpleArtistSerializer, AlbumSerializer, SearchSongSerializer, SearchAlbumSerializer, PlaylistSerializer, PlaylistDetailSerializer, ListeningHistorySerializer
+from .serializers import field_selection, nested_selection
 from .permissions import CanAcessPermission
+from .pagination import CatalogPaginationMixin, CatalogCursorPagination
+from .conditional import ConditionalGetMixin, ConditionalViewSetMixin
+from .streaming import StreamContentNegotiation
+from .media_delivery import media_response, deliver, StoredFile
+from .storage import share_file
+from . import album_feed, chunked_upload, search, search_cache, signed_media, thumbnails, up_next, waveform
+from .autocomplete import prefix_index
+from .utils import in_rank_order
+from symphonia.renderers import negotiated_response
+from symphonia.text import normalize_text
+
+# Upload ids in the chunked upload URLs
+UUID_PATTERN = '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+
+# Response key -> (search index kind, normalized shadow column)
+SEARCH_CATEGORY_FIELDS = {
+    'songs': (search.KIND_SONG, 'title_normalized'),
+    'artists': (search.KIND_ARTIST, 'name_normalized'),
+    'albums': (search.KIND_ALBUM, 'title_normalized'),
+}
+
+# Querysets and serializers used to render each category in each response mode.
+# 'compact' prefetches everything it renders and never touches storage, so a
+# search page costs the same number of queries however many results it has.
+SEARCH_MODES = {
+    'full': {
+        'songs': (Song.objects.prefetch_related('artist', 'album__artist', 'audio_metadata'), SongSerializer),
+        'artists': (Artist.objects.all(), ArtistSerializer),
+        'albums': (Album.objects.prefetch_related('artist', 'songs'), AlbumSerializer),
+    },
+    'compact': {
+        'songs': (
+            Song.objects.defer('lyric').prefetch_related(
+                Prefetch('artist', queryset=Artist.objects.only('id', 'name')),
+                Prefetch('album', queryset=Album.objects.only('id', 'title')),
+            ),
+            SearchSongSerializer,
+        ),
+        'artists': (Artist.objects.only('id', 'name', 'artist_picture'), SimpleArtistSerializer),
+        'albums': (
+            Album.objects.prefetch_related(Prefetch('artist', queryset=Artist.objects.only('id', 'name'))),
+            SearchAlbumSerializer,
+        ),
+    },
+}
+
+def search_category(category, query, max_results, mode='full', after=None):
+    """
+    Search a single category, starting after the position of a previous page.
+    Returns (serialized results, position of the last result or None when
+    there is nothing left)
+    """
+    kind, normalized_field = SEARCH_CATEGORY_FIELDS[category]
+    queryset, serializer_class = SEARCH_MODES[mode][category]
+    if search.is_available():
+        # Relevance-ranked lookups through the full-text and trigram indexes
+        ids, position = search.search_page(kind, query, max_results, after)
+        objects = in_rank_order(queryset, ids)
+    else:
+        # Keyset on the primary key: each page is one range read
+        normalized_query = normalize_text(query)
+        objects = queryset.filter(**{f'{normalized_field}__icontains': normalized_query})
+        if after is not None:
+            objects = objects.filter(pk__gt=after[1])
+        objects = list(objects.order_by('pk')[:max_results])
+        position = ('pk', objects[-1].pk) if len(objects) == max_results else None
+    return list(serializer_class(objects, many=True).data), position
+
+def search_estimated_total(category, query):
+    kind, normalized_field = SEARCH_CATEGORY_FIELDS[category]
+    if search.is_available():
+        return search.estimate_total(kind, query)
+    queryset = SEARCH_MODES['full'][category][0]
+    normalized_query = normalize_text(query)
+    return queryset.filter(**{f'{normalized_field}__icontains': normalized_query})[:search.ESTIMATE_CAP].count()
+
+def search_overview(query, pages):
+    """
+    Response body for a search over every category. pages maps each category
+    to the (results, position) returned by search_category.
+    """
+    results = {category: page[0] for category, page in pages.items()}
+    results['next_cursors'] = {
+        category: search.encode_cursor(SEARCH_CATEGORY_FIELDS[category][0], query, position, None) if position else None
+        for category, (_, position) in pages.items()
+    }
+    return results
+
+def search_results(params):
+    """
+    Response body for SearchView: the first page of every category, or the
+    page of params['category'] after params['cursor']
+    """
+    query, max_results, mode, category = params['query'], params['max_results'], params['mode'], params['category']
+    if category is None:
+        return search_overview(query, {
+            category: search_category(category, query, max_results, mode)
+            for category in SEARCH_CATEGORY_FIELDS
+        })
+
+    after, estimated_total = params['cursor'] or (None, None)
+    results, position = search_category(category, query, max_results, mode, after)
+    if estimated_total is None:
+        estimated_total = search_estimated_total(category, query)
+    kind = SEARCH_CATEGORY_FIELDS[category][0]
+    return {
+        'results': results,
+        'next_cursor': search.encode_cursor(kind, query, position, estimated_total) if position else None,
+        'estimated_total': estimated_total,
+    }
+
+def parse_search_params(query_params):
+    """
+    Validate SearchView query parameters.
+    Returns (params, error message)
+    """
+    params = {
+        'query': query_params.get('query', None),
+        'max_results': int(query_params.get('max_results', 5)),  # Default to 5 results
+        'mode': query_params.get('mode', 'full'),
+        'category': query_params.get('category', None),
+        'cursor': None,
+    }
+    cursor = query_params.get('cursor', None)
+
+    if not params['query']:
+        return params, 'Query parameter is required'
+    if params['mode'] not in SEARCH_MODES:
+        return params, f'Invalid mode. Must be one of: {", ".join(SEARCH_MODES)}'
+    if params['category'] is not None and params['category'] not in SEARCH_CATEGORY_FIELDS:
+        return params, f'Invalid category. Must be one of: {", ".join(SEARCH_CATEGORY_FIELDS)}'
+    if cursor:
+        if params['category'] is None:
+            return params, 'The category parameter is required with a cursor'
+        params['cursor'] = search.decode_cursor(cursor, SEARCH_CATEGORY_FIELDS[params['category']][0], params['query'])
+        if params['cursor'] is None:
+            return params, 'Invalid cursor'
+    return params, None
+
+def parse_up_next_params(query_params):
+    """
+    Validate the query parameters of the up-next manifests: the position of
+    the track playing now (-1 before the first) and how many tracks follow.
+    Returns (quality, first position, count, error message)
+    """
+    quality = query_params.get('quality', '320kbps')
+    try:
+        position = int(query_params.get('position', -1))
+        count = int(query_params.get('count', 5))
+    except ValueError:
+        return quality, None, None, 'position and count must be integers'
+    if position < -1:
+        return quality, None, None, 'position must be -1 or more'
+    if count < 1:
+        return quality, None, None, 'count must be at least 1'
+    return quality, position + 1, min(count, up_next.max_tracks()), None
+
+def search_cache_params(params):
+    return {
+        'max_results': params['max_results'],
+        'mode': params['mode'],
+        'category': params['category'],
+        'cursor': params['cursor'],
+    }
 
 class SearchView(APIView):
     def get(self, request, *args, **kwargs):
+        """
+        Search songs, artists and albums
+        Usage: GET /api/library/search/?query=...&max_results=5&mode=full
+        Each category's next_cursor loads more of that category:
+        GET /api/library/search/?query=...&category=songs&cursor=...
+        """
+        params, error = parse_search_params(request.query_params)
+        if error:
+            return Response({'error': error}, status=400)
+
+        results = search_cache.get_or_compute(
+            params['query'],
+            lambda: search_results(params),
+            **search_cache_params(params),
+        )
+        return Response(results)
+
+# Worker threads of AsyncSearchView. They live as long as the process, so
+# with CONN_MAX_AGE each keeps its database connection between requests
+search_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'SEARCH_THREADS', 30),
+    thread_name_prefix='search',
+)
+
+def _in_search_thread(function, *args, **kwargs):
+    # What the request_started and request_finished signals do for a WSGI
+    # worker: drop the thread's connection only when it is too old or broken
+    close_old_connections()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+async def in_search_thread(function, *args, **kwargs):
+    """
+    Run function on a search_executor thread. Not thread-sensitive, so
+    calls from concurrent requests don't queue behind each other.
+    """
+    return await sync_to_async(_in_search_thread, thread_sensitive=False, executor=search_executor)(
+        function, *args, **kwargs
+    )
+
+class AsyncSearchView(View):
+    """
+    Same results as SearchView, with the song, artist and album lookups
+    running concurrently so latency follows the slowest category rather
+    than the sum of all three. Meant to be served by symphonia.asgi;
+    bench_search compares the two.
+    Usage: GET /api/library/search/async/?query=...&max_results=5&mode=full
+    """
+    async def get(self, request, *args, **kwargs):
+        params, error = parse_search_params(request.GET)
+        if error:
+            return negotiated_response(request, {'error': error}, status=400)
+
+        key, results = await in_search_thread(search_cache.lookup, params['query'], **search_cache_params(params))
+        if results is None:
+            if params['category'] is None:
+                pages = await asyncio.gather(*(
+                    in_search_thread(search_category, category, params['query'], params['max_results'], params['mode'])
+                    for category in SEARCH_CATEGORY_FIELDS
+                ))
+                results = search_overview(params['query'], dict(zip(SEARCH_CATEGORY_FIELDS, pages)))
+            else:
+                # A single category page has nothing to run concurrently
+                results = await in_search_thread(search_results, params)
+            await in_search_thread(search_cache.store, key, results)
+        return negotiated_response(request, results)
+
+class SignedMediaView(View):
+    """
+    Serve a media file named by a signed URL (see signed_media). The
+    signature is the whole authorization check: no session, token or
+    database lookup, so responses can be cached by the URL until it expires.
+    Usage: GET /api/library/media/<file name>?expires=...&signature=...
+    """
+    def get(self, request, name):
+        expires = request.GET.get('expires')
+        if not signed_media.verify(name, expires, request.GET.get('signature')):
+            return negotiated_response(request, {'error': 'Invalid or expired media link'}, status=403)
+        # Thumbnails go out as the smallest format the client accepts
+        served_name = thumbnails.negotiate(default_storage, name, request.headers.get('Accept', ''))
+        try:
+            response = deliver(request, StoredFile(default_storage, served_name))
+        except FileNotFoundError:
+            return negotiated_response(request, {'error': 'Media file not found'}, status=404)
+        patch_cache_control(response, public=True, max_age=max(int(expires) - int(time.time()), 0))
+        if thumbnails.parse_thumbnail_name(name) is not None and thumbnails.variant_formats():
+            patch_vary_headers(response, ['Accept'])
+        return response
+
+class AutocompleteView(APIView):
+    def get(self, request, *args, **kwargs):
+        """
+        Compact title suggestions for the search box
+        Usage: GET /api/library/autocomplete/?query=son&limit=10&types=song,artist
+        """
         query = request.query_params.get('query', None)
-        max_results = int(request.query_params.get('max_results', 5))  # Default to 5 results
+        limit = min(int(request.query_params.get('limit', 10)), 50)
+        types = request.query_params.get('types', None)
 
         if not query:
             return Response({'error': 'Query parameter is required'}, status=400)
 
-        songs = Song.objects.filter(Q(title__icontains=query))[:max_results]
-        artists = Artist.objects.filter(Q(name__icontains=query))[:max_results]
-        albums = Album.objects.filter(Q(title__icontains=query))[:max_results]
+        kinds = set(types.split(',')) if types else None
+        return Response(prefix_index.lookup(query, limit=limit, kinds=kinds))
 
-        song_serializer = SongSerializer(songs, many=True)
-        artist_serializer = ArtistSerializer(artists, many=True)
-        album_serializer = AlbumSerializer(albums, many=True)
-
-        return Response({
-            'songs': song_serializer.data,
-            'artists': artist_serializer.data,
-            'albums': album_serializer.data,
-        })
-
-class SongViewSet(ReadOnlyModelViewSet):
-    queryset = Song.objects.all()
+class SongViewSet(ConditionalViewSetMixin, CatalogPaginationMixin, ReadOnlyModelViewSet):
+    # Everything SongSerializer renders, so a page costs a fixed number of queries
+    queryset = Song.objects.prefetch_related('artist', 'album__artist', 'audio_metadata')
     serializer_class = SongSerializer
+    conditional_models = (Song, Artist, Album, AudioFileMetadata)
+
+    def get_queryset(self):
+        if self.action in ('stream', 'cover'):
+            # Only the file fields and the stored checksums are needed to send files
+            return Song.objects.defer('lyric').prefetch_related('audio_metadata')
+        if self.action in ('start_upload', 'upload_status', 'upload_chunk'):
+            return Song.objects.defer('lyric')
+        if self.action == 'waveform_peaks':
+            # The file names tell whether the stored peaks are still current
+            return Song.objects.select_related('waveform').only('id', *waveform.SOURCE_FIELDS.values(), 'waveform')
+        # Don't read the lyrics JSON unless ?fields= asks for it
+        fields, _ = field_selection(self.request)
+        return super().get_queryset().defer(*SongSerializer.deferred_columns(fields))
     
     @action(detail=True, methods=['get'])
     def audio(self, request, pk=None):
@@ -49,7 +330,9 @@ class SongViewSet(ReadOnlyModelViewSet):
         song = self.get_object()
         quality = request.query_params.get('quality', '320kbps')
         
-        audio_url = song.get_audio_url(quality)
+        expires = signed_media.expiry()
+        _, audio_file = song.get_audio_file(quality)
+        audio_url = signed_media.signed_url(audio_file, expires=expires)
         if not audio_url:
             return Response(
                 {
@@ -59,13 +342,91 @@ class SongViewSet(ReadOnlyModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
+        metadata = song.get_audio_metadata(quality)
         return Response({
             'audio_url': audio_url,
+            'expires': expires,
             'quality': quality,
             'available_qualities': song.get_available_qualities(),
-            'file_size': song.get_file_size(quality)
+            'file_size': metadata.size if metadata else 0,
+            'bitrate': metadata.bitrate if metadata else None,
+            'codec': metadata.codec if metadata else None,
+            'checksum': metadata.checksum if metadata else None,
         })
     
+    @action(detail=False, methods=['get'], url_path='up-next')
+    def up_next(self, request):
+        """
+        URLs, sizes, durations and prefetch ranges of the tracks after a
+        position in a client-side queue, to fetch ahead of playback
+        Usage: GET /api/library/songs/up-next/?queue=4,9,2,7&position=0&count=2&quality=320kbps
+        """
+        quality, start, count, error = parse_up_next_params(request.query_params)
+        try:
+            queue = [int(song_id) for song_id in request.query_params.get('queue', '').split(',') if song_id]
+        except ValueError:
+            error = error or 'queue must be a comma-separated list of song ids'
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(up_next.manifest(up_next.queue_songs(queue[start:start + count]), quality, start))
+
+    @action(detail=True, methods=['get'], content_negotiation_class=StreamContentNegotiation)
+    def stream(self, request, pk=None):
+        """
+        Stream audio for a specific quality, with HTTP Range support for seeking
+        Usage: GET /api/library/songs/{id}/stream/?quality=lossless
+        """
+        song = self.get_object()
+        quality = request.query_params.get('quality', '320kbps')
+
+        served_quality, audio_file = song.get_audio_file(quality)
+        if audio_file is None:
+            return Response(
+                {
+                    'error': 'Audio not available for this quality',
+                    'available_qualities': song.get_available_qualities()
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        metadata = song.get_audio_metadata(served_quality) if served_quality in AUDIO_QUALITY_FIELDS else None
+        return media_response(request, audio_file, 'Audio file is missing', checksum=metadata.checksum if metadata else None)
+
+    @action(detail=True, methods=['get'], content_negotiation_class=StreamContentNegotiation)
+    def cover(self, request, pk=None):
+        """
+        Cover art image of a song
+        Usage: GET /api/library/songs/{id}/cover/
+        """
+        return media_response(request, self.get_object().cover_art, 'Song has no cover art')
+
+    @action(
+        detail=True,
+        methods=['get'],
+        url_path='waveform',
+        url_name='waveform',
+        content_negotiation_class=StreamContentNegotiation,
+    )
+    def waveform_peaks(self, request, pk=None):
+        """
+        Waveform peaks for drawing a seek bar: a (min, max) pair of signed
+        bytes per bucket, see library/waveform.py
+        Usage: GET /api/library/songs/{id}/waveform/
+        """
+        song = self.get_object()
+        song_waveform = getattr(song, 'waveform', None)
+        if song_waveform is None or not waveform.is_current(song_waveform, song):
+            return Response({'error': 'Waveform not computed yet'}, status=status.HTTP_404_NOT_FOUND)
+
+        peaks = bytes(song_waveform.peaks)
+        etag = f'"{hashlib.sha256(peaks).hexdigest()[:32]}"'
+        response = get_conditional_response(request._request, etag=etag)
+        if response is None:
+            response = HttpResponse(peaks, content_type='application/octet-stream')
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=getattr(settings, 'WAVEFORM_CACHE_MAX_AGE', 24 * 60 * 60))
+        return response
+
     @action(detail=True, methods=['post'])
     def upload_audio(self, request, pk=None):
         """
@@ -105,9 +466,11 @@ class SongViewSet(ReadOnlyModelViewSet):
             song.audio_lossless = audio_file
         elif quality == '320kbps':
             song.audio_320kbps = audio_file
-        elif quality == '140kbps':
-            song.audio_140kbps = audio_file
+        elif quality == '128kbps':
+            song.audio_128kbps = audio_file
         
+        # Saving also records the file's size, duration, bitrate and checksum
+        # (see signals.sync_audio_metadata)
         song.save()
         
         serializer = SongSerializer(song)
@@ -116,39 +479,190 @@ class SongViewSet(ReadOnlyModelViewSet):
             'song': serializer.data
         }, status=status.HTTP_200_OK)
 
-class ArtistViewSet(ReadOnlyModelViewSet):
+    def _upload_status(self, upload):
+        return {
+            'upload_id': str(upload.id),
+            'quality': upload.quality,
+            'size': upload.size,
+            'chunk_size': upload.chunk_size,
+            'chunk_count': upload.chunk_count,
+            'received_chunks': chunked_upload.received_chunks(upload),
+            'status': upload.status,
+        }
+
+    def _get_upload(self, song, upload_id):
+        return AudioUpload.objects.filter(song=song, pk=upload_id).first()
+
+    @action(detail=True, methods=['post'], url_path='uploads', permission_classes=[IsAdminUser])
+    def start_upload(self, request, pk=None):
+        """
+        Start a resumable upload of a large audio file (see library/chunked_upload.py)
+        Usage: POST /api/library/songs/{id}/uploads/ with quality, file_name, size and checksum (SHA-256)
+        """
+        song = self.get_object()
+        try:
+            upload = chunked_upload.start(
+                song,
+                request.data.get('quality', '320kbps'),
+                request.data.get('file_name'),
+                request.data.get('size'),
+                request.data.get('checksum'),
+            )
+        except chunked_upload.UploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self._upload_status(upload), status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get', 'delete'], url_path=f'uploads/(?P<upload_id>{UUID_PATTERN})', permission_classes=[IsAdminUser])
+    def upload_status(self, request, pk=None, upload_id=None):
+        """
+        Chunks received so far, to resume an upload; DELETE aborts it
+        Usage: GET /api/library/songs/{id}/uploads/{upload_id}/
+        """
+        upload = self._get_upload(self.get_object(), upload_id)
+        if upload is None:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        if request.method == 'DELETE':
+            chunked_upload.discard_chunks(upload)
+            upload.delete()
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(self._upload_status(upload))
+
+    @action(detail=True, methods=['put'], url_path=f'uploads/(?P<upload_id>{UUID_PATTERN})/chunks/(?P<index>[0-9]+)', permission_classes=[IsAdminUser])
+    def upload_chunk(self, request, pk=None, upload_id=None, index=None):
+        """
+        Store one chunk; the body is the raw bytes and X-Content-SHA256 their SHA-256
+        Usage: PUT /api/library/songs/{id}/uploads/{upload_id}/chunks/{index}/
+        """
+        upload = self._get_upload(self.get_object(), upload_id)
+        if upload is None:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        try:
+            # Read the body as a stream: request.data would load it into memory
+            chunked_upload.write_chunk(upload, int(index), request.stream, content_length, request.META.get('HTTP_X_CONTENT_SHA256'))
+        except chunked_upload.UploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self._upload_status(upload))
+
+    @action(detail=True, methods=['post'], url_path=f'uploads/(?P<upload_id>{UUID_PATTERN})/finalize', permission_classes=[IsAdminUser])
+    def finalize_upload(self, request, pk=None, upload_id=None):
+        """
+        Assemble the chunks, verify the file checksum and store the audio
+        Usage: POST /api/library/songs/{id}/uploads/{upload_id}/finalize/
+        """
+        upload = self._get_upload(self.get_object(), upload_id)
+        if upload is None:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            song = chunked_upload.finalize(upload)
+        except chunked_upload.UploadError as e:
+            return Response({'error': str(e), **self._upload_status(upload)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'message': f'Audio uploaded successfully for {upload.quality} quality',
+            'song': SongSerializer(song).data
+        }, status=status.HTTP_200_OK)
+
+class ArtistViewSet(ConditionalViewSetMixin, CatalogPaginationMixin, ReadOnlyModelViewSet):
     queryset = Artist.objects.all()
     serializer_class = ArtistSerializer
+    conditional_models = (Artist,)
+
+    def get_queryset(self):
+        fields, _ = field_selection(self.request)
+        return super().get_queryset().defer(*ArtistSerializer.deferred_columns(fields))
 
-class AlbumViewSet(ReadOnlyModelViewSet):
-    queryset = Album.objects.all()
+class AlbumViewSet(ConditionalViewSetMixin, CatalogPaginationMixin, ReadOnlyModelViewSet):
+    queryset = Album.objects.prefetch_related('artist', 'songs')
     serializer_class = AlbumSerializer
+    conditional_models = (Album, Artist, Song)
+
+    def get_queryset(self):
+        if self.action == 'cover':
+            return Album.objects.all()
+        fields, expand = field_selection(self.request)
+        if 'songs' not in expand:
+            return super().get_queryset()
+        # Expanded songs render their artists and albums
+        songs = Song.objects.defer(
+            *SimpleSongSerializer.deferred_columns(nested_selection(fields, 'songs'))
+        ).prefetch_related('artist', 'album')
+        return Album.objects.prefetch_related('artist', Prefetch('songs', queryset=songs))
     
+    @action(detail=True, methods=['get'], content_negotiation_class=StreamContentNegotiation)
+    def cover(self, request, pk=None):
+        """
+        Cover art image of an album
+        Usage: GET /api/library/albums/{id}/cover/
+        """
+        return media_response(request, self.get_object().cover_art, 'Album has no cover art')
+
     def list(self, request, *args, **kwargs):
-        # Get all albums and shuffle them
-        albums = list(Album.objects.all())
-        import random
-        random.shuffle(albums)
-        
-        # Serialize the shuffled albums
-        serializer = self.get_serializer(albums, many=True)
-        return Response(serializer.data)
+        """
+        Shuffled album feed, stable for a seed
+        Usage: GET /api/library/albums/?seed=abc&page_size=20, then follow 'next'
+        """
+        if 'seed' not in request.query_params and 'cursor' not in request.query_params:
+            # A fresh random seed makes every response different
+            return self.shuffled_feed(request)
+        return self.conditional_response(request, lambda: self.shuffled_feed(request))
+
+    def shuffled_feed(self, request):
+        paginator = CatalogCursorPagination()
+        page_size = paginator.get_page_size(request)
+        cursor = request.query_params.get('cursor', None)
+        if cursor:
+            decoded = album_feed.decode_cursor(cursor)
+            if decoded is None:
+                return Response({'error': 'Invalid cursor'}, status=400)
+            seed, position = decoded
+        else:
+            seed, position = request.query_params.get('seed') or album_feed.new_seed(), None
+
+        ids, position = album_feed.page(seed, page_size, after=position)
+        serializer = self.get_serializer(in_rank_order(self.get_queryset(), ids), many=True)
+
+        next_url = None
+        if position is not None:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor', album_feed.encode_cursor(seed, position)
+            )
+        return Response({'seed': seed, 'next': next_url, 'results': serializer.data})
 
-class PlaylistViewSet(ModelViewSet):
+class PlaylistViewSet(ConditionalViewSetMixin, ModelViewSet):
     queryset = Playlist.objects.all()
     serializer_class = PlaylistSerializer
     permission_classes = [CanAcessPermission]
     parser_classes = [JSONParser, MultiPartParser, FormParser]
+    # Friendship: friends-only playlists stop being visible on an unfriend
+    conditional_models = (Playlist, Song, Artist, Album, UserProfile, Friendship)
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
             return PlaylistDetailSerializer
         return PlaylistSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ['list', 'retrieve']:
+            return queryset
+        # Nested songs are read for the durations even when not rendered, but
+        # their lyrics only when ?fields= asks for them
+        fields, _ = field_selection(self.request)
+        songs = Song.objects.defer(
+            *SimpleSongSerializer.deferred_columns(nested_selection(fields, 'songs'))
+        ).prefetch_related('artist', 'album')
+        return queryset.select_related('owner').prefetch_related(Prefetch('songs', queryset=songs))
+
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
     def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: self.owned_playlists(request))
+
+    def owned_playlists(self, request):
         # Get playlists owned by the current user, ordered by creation date (newest first)
         queryset = self.get_queryset().filter(owner=request.user).order_by('-created_at')
         
@@ -161,10 +675,34 @@ class PlaylistViewSet(ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
-    def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+
+    @action(
+        detail=True,
+        methods=['get'],
+        permission_classes=[IsAuthenticated, CanAcessPermission],
+        content_negotiation_class=StreamContentNegotiation,
+    )
+    def cover(self, request, pk=None):
+        """
+        Cover image of a playlist, for users who can access the playlist
+        Usage: GET /api/library/playlists/{id}/cover/
+        """
+        # get_object checks Playlist.is_accessible_by through CanAcessPermission
+        return media_response(request, self.get_object().cover_image, 'Playlist has no cover image')
+
+    @action(detail=True, methods=['get'], url_path='up-next')
+    def up_next(self, request, pk=None):
+        """
+        URLs, sizes, durations and prefetch ranges of the playlist's tracks
+        after a position, to fetch ahead of playback
+        Usage: GET /api/library/playlists/{id}/up-next/?position=3&count=5&quality=320kbps
+        """
+        quality, start, count, error = parse_up_next_params(request.query_params)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        # get_object checks Playlist.is_accessible_by through CanAcessPermission
+        playlist = self.get_object()
+        return Response(up_next.manifest(up_next.playlist_songs(playlist, start, count), quality, start))
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def upload_cover(self, request, pk=None):
@@ -342,38 +880,11 @@ class AddSongToPlaylistView(APIView):
             # automatically copy the song's cover art as playlist cover
             if is_first_song and not playlist.cover_image and song.cover_art:
                 try:
-                    import os
-                    import shutil
-                    from django.core.files import File
-                    from django.conf import settings
-                    
-                    print(f"Auto-copying cover from first song: {song.title}")
-                    print(f"Song cover art path: {song.cover_art.path}")
-                    
-                    # Get file extension from song cover art
-                    original_path = song.cover_art.path
-                    file_extension = os.path.splitext(original_path)[1]
-                    
-                    # Create new filename with playlist ID
-                    new_filename = f"{playlist.id}{file_extension}"
-                    playlist_covers_dir = os.path.join(settings.MEDIA_ROOT, 'images', 'playlist_covers')
-                    new_file_path = os.path.join(playlist_covers_dir, new_filename)
-                    
-                    print(f"Copying to: {new_file_path}")
-                    
-                    # Ensure the playlist covers directory exists
-                    os.makedirs(playlist_covers_dir, exist_ok=True)
-                    
-                    # Copy the file
-                    shutil.copy2(original_path, new_file_path)
-                    
-                    # Set the playlist cover_image field to the new file
-                    relative_path = f"images/playlist_covers/{new_filename}"
-                    playlist.cover_image.name = relative_path
+                    # Same bytes as the song cover: the media store links
+                    # them instead of keeping another copy
+                    cover_name = playlist.cover_image.field.generate_filename(playlist, os.path.basename(song.cover_art.name))
+                    playlist.cover_image.name = share_file(song.cover_art, cover_name)
                     playlist.save()
-                    
-                    print(f"Successfully copied and set playlist cover: {relative_path}")
-                    
                 except Exception as e:
                     print(f"Failed to copy song cover to playlist: {str(e)}")
                     import traceback
@@ -481,8 +992,12 @@ class LikedSongsView(APIView):
 
     def get(self, request, song_id=None):
         if not song_id:
-            liked_songs = Song.objects.filter(liked_by=request.user)
-            return Response(SimpleSongSerializer(liked_songs, many=True).data, status=200)
+            fields, expand = field_selection(request)
+            liked_songs = Song.objects.filter(liked_by=request.user).defer(
+                *SimpleSongSerializer.deferred_columns(fields)
+            ).prefetch_related('artist', 'album')
+            serializer = SimpleSongSerializer(liked_songs, many=True, fields=fields, expand=expand)
+            return Response(serializer.data, status=200)
         else:
             try:
                 song = Song.objects.get(id=song_id)
@@ -635,10 +1150,14 @@ class UploadLyricsView(APIView):
             status=status.HTTP_200_OK
         )
 
-class UserPlaylistsView(APIView):
+class UserPlaylistsView(ConditionalGetMixin, APIView):
     permission_classes = [IsAuthenticated]
+    conditional_models = (Playlist, UserProfile, Friendship)
 
     def get(self, request, user_id, *args, **kwargs):
+        return self.conditional_response(request, lambda: self.playlists(request, user_id))
+
+    def playlists(self, request, user_id):
         try:
             # Get the target user
             target_user = User.objects.get(id=user_id)
@@ -676,10 +1195,14 @@ class UserPlaylistsView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class PublicPlaylistsView(APIView):
+class PublicPlaylistsView(ConditionalGetMixin, APIView):
     permission_classes = [IsAuthenticated]
+    conditional_models = (Playlist, Song, UserProfile)
 
     def get(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: self.playlists(request))
+
+    def playlists(self, request):
         try:
             # Get all public playlists from all users
             public_playlists = Playlist.objects.filter(
@@ -722,10 +1245,14 @@ class PublicPlaylistsView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class FriendsPlaylistsView(APIView):
+class FriendsPlaylistsView(ConditionalGetMixin, APIView):
     permission_classes = [IsAuthenticated]
+    conditional_models = (Playlist, Song, UserProfile, Friendship)
 
     def get(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: self.playlists(request))
+
+    def playlists(self, request):
         try:
             # Get all friends of the current user
             current_user = request.user
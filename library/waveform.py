@@ -0,0 +1,188 @@
+"""
+Precomputed waveform peaks for seek bars.
+
+Players used to download and decode a whole file to draw its waveform.
+Instead the compute_waveforms command decodes each song once, splits the
+samples into WAVEFORM_BUCKETS equal slices and keeps the minimum and
+maximum of each, and SongViewSet.waveform serves the result as a small
+cacheable binary:
+
+    bucket count * 2 signed bytes: min, max, min, max, ...
+
+each the top byte of a 16-bit sample (-128 to 127 of full scale).
+
+16-bit PCM WAV files are read directly; everything else is decoded to
+mono 16-bit PCM at WAVEFORM_SAMPLE_RATE by ffmpeg. The reduction uses
+NumPy (minimum/maximum.reduceat over the bucket edges), which
+requirements.txt installs; without it a plain Python loop computes the
+same bytes, much more slowly. Peaks come from the cheapest
+file a song has to decode; they are recomputed when that file changes.
+"""
+import struct
+import subprocess
+import sys
+import wave
+from array import array
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Song, SongWaveform, AUDIO_QUALITY_FIELDS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Qualities peaks are read from, cheapest to decode first
+WAVEFORM_SOURCES = ['128kbps', '320kbps', 'legacy', 'lossless']
+SOURCE_FIELDS = {**AUDIO_QUALITY_FIELDS, 'legacy': 'audio'}
+
+
+class WaveformError(Exception):
+    pass
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def bucket_count():
+    return _setting('WAVEFORM_BUCKETS', 1000)
+
+
+def source(song):
+    """
+    (quality, file) to read peaks from, or (None, None)
+    """
+    for quality in WAVEFORM_SOURCES:
+        audio_file = getattr(song, SOURCE_FIELDS[quality])
+        if audio_file and audio_file.name:
+            return quality, audio_file
+    return None, None
+
+
+def is_current(waveform, song):
+    """
+    True if waveform was computed from the file song would take peaks
+    from now, with the configured bucket count
+    """
+    _, audio_file = source(song)
+    return audio_file is not None and waveform.file_name == audio_file.name and waveform.buckets == bucket_count()
+
+
+def songs_needing_waveforms(force=False):
+    """
+    Songs with audio whose peaks are missing or out of date
+    """
+    has_audio = Q()
+    for field_name in SOURCE_FIELDS.values():
+        has_audio |= Q(**{f'{field_name}__gt': ''})
+    songs = Song.objects.filter(has_audio).select_related('waveform').only(
+        'id', *SOURCE_FIELDS.values(), 'waveform__file_name', 'waveform__buckets',
+    )
+    for song in songs.iterator(chunk_size=2000):
+        waveform = getattr(song, 'waveform', None)
+        if force or waveform is None or not is_current(waveform, song):
+            yield song
+
+
+def _int16(data):
+    if np is not None:
+        return np.frombuffer(data, dtype='<i2')
+    samples = array('h', data[:len(data) - len(data) % 2])
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples
+
+
+def _read_wav(path):
+    """
+    Samples of a 16-bit PCM WAV file, all channels interleaved; None for
+    other formats
+    """
+    try:
+        with wave.open(path, 'rb') as wav:
+            if wav.getsampwidth() != 2 or wav.getcomptype() != 'NONE':
+                return None
+            return _int16(wav.readframes(wav.getnframes()))
+    except (wave.Error, EOFError):
+        return None
+
+
+def _decode(path):
+    command = [
+        _setting('FFMPEG_BINARY', 'ffmpeg'), '-nostdin', '-loglevel', 'error',
+        '-i', path, '-vn', '-ac', '1', '-ar', str(_setting('WAVEFORM_SAMPLE_RATE', 8000)),
+        '-f', 's16le', '-',
+    ]
+    try:
+        result = subprocess.run(command, check=True, capture_output=True)
+    except FileNotFoundError:
+        raise WaveformError(f'{command[0]} not found')
+    except subprocess.CalledProcessError as e:
+        raise WaveformError(e.stderr.decode('utf-8', 'replace').strip()[-500:] or f'ffmpeg exited with {e.returncode}')
+    return _int16(result.stdout)
+
+
+def read_samples(path):
+    samples = _read_wav(path) if path.lower().endswith('.wav') else None
+    return _decode(path) if samples is None else samples
+
+
+def peaks(samples, buckets):
+    """
+    Interleaved (min, max) signed bytes of samples (16-bit) in each of
+    buckets equal slices; a slice shorter than one sample repeats its
+    neighbour's sample
+    """
+    if len(samples) == 0:
+        return bytes(2 * buckets)
+    if np is not None:
+        samples = np.asarray(samples, dtype=np.int16)
+        edges = np.arange(buckets, dtype=np.int64) * len(samples) // buckets
+        pairs = np.empty((buckets, 2), dtype=np.int8)
+        pairs[:, 0] = np.minimum.reduceat(samples, edges) >> 8
+        pairs[:, 1] = np.maximum.reduceat(samples, edges) >> 8
+        return pairs.tobytes()
+
+    edges = [index * len(samples) // buckets for index in range(buckets)] + [len(samples)]
+    pairs = bytearray()
+    for start, end in zip(edges, edges[1:]):
+        bucket = samples[start:max(end, start + 1)]
+        pairs += struct.pack('bb', min(bucket) >> 8, max(bucket) >> 8)
+    return bytes(pairs)
+
+
+def compute_task(task):
+    """
+    Peaks of one file; executed in the command's process pool. Returns
+    (song id, quality, file name, peaks or None, error or None).
+    """
+    song_id, quality, file_name, path, buckets = task
+    try:
+        return song_id, quality, file_name, peaks(read_samples(path), buckets), None
+    except (OSError, WaveformError) as e:
+        return song_id, quality, file_name, None, str(e)
+
+
+def task_for(song):
+    """
+    The picklable compute_task argument for song, or None if it has no audio
+    """
+    quality, audio_file = source(song)
+    if audio_file is None:
+        return None
+    return song.pk, quality, audio_file.name, audio_file.path, bucket_count()
+
+
+def store(song_id, quality, file_name, peak_bytes):
+    SongWaveform.objects.update_or_create(
+        song_id=song_id,
+        defaults={
+            'source_quality': quality,
+            'file_name': file_name,
+            'buckets': len(peak_bytes) // 2,
+            'peaks': peak_bytes,
+        },
+    )
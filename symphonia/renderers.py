@@ -0,0 +1,96 @@
+"""
+Response renderers for the API.
+
+FastJSONRenderer encodes with orjson when it is installed and falls back to
+DRF's JSONRenderer otherwise. MessagePackRenderer gives mobile clients a
+compact binary encoding, selected with "Accept: application/msgpack" or
+?format=msgpack. Both fall back to DRF's JSON encoder for values they
+don't know (dates, decimals, lazy strings, ...), so every format carries
+the same data.
+"""
+from django.http import HttpResponse, JsonResponse
+import msgpack
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+_json_encoder = JSONEncoder()
+
+
+def _default(obj):
+    """
+    Convert what the fast encoders can't handle the way DRF's JSON encoder does
+    """
+    return _json_encoder.default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson. Indented output (e.g. for the
+    browsable API) still goes through the standard encoder.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Keep DRF's "Z" suffix for UTC datetimes
+        ret = orjson.dumps(data, default=_default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        # Escaped like JSONRenderer does, so the output is also valid JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def packb(data):
+    """
+    Encode data as MessagePack
+    """
+    return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = MSGPACK_MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return packb(data)
+
+
+def negotiated_response(request, data, status=200):
+    """
+    Response for plain Django views (outside DRF) in the format the client
+    asked for: MessagePack or JSON
+    """
+    formats = [FastJSONRenderer(), MessagePackRenderer()]
+    try:
+        renderer, media_type = DefaultContentNegotiation().select_renderer(_NegotiationRequest(request), formats)
+    except NotAcceptable:
+        renderer = formats[0]
+    if isinstance(renderer, MessagePackRenderer):
+        return HttpResponse(renderer.render(data), status=status, content_type=media_type)
+    if orjson is None:
+        return JsonResponse(data, status=status, encoder=JSONEncoder)
+    return HttpResponse(renderer.render(data), status=status, content_type='application/json')
+
+
+class _NegotiationRequest:
+    """
+    The parts of a DRF Request that content negotiation reads, for a plain HttpRequest
+    """
+
+    def __init__(self, request):
+        self.META = request.META
+        self.query_params = request.GET
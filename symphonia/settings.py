@@ -85,10 +85,40 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections between requests, including those of the
+        # AsyncSearchView worker threads
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# Local memory is per process. Switch to
+# 'django.core.cache.backends.filebased.FileBasedCache' with a shared LOCATION
+# to share cached search results and the catalog version between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'symphonia',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    }
+}
+
+# Search results cache (see library/search_cache.py)
+SEARCH_CACHE_ALIAS = 'default'
+SEARCH_CACHE_TIMEOUT = 300  # seconds
+# Search result cursors (library/search.py) are refused after this many seconds
+SEARCH_CURSOR_MAX_AGE = 60 * 60
+# Worker threads AsyncSearchView runs its lookups on, per process: the
+# three category lookups of 10 concurrent requests
+SEARCH_THREADS = 30
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -140,6 +170,12 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # JSON by default; MessagePack with "Accept: application/msgpack" or ?format=msgpack
+    'DEFAULT_RENDERER_CLASSES': (
+        'symphonia.renderers.FastJSONRenderer',
+        'symphonia.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Symphonia API',
@@ -149,6 +185,71 @@ SPECTACULAR_SETTINGS = {
 }
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+
+# Media is stored once per distinct content (library/storage.py): names are
+# hardlinks to SHA-256 blobs kept in MEDIA_BLOB_DIR. It must be outside
+# MEDIA_ROOT, which the debug media route and the proxy serve, and on the
+# same filesystem. Blobs of installs that kept them in MEDIA_ROOT/.blobs move
+# here with the directory. reclaim_media removes unreferenced blobs and
+# reports the space saved.
+STORAGES = {
+    'default': {'BACKEND': 'library.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+MEDIA_BLOB_DIR = os.path.join(BASE_DIR, 'media_blobs')
+
+# How the authorized media endpoints (song streams, covers, profile pictures)
+# send file bytes once a request is allowed:
+#   'django'            stream from the worker (local development)
+#   'x-accel-redirect'  hand the transfer to nginx, which must serve
+#                       MEDIA_ACCEL_REDIRECT_PREFIX as an internal location
+#                       aliased to MEDIA_ROOT
+#   'x-sendfile'        hand the transfer to Apache mod_xsendfile / lighttpd
+MEDIA_DELIVERY = 'django'
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Signed media URLs (library/signed_media.py) stay valid for at least
+# MEDIA_SIGNED_URL_TTL seconds; expiry times are rounded up to whole
+# MEDIA_SIGNED_URL_BUCKET periods so URLs repeat and stay cacheable.
+# MEDIA_SIGNING_KEY defaults to SECRET_KEY; set it to share the key with a proxy.
+MEDIA_SIGNED_URL_TTL = 6 * 60 * 60
+MEDIA_SIGNED_URL_BUCKET = 60 * 60
+MEDIA_SIGNING_KEY = None
+
+# Resumable audio uploads (library/chunked_upload.py): chunks are staged in
+# AUDIO_UPLOAD_TEMP_DIR, ideally on the same filesystem as MEDIA_ROOT so the
+# finished file is moved rather than copied into place
+AUDIO_UPLOAD_TEMP_DIR = os.path.join(BASE_DIR, 'upload_chunks')
+AUDIO_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+AUDIO_UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+# Background transcoding of missing renditions (library/transcoding.py, run
+# by the transcode_audio command). AUDIO_TRANSCODER names a
+# library.transcoding.Transcoder; StubTranscoder copies files unchanged.
+AUDIO_TRANSCODER = 'library.transcoding.FFmpegTranscoder'
+AUDIO_TRANSCODE_TEMP_DIR = os.path.join(BASE_DIR, 'transcode_tmp')
+AUDIO_JOB_MAX_ATTEMPTS = 3
+AUDIO_JOB_RETRY_DELAY = 60
+AUDIO_JOB_TIMEOUT = 60 * 60
+
+# Up-next manifests (library/up_next.py) list at most UP_NEXT_MAX_TRACKS
+# tracks, each with the byte range of its first UP_NEXT_PREFETCH_SECONDS
+UP_NEXT_MAX_TRACKS = 20
+UP_NEXT_PREFETCH_SECONDS = 10
+
+# Waveform peaks for seek bars (library/waveform.py, computed by the
+# compute_waveforms command): WAVEFORM_BUCKETS (min, max) pairs per song,
+# from audio decoded at WAVEFORM_SAMPLE_RATE
+WAVEFORM_BUCKETS = 1000
+WAVEFORM_SAMPLE_RATE = 8000
+WAVEFORM_CACHE_MAX_AGE = 24 * 60 * 60
+
+# Fixed-size renditions of all artwork (library/thumbnails.py), by longest
+# side, each also encoded in the IMAGE_VARIANT_FORMATS this Pillow build can
+# write; the smallest one the client's Accept header allows is sent
+THUMBNAIL_SIZES = (64, 256, 640)
+IMAGE_VARIANT_FORMATS = ('AVIF', 'WEBP')
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=12),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
@@ -0,0 +1,18 @@
+"""
+Text helpers shared by the apps.
+"""
+import unicodedata
+
+# Letters that carry no combining mark in Unicode and survive NFD
+_EXTRA_FOLDS = str.maketrans({'đ': 'd', 'Đ': 'D'})
+
+
+def normalize_text(value):
+    """
+    Strip accents, case-fold and collapse whitespace: "Sơn Tùng" -> "son tung"
+    """
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFD', value.translate(_EXTRA_FOLDS))
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
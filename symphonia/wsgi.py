@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'symphonia.settings')
 
 application = get_wsgi_application()
+
+# Load the in-memory autocomplete index before the first request needs it
+from library.autocomplete import prefix_index  # noqa: E402
+
+prefix_index.warm_up()